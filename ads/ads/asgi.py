@@ -13,4 +13,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ads.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Importé après l'initialisation de Django (modèles, schéma)
+from partenaire.websocket import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Abonnements GraphQL en WebSocket (SUBSCRIPTION_PATH), le reste est servi par Django
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
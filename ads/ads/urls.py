@@ -2,16 +2,21 @@
 from django.contrib import admin
 from django.urls import path
 from django.conf import settings
-from graphene_file_upload.django import FileUploadGraphQLView
 from django.views.decorators.csrf import csrf_exempt
 from graphql_jwt.decorators import jwt_cookie
 from django.conf.urls.static import static
+from partenaire.views import AsyncGraphQLView, GraphQLView, avatar_view, impressions_view, metrics_view
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql/', csrf_exempt(FileUploadGraphQLView.as_view(graphiql=True))),
-    path('graphql/jwt/', csrf_exempt(jwt_cookie(FileUploadGraphQLView.as_view(graphiql=True)))),
+    path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path('graphql/jwt/', csrf_exempt(jwt_cookie(GraphQLView.as_view(graphiql=True)))),
+    # Exécution asynchrone, à servir via ads.asgi (uvicorn, daphne...)
+    path('graphql/async/', csrf_exempt(AsyncGraphQLView.as_view())),
+    path('metrics/', metrics_view),
+    path('impressions/', csrf_exempt(impressions_view)),
+    path('avatars/<int:user_id>/', avatar_view, name='avatar'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,73 @@
+"""
+Coût de l'authentification JWT sur une requête de 200 champs (user-025) : 20 utilisateurById
+avec alias x 10 champs, jeton dans l'en-tête Authorization.
+
+    python -m bench.auth [--number 300]
+
+Mesures : sans middleware d'authentification, middleware de graphql_jwt (vérification au
+premier champ, contrôles à chaque champ), partenaire.jwt_auth sans puis avec le cache
+jeton -> utilisateur.
+"""
+import argparse
+from unittest import mock
+
+from .common import best_of, graphql, table, test_database
+
+FIELDS = 'id nom prenom email role actif contact pays ville icone'
+
+
+def query(user_id, count=20):
+    return '{ ' + ' '.join(f'u{i}: utilisateurById(id: {user_id}) {{ {FIELDS} }}' for i in range(count)) + ' }'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=300)
+    args = parser.parse_args()
+
+    with test_database():
+        from django.contrib.auth.models import User
+        from graphene_django.settings import graphene_settings
+        from graphql_jwt.middleware import JSONWebTokenMiddleware as GraphqlJWTMiddleware
+        from graphql_jwt.shortcuts import get_token
+        from partenaire.jwt_auth import JSONWebTokenMiddleware, token_cache
+        from partenaire.models import Utilisateur
+
+        utilisateur = Utilisateur.objects.create(nom='Nom', prenom='Prénom', email='bench@example.com', role='client')
+        text = query(utilisateur.pk)
+        headers = {'HTTP_AUTHORIZATION': f'JWT {get_token(User.objects.create_user("bench"))}'}
+        others = [cls for cls in graphene_settings.MIDDLEWARE if cls is not JSONWebTokenMiddleware]
+
+        def run(middleware, before=None):
+            def request():
+                if before:
+                    before()
+                graphql(text, **headers)
+
+            with mock.patch.object(graphene_settings, 'MIDDLEWARE', middleware + others):
+                request()
+                return best_of(request, repeat=5, number=args.number)
+
+        baseline = run([])
+        with mock.patch('django.conf.settings.AUTHENTICATION_BACKENDS', [
+            'graphql_jwt.backends.JSONWebTokenBackend', 'django.contrib.auth.backends.ModelBackend',
+        ]):
+            graphql_jwt = run([GraphqlJWTMiddleware])
+        cold = run([JSONWebTokenMiddleware], before=token_cache.clear)
+        warm = run([JSONWebTokenMiddleware])
+
+        rows = [
+            [label, f'{seconds * 1000:.2f}', f'{(seconds - baseline) * 1000:+.2f}']
+            for label, seconds in (
+                ('sans middleware', baseline),
+                ('graphql_jwt', graphql_jwt),
+                ('jwt_auth, cache vide', cold),
+                ('jwt_auth, cache chaud', warm),
+            )
+        ]
+        print(f'200 champs, meilleure de 5 séries de {args.number} requêtes')
+        table(['authentification', 'ms / requête', 'écart ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
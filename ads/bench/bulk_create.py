@@ -0,0 +1,49 @@
+"""
+bulkCreateCampaigns face à createCampaign appelé campagne par campagne (user-005).
+
+    python -m bench.bulk_create [--campaigns 5] [--displays 200]
+"""
+import argparse
+
+from .common import graphql, table, test_database, timed
+
+CREATE = '''mutation ($name: String!, $displays: [Int]) {
+    createCampaign(campaignName: $name, idDisplays: $displays) { campaign { id } }
+}'''
+
+BULK_CREATE = '''mutation ($campaigns: [CampaignInput!]!) {
+    bulkCreateCampaigns(campaigns: $campaigns) { ok results { ok } }
+}'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--campaigns', type=int, default=5)
+    parser.add_argument('--displays', type=int, default=200)
+    args = parser.parse_args()
+
+    with test_database():
+        from partenaire.models import Display
+
+        Display.objects.bulk_create(Display(display_name=f'Display {i}') for i in range(args.displays))
+        display_ids = list(Display.objects.values_list('pk', flat=True))
+
+        def per_row():
+            for i in range(args.campaigns):
+                graphql(CREATE, {'name': f'Campagne {i}', 'displays': display_ids})
+
+        def bulk():
+            campaigns = [{'campaignName': f'Campagne {i}', 'idDisplays': display_ids} for i in range(args.campaigns)]
+            body = graphql(BULK_CREATE, {'campaigns': campaigns})
+            assert body['data']['bulkCreateCampaigns']['ok']
+
+        rows = []
+        for name, fn in [('createCampaign x N', per_row), ('bulkCreateCampaigns', bulk)]:
+            _, elapsed, queries = timed(fn)
+            rows.append([name, f'{elapsed * 1000:.1f}', queries])
+        print(f'{args.campaigns} campagnes x {args.displays} displays')
+        table(['chemin', 'ms', 'requêtes SQL'], rows)
+
+
+if __name__ == '__main__':
+    main()
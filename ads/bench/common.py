@@ -0,0 +1,97 @@
+"""
+Outils communs des benchmarks, lancés depuis le dossier du projet : python -m bench.<nom>
+
+Chaque benchmark tourne sur une base jetable, créée et détruite comme par `manage.py test` :
+un fichier SQLite temporaire par défaut, une base test_<nom> sur le serveur PostgreSQL si
+DATABASE_URL est défini (voir ads/settings.py).
+"""
+import contextlib
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ads.settings')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment  # noqa: E402
+
+
+@contextlib.contextmanager
+def test_database():
+    """Base (et stockage des médias) jetables, sans cache de réponses ni traçage."""
+    tmp = tempfile.mkdtemp(prefix='bench-')
+    database = settings.DATABASES['default']
+    if database['ENGINE'] == 'django.db.backends.sqlite3':
+        # Un fichier plutôt que la base en mémoire des tests : mesures proches de la production
+        database.setdefault('TEST', {})['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+    settings.DEBUG = False
+    settings.MEDIA_ROOT = os.path.join(tmp, 'media')
+    settings.GRAPHQL_RESPONSE_CACHE_ALIAS = None
+    settings.GRAPHQL_TRACING_SAMPLE_RATE = 0
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def graphql(query, variables=None, path='/graphql/', client=None, **headers):
+    """POST d'une opération GraphQL ; renvoie le corps décodé, erreurs GraphQL levées."""
+    response = (client or Client()).post(
+        path, json.dumps({'query': query, 'variables': variables or {}}),
+        content_type='application/json', **headers,
+    )
+    body = response.json()
+    if body.get('errors'):
+        raise RuntimeError(body['errors'])
+    return body
+
+
+def timed(fn):
+    """Renvoie (résultat, durée en secondes, nombre de requêtes SQL) d'un appel de fn."""
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+    return result, elapsed, len(queries.captured_queries)
+
+
+def best_of(fn, repeat=5, number=1):
+    """Durée moyenne (secondes) d'un appel de fn, meilleure série sur `repeat`."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def median(values):
+    return statistics.median(values)
+
+
+def table(headers, rows):
+    """Affiche un tableau aligné (une ligne par mesure)."""
+    rows = [[str(cell) for cell in row] for row in rows]
+    widths = [max(len(str(header)), *(len(row[i]) for row in rows)) for i, header in enumerate(headers)]
+    print('  '.join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
@@ -0,0 +1,99 @@
+"""
+Débit de /impressions/ (user-016) : événements acceptés par seconde (authentification du
+display, contrôle des couples, journal sur disque), puis écriture en base par le flush.
+
+    python -m bench.impressions [--displays 50] [--batch 500] [--requests 100]
+
+Chaque display envoie ses lots avec sa clé ; un lot répète les couples (campagne, display)
+du display. Mesuré avec et sans fsync du journal (IMPRESSION_WAL_FSYNC).
+"""
+import argparse
+import json
+import shutil
+import tempfile
+import time
+
+from .common import table, test_database
+
+
+def seed(displays, campaigns_per_display):
+    from partenaire.impressions import display_key_hash
+    from partenaire.models import Campaign, CampaignDisplay, Display
+
+    created = Display.objects.bulk_create(
+        Display(display_name=f'Display {i}', cle_impressions=display_key_hash(f'cle-{i}')) for i in range(displays)
+    )
+    campaigns = Campaign.objects.bulk_create(
+        Campaign(campaign_name=f'Campagne {i}') for i in range(campaigns_per_display)
+    )
+    CampaignDisplay.objects.bulk_create(
+        CampaignDisplay(id_campaign=campaign, id_display=display) for display in created for campaign in campaigns
+    )
+    return [(f'cle-{i}', display.pk) for i, display in enumerate(created)], [campaign.pk for campaign in campaigns]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--displays', type=int, default=50)
+    parser.add_argument('--campaigns', type=int, default=10, help="campagnes diffusées par display")
+    parser.add_argument('--batch', type=int, default=500, help="événements par requête")
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    with test_database():
+        from django.conf import settings
+        from django.test import Client
+        from partenaire.impressions import buffer
+        from partenaire.models import CampaignDisplay
+
+        wal_dir = tempfile.mkdtemp(prefix='bench-wal-')
+        settings.IMPRESSION_WAL_DIR = wal_dir
+        # Flush déclenché par le benchmark seulement, pas pendant la mesure de la réception
+        settings.IMPRESSION_FLUSH_INTERVAL = 3600
+        settings.IMPRESSION_MAX_PENDING_PAIRS = 10 ** 9
+        displays, campaigns = seed(args.displays, args.campaigns)
+        bodies = [
+            (key, json.dumps({'events': [
+                {'campaign': campaigns[i % len(campaigns)], 'display': display, 'count': 1}
+                for i in range(args.batch)
+            ]}))
+            for key, display in displays
+        ]
+        client = Client()
+        rows = []
+        total = 0
+        try:
+            for fsync in (True, False):
+                settings.IMPRESSION_WAL_FSYNC = fsync
+                start = time.perf_counter()
+                for i in range(args.requests):
+                    key, body = bodies[i % len(bodies)]
+                    response = client.post(
+                        '/impressions/', body, content_type='application/json', headers={'authorization': f'Display {key}'},
+                    )
+                    if response.status_code != 202:
+                        raise RuntimeError(f'{response.status_code} {response.content[:300]!r}')
+                elapsed = time.perf_counter() - start
+                events = args.requests * args.batch
+                total += events
+                rows.append([
+                    f'réception (fsync {"oui" if fsync else "non"})', events,
+                    f'{elapsed / args.requests * 1000:.2f}', f'{events / elapsed:.0f}',
+                ])
+
+                start = time.perf_counter()
+                flushed = buffer.flush()
+                elapsed = time.perf_counter() - start
+                rows.append(['flush en base', flushed, f'{elapsed * 1000:.2f}', f'{flushed / elapsed:.0f}'])
+        finally:
+            shutil.rmtree(wal_dir, ignore_errors=True)
+
+        stored = sum(CampaignDisplay.objects.values_list('nombre_affichages', flat=True))
+        if stored != total:
+            raise RuntimeError(f'{stored} impressions en base, {total} envoyées')
+        print(f'{args.displays} displays, {args.campaigns} campagnes par display, lots de {args.batch}')
+        table(['étape', 'événements', 'ms / appel', 'événements / s'], rows)
+
+
+if __name__ == '__main__':
+    main()
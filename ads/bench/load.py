@@ -0,0 +1,187 @@
+"""
+Charge sur /graphql/ (WSGI) et /graphql/async/ (ASGI) : requêtes par seconde et latences p50 / p99
+(user-010).
+
+    python -m bench.load [--requests 400] [--concurrency 16] [--campaigns 200]
+    python -m bench.load --url http://127.0.0.1:8000     # serveurs lancés à part, base existante
+
+Sans --url, les deux applications tournent dans ce processus, sur une base jetable : la vue
+WSGI est appelée par `concurrency` threads (serveur WSGI multi-thread), la vue ASGI par autant
+de tâches dans une seule boucle d'événements (serveur ASGI).
+"""
+import argparse
+import asyncio
+import io
+import json
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import median, percentile, table, test_database
+
+QUERIES = {
+    'list': '''{ allCampaigns(first: 50) { edges { node {
+        campaignName status idUtilisateurCreateur { nom }
+        campaigndisplaySet { idDisplay { displayName } }
+    } } } }''',
+    'byid': '{ campaignById(id: 1) { campaignName idUtilisateurCreateur { nom prenom } } }',
+}
+
+
+def _wsgi_call(application, path, body):
+    environ = {
+        'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver', 'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    status = []
+    result = application(environ, lambda line, headers, exc_info=None: status.append(line))
+    try:
+        content = b''.join(result)
+    finally:
+        getattr(result, 'close', lambda: None)()
+    return int(status[0].split()[0]), content
+
+
+async def _asgi_call(application, path, body):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    received = False
+    response = {'body': b''}
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # Pas de déconnexion du client : Django annule cette attente en fin de réponse
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['body'] += message.get('body', b'')
+
+    await application(scope, receive, send)
+    return response['status'], response['body']
+
+
+def _check(status, content):
+    if status != 200 or b'"errors"' in content:
+        raise RuntimeError(f'{status} {content[:300]!r}')
+
+
+def run_threads(call, requests, concurrency):
+    """`requests` appels de call() répartis sur `concurrency` threads ; renvoie (durée, latences)."""
+    def timed(_):
+        start = time.perf_counter()
+        _check(*call())
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(timed, range(requests)))
+    return time.perf_counter() - start, latencies
+
+
+async def run_tasks(call, requests, concurrency):
+    """`requests` appels de call() par `concurrency` tâches concurrentes ; renvoie (durée, latences)."""
+    remaining = iter(range(requests))
+    latencies = []
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            _check(*await call())
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+
+def _row(name, query, elapsed, latencies):
+    return [
+        name, query, f'{len(latencies) / elapsed:.0f}',
+        f'{median(latencies) * 1000:.1f}', f'{percentile(latencies, 99) * 1000:.1f}',
+    ]
+
+
+def seed(campaigns):
+    from partenaire.models import Campaign, CampaignDisplay, Display, Utilisateur
+
+    createur = Utilisateur.objects.create(nom='Nom', prenom='Prénom', email='bench@example.com', role='client')
+    Campaign.objects.bulk_create(
+        Campaign(campaign_name=f'Campagne {i}', id_utilisateur_createur=createur) for i in range(campaigns)
+    )
+    Display.objects.bulk_create(Display(display_name=f'Display {i}') for i in range(campaigns))
+    CampaignDisplay.objects.bulk_create(
+        CampaignDisplay(id_campaign_id=campaign_id, id_display_id=display_id)
+        for campaign_id, display_id in zip(
+            Campaign.objects.values_list('pk', flat=True), Display.objects.values_list('pk', flat=True),
+        )
+    )
+
+
+def in_process(args):
+    with test_database():
+        from ads.asgi import application as asgi_application
+        from ads.wsgi import application as wsgi_application
+
+        seed(args.campaigns)
+        rows = []
+        for name, query in QUERIES.items():
+            body = json.dumps({'query': query}).encode()
+            _check(*_wsgi_call(wsgi_application, '/graphql/', body))
+            elapsed, latencies = run_threads(
+                lambda: _wsgi_call(wsgi_application, '/graphql/', body), args.requests, args.concurrency,
+            )
+            rows.append(_row('WSGI /graphql/', name, elapsed, latencies))
+            elapsed, latencies = asyncio.run(run_tasks(
+                lambda: _asgi_call(asgi_application, '/graphql/async/', body), args.requests, args.concurrency,
+            ))
+            rows.append(_row('ASGI /graphql/async/', name, elapsed, latencies))
+        return rows
+
+
+def remote(args):
+    def post(path, body):
+        request = urllib.request.Request(
+            args.url.rstrip('/') + path, data=body, headers={'Content-Type': 'application/json'},
+        )
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read()
+
+    rows = []
+    for name, query in QUERIES.items():
+        body = json.dumps({'query': query}).encode()
+        for path in ('/graphql/', '/graphql/async/'):
+            elapsed, latencies = run_threads(lambda: post(path, body), args.requests, args.concurrency)
+            rows.append(_row(path, name, elapsed, latencies))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--campaigns', type=int, default=200)
+    parser.add_argument('--url', help="serveur à mesurer (WSGI et ASGI derrière la même URL)")
+    args = parser.parse_args()
+
+    rows = remote(args) if args.url else in_process(args)
+    print(f'{args.requests} requêtes, concurrence {args.concurrency}')
+    table(['vue', 'requête', 'req/s', 'p50 ms', 'p99 ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Débit de loginUtilisateur sous concurrence (user-009) : PBKDF2 dans le thread de requête
+(ancien chemin), dans le pool de processus, puis connexions répétées servies par le cache.
+
+    python -m bench.login [--threads 8] [--logins 32]
+
+Les connexions refusées par la limite du pool (LOGIN_QUEUE_TIMEOUT) sont comptées à part.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from .common import graphql, table, test_database
+
+LOGIN = '''mutation ($email: String!, $password: String!) {
+    loginUtilisateur(email: $email, motDePasse: $password) { ok message }
+}'''
+
+
+def _inline_verify(email, raw_password, encoded):
+    # Ancien chemin : vérification dans le thread de la requête
+    from partenaire.auth import _verify
+    return _verify(raw_password, encoded)
+
+
+def run(emails, threads):
+    """Connexions en parallèle ; renvoie [débit des connexions réussies (par s), refusées]."""
+    from django.db import connection
+
+    def login(email):
+        try:
+            return graphql(LOGIN, {'email': email, 'password': 'secret'})['data']['loginUtilisateur']['ok']
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(login, emails))
+    elapsed = time.perf_counter() - start
+    return [f'{results.count(True) / elapsed:.1f}', results.count(False)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=32)
+    args = parser.parse_args()
+
+    with test_database():
+        from django.conf import settings
+        from django.contrib.auth.hashers import make_password
+        from partenaire.auth import verify_password
+        from partenaire.models import Utilisateur
+
+        encoded = make_password('secret')
+        Utilisateur.objects.bulk_create(
+            Utilisateur(nom='Nom', prenom='Prénom', email=f'user{i}@example.com', role='client', mot_de_passe=encoded)
+            for i in range(args.logins * 2)
+        )
+        emails = [f'user{i}@example.com' for i in range(args.logins * 2)]
+        # Démarre les processus du pool avant la mesure
+        verify_password('warmup@example.com', 'secret', encoded)
+
+        rows = []
+        with mock.patch('partenaire.mutations.verify_password', _inline_verify):
+            rows.append(['thread de requête', *run(emails[:args.logins], args.threads)])
+        rows.append([f'pool ({settings.LOGIN_HASH_WORKERS} processus)', *run(emails[args.logins:], args.threads)])
+        rows.append(['pool, cache', *run(emails[args.logins:], args.threads)])
+        print(f'{args.logins} connexions, {args.threads} threads')
+        table(['vérification', 'connexions/s', 'refusées'], rows)
+
+
+if __name__ == '__main__':
+    main()
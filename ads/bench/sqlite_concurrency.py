@@ -0,0 +1,137 @@
+"""
+Lectures et écritures concurrentes sur SQLite (user-020), mode par défaut puis mode
+performance (SQLITE_PERFORMANCE_MODE=1 : WAL, pragmas, BEGIN IMMEDIATE, mutations sérialisées).
+
+    python -m bench.sqlite_concurrency [--processes 2] [--threads 4] [--seconds 5]
+
+Comme des workers WSGI : `processes` processus écrivains (updateCampaign) et autant de
+processus lecteurs (allCampaigns), chacun avec `threads` threads, sur une copie de la même
+base pour chaque mode. Les échecs (« database is locked ») sont comptés à part.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+READ = '{ allCampaigns(first: 20) { edges { node { campaignName status idUtilisateurCreateur { nom } } } } }'
+WRITE = '''mutation ($id: Int!, $name: String) {
+    updateCampaign(id: $id, campaignName: $name) { campaign { id } }
+}'''
+
+
+def worker(role, database, seconds, threads, campaigns):
+    """Processus de mesure : affiche {"ok": n, "errors": n} sur la sortie standard."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .common import graphql
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    # Client de test : hôte « testserver » autorisé
+    setup_test_environment()
+    settings.DATABASES['default']['NAME'] = database
+    settings.DEBUG = False
+    settings.GRAPHQL_RESPONSE_CACHE_ALIAS = None
+    settings.GRAPHQL_TRACING_SAMPLE_RATE = 0
+    deadline = time.monotonic() + seconds
+
+    def loop(index):
+        ok = errors = 0
+        try:
+            while time.monotonic() < deadline:
+                try:
+                    if role == 'write':
+                        graphql(WRITE, {'id': (index + ok) % campaigns + 1, 'name': f'Campagne {ok}'})
+                    else:
+                        graphql(READ)
+                    ok += 1
+                except Exception:
+                    errors += 1
+        finally:
+            connection.close()
+        return ok, errors
+
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(loop, range(threads)))
+    print(json.dumps({'ok': sum(ok for ok, _ in results), 'errors': sum(errors for _, errors in results)}))
+
+
+def run_mode(performance, database, args):
+    env = {**os.environ, 'SQLITE_PERFORMANCE_MODE': '1' if performance else '0'}
+    env.pop('DATABASE_URL', None)
+    command = [
+        sys.executable, '-m', 'bench.sqlite_concurrency', '--database', database, '--seconds', str(args.seconds),
+        '--threads', str(args.threads), '--campaigns', str(args.campaigns),
+    ]
+    processes = [
+        (role, subprocess.Popen(command + ['--worker', role], env=env, stdout=subprocess.PIPE, text=True))
+        for role in ('write', 'read') for _ in range(args.processes)
+    ]
+    totals = {'write': [0, 0], 'read': [0, 0]}
+    for role, process in processes:
+        output, _ = process.communicate()
+        if process.returncode:
+            raise RuntimeError(f'processus {role} en échec ({process.returncode})')
+        result = json.loads(output.strip().splitlines()[-1])
+        totals[role][0] += result['ok']
+        totals[role][1] += result['errors']
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--campaigns', type=int, default=200)
+    parser.add_argument('--worker', choices=['read', 'write'])
+    parser.add_argument('--database')
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.database, args.seconds, args.threads, args.campaigns)
+        return
+
+    from .common import table, test_database
+
+    from django.db import connection
+
+    if connection.vendor != 'sqlite':
+        raise SystemExit('Benchmark SQLite : lancer sans DATABASE_URL')
+    with test_database():
+        from partenaire.models import Campaign, Utilisateur
+
+        createur = Utilisateur.objects.create(nom='Nom', prenom='Prénom', email='bench@example.com', role='client')
+        Campaign.objects.bulk_create(
+            Campaign(campaign_name=f'Campagne {i}', id_utilisateur_createur=createur) for i in range(args.campaigns)
+        )
+        source = connection.settings_dict['NAME']
+        connection.close()
+        tmp = tempfile.mkdtemp(prefix='bench-sqlite-')
+        rows = []
+        try:
+            for performance in (False, True):
+                # Copie par mode : le mode performance laisse la base en journal WAL
+                database = os.path.join(tmp, f'{"performance" if performance else "defaut"}.sqlite3')
+                shutil.copy(source, database)
+                totals = run_mode(performance, database, args)
+                for role, label in (('write', 'écritures'), ('read', 'lectures')):
+                    ok, errors = totals[role]
+                    rows.append([
+                        'performance' if performance else 'défaut', label, f'{ok / args.seconds:.0f}', errors,
+                    ])
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    print(f'{args.processes} processus écrivains et {args.processes} lecteurs, {args.threads} threads chacun, '
+          f'{args.seconds:g} s')
+    table(['mode', 'opérations', 'par seconde', 'échecs'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Coût du traçage des requêtes GraphQL (user-014) : sans traçage (ni TracingMiddleware ni
+wrapper SQL), échantillonnage à 0 (réglage de production sans traçage), puis à 1.
+
+    python -m bench.tracing [--campaigns 50] [--number 50]
+
+Le surcoût à 0 est celui payé par toutes les requêtes non échantillonnées : un appel du
+middleware par champ résolu et un appel du wrapper par requête SQL.
+"""
+import argparse
+import contextlib
+import logging
+from unittest import mock
+
+from .common import best_of, graphql, table, test_database
+
+QUERIES = {
+    'list': '''{ allCampaigns(first: 50) { edges { node {
+        campaignName status idUtilisateurCreateur { nom prenom }
+        campaigndisplaySet { idDisplay { displayName } }
+    } } } }''',
+    'byid': '{ campaignById(id: 1) { campaignName idUtilisateurCreateur { nom } } }',
+}
+
+
+def seed(campaigns):
+    from partenaire.models import Campaign, CampaignDisplay, Display, Utilisateur
+
+    createur = Utilisateur.objects.create(nom='Nom', prenom='Prénom', email='bench@example.com', role='client')
+    for i in range(campaigns):
+        campaign = Campaign.objects.create(campaign_name=f'Campagne {i}', id_utilisateur_createur=createur)
+        display = Display.objects.create(display_name=f'Display {i}')
+        CampaignDisplay.objects.create(id_campaign=campaign, id_display=display)
+
+
+@contextlib.contextmanager
+def untraced():
+    """Ni TracingMiddleware dans le schéma, ni wrapper SQL sur la connexion."""
+    from django.db import connection
+    from graphene_django.settings import graphene_settings
+    from partenaire import tracing
+
+    middleware = [cls for cls in graphene_settings.MIDDLEWARE if cls is not tracing.TracingMiddleware]
+    connection.ensure_connection()
+    connection.execute_wrappers.remove(tracing._execute_sql)
+    try:
+        with mock.patch.object(graphene_settings, 'MIDDLEWARE', middleware):
+            yield
+    finally:
+        connection.execute_wrappers.insert(0, tracing._execute_sql)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--campaigns', type=int, default=50)
+    parser.add_argument('--number', type=int, default=50)
+    args = parser.parse_args()
+
+    with test_database():
+        from django.conf import settings
+
+        seed(args.campaigns)
+        # Traces journalisées à chaque requête échantillonnée : hors mesure
+        logging.getLogger('partenaire.tracing').disabled = True
+        rows = []
+        for name, query in QUERIES.items():
+            graphql(query)
+
+            def run():
+                return best_of(lambda: graphql(query), repeat=5, number=args.number)
+
+            with untraced():
+                baseline = run()
+            settings.GRAPHQL_TRACING_SAMPLE_RATE = 0
+            sampled_out = run()
+            settings.GRAPHQL_TRACING_SAMPLE_RATE = 1
+            traced = run()
+            settings.GRAPHQL_TRACING_SAMPLE_RATE = 0
+            for label, seconds in (('sans traçage', baseline), ('échantillon 0', sampled_out), ('échantillon 1', traced)):
+                rows.append([
+                    name, label, f'{seconds * 1000:.2f}', f'{(seconds / baseline - 1) * 100:+.1f} %',
+                ])
+        table(['requête', 'configuration', 'ms / requête', 'surcoût'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,3 +4,22 @@ from django.apps import AppConfig
 class PartenaireConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'partenaire'
+
+    def ready(self):
+        # Enregistre les handlers des tâches de fond
+        from . import blobs, images  # noqa: F401
+        from . import jwt_auth, persisted, playlist, pubsub, response_cache, sync, tracing
+        # Invalidation du cache des réponses GraphQL à chaque écriture
+        response_cache.connect_signals()
+        # Mise à jour de l'index des playlists des displays
+        playlist.connect_signals()
+        # Changements diffusés aux abonnements GraphQL
+        pubsub.connect_signals()
+        # Journal des changements de changesSince
+        sync.connect_signals()
+        # Jetons JWT déjà vérifiés d'un utilisateur (auth) oubliés quand il change
+        jwt_auth.connect_signals()
+        # Requête persistée supprimée : de nouveau refusée
+        persisted.connect_signals()
+        # Requêtes SQL attribuées aux resolvers des opérations tracées
+        tracing.connect_signals()
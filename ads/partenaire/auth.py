@@ -0,0 +1,166 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.utils.crypto import constant_time_compare
+
+
+class LoginThrottled(Exception):
+    pass
+
+
+def _init_worker():
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ads.settings')
+    django.setup()
+
+
+def _verify(raw_password, encoded):
+    """
+    Exécuté dans un processus du pool. Renvoie (ok, nouveau_hash) : nouveau_hash est fourni
+    quand le mot de passe stocké doit être (re)hashé (texte clair historique, hasher obsolète).
+    """
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        # Ancien mot de passe stocké en clair
+        if constant_time_compare(raw_password, encoded):
+            return True, make_password(raw_password)
+        return False, None
+    if not check_password(raw_password, encoded):
+        return False, None
+    return True, make_password(raw_password) if hasher.must_update(encoded) else None
+
+
+class _Verifier:
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(settings.LOGIN_HASH_WORKERS * 4)
+        self._per_email = {}
+        self._failures = OrderedDict()
+        self._cache = OrderedDict()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.LOGIN_HASH_WORKERS, initializer=_init_worker,
+                )
+            return self._executor
+
+    def _cache_key(self, email, encoded, raw_password):
+        # Empreinte rapide (HMAC) d'un couple déjà vérifié ; inclut le hash stocké
+        # pour qu'un changement de mot de passe invalide l'entrée.
+        key = f'{email}\0{encoded}'.encode()
+        proof = hmac.new(settings.SECRET_KEY.encode(), key + b'\0' + raw_password.encode(), hashlib.sha256)
+        return key, proof.hexdigest()
+
+    def _cached(self, key, proof):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return False
+            if entry[1] < time.monotonic():
+                del self._cache[key]
+                return False
+            return hmac.compare_digest(entry[0], proof)
+
+    def _remember(self, key, proof):
+        with self._lock:
+            self._cache[key] = (proof, time.monotonic() + settings.LOGIN_CACHE_TTL)
+            self._cache.move_to_end(key)
+            while len(self._cache) > settings.LOGIN_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def _enter(self, email):
+        with self._lock:
+            count = self._per_email.get(email, 0)
+            if count >= settings.LOGIN_MAX_CONCURRENT_PER_EMAIL:
+                raise LoginThrottled("Trop de tentatives de connexion simultanées pour cet email")
+            self._per_email[email] = count + 1
+
+    def _leave(self, email):
+        with self._lock:
+            count = self._per_email.get(email, 1) - 1
+            if count:
+                self._per_email[email] = count
+            else:
+                self._per_email.pop(email, None)
+
+    def _check_failures(self, email):
+        with self._lock:
+            entry = self._failures.get(email)
+            if entry is None:
+                return
+            if entry[1] < time.monotonic():
+                del self._failures[email]
+            elif entry[0] >= settings.LOGIN_MAX_FAILURES:
+                raise LoginThrottled("Trop d'échecs de connexion pour cet email, réessayez plus tard")
+
+    def _record(self, email, ok):
+        # Échecs comptés par email sur une fenêtre fixe ; une connexion réussie remet le compteur à zéro
+        with self._lock:
+            if ok:
+                self._failures.pop(email, None)
+                return
+            count, expires = self._failures.get(email, (0, time.monotonic() + settings.LOGIN_FAILURE_WINDOW))
+            self._failures[email] = (count + 1, expires)
+            self._failures.move_to_end(email)
+            while len(self._failures) > settings.LOGIN_CACHE_SIZE:
+                self._failures.popitem(last=False)
+
+    def verify(self, email, raw_password, encoded):
+        self._check_failures(email)
+        if not encoded:
+            self._record(email, False)
+            return False, None
+        key, proof = self._cache_key(email, encoded, raw_password)
+        if self._cached(key, proof):
+            self._record(email, True)
+            return True, None
+
+        self._enter(email)
+        try:
+            if not self._slots.acquire(timeout=settings.LOGIN_QUEUE_TIMEOUT):
+                raise LoginThrottled("Serveur de connexion saturé, réessayez")
+            try:
+                try:
+                    ok, new_encoded = self._pool().submit(_verify, raw_password, encoded).result()
+                except BrokenProcessPool:
+                    with self._lock:
+                        self._executor = None
+                    ok, new_encoded = _verify(raw_password, encoded)
+            finally:
+                self._slots.release()
+        finally:
+            self._leave(email)
+
+        self._record(email, ok)
+        if ok and new_encoded is None:
+            self._remember(key, proof)
+        return ok, new_encoded
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def verify_password(email, raw_password, encoded):
+    """
+    Vérifie un mot de passe hors du thread de requête (pool de processus borné).
+    Lève LoginThrottled si trop de vérifications sont en cours, ou après LOGIN_MAX_FAILURES
+    échecs pour cet email dans la fenêtre LOGIN_FAILURE_WINDOW.
+    """
+    global _verifier
+    with _verifier_lock:
+        if _verifier is None:
+            _verifier = _Verifier()
+    return _verifier.verify(email, raw_password, encoded)
@@ -0,0 +1,76 @@
+import base64
+import binascii
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image as PILImage
+
+from .blobs import hash_file
+
+
+class AvatarError(Exception):
+    pass
+
+
+def decode_picture(value):
+    """Contenu d'une photo envoyée en base64 (avec ou sans préfixe data:image/...;base64,)."""
+    if ',' in value and value.startswith('data:'):
+        value = value.split(',', 1)[1]
+    try:
+        return base64.b64decode(value, validate=False)
+    except (binascii.Error, ValueError):
+        raise AvatarError("Photo base64 invalide")
+
+
+# Formats acceptés, détectés par PIL : extension du fichier stocké et Content-Type servi
+AVATAR_FORMATS = {
+    'JPEG': ('.jpg', 'image/jpeg'),
+    'PNG': ('.png', 'image/png'),
+    'GIF': ('.gif', 'image/gif'),
+    'WEBP': ('.webp', 'image/webp'),
+}
+# .jpeg : photos stockées avant que l'extension ne soit normalisée
+AVATAR_CONTENT_TYPES = {**dict(AVATAR_FORMATS.values()), '.jpeg': 'image/jpeg'}
+
+
+def _extension(file):
+    """Extension tirée du format détecté dans le contenu, jamais du nom envoyé par le client."""
+    try:
+        with PILImage.open(file) as image:
+            image_format = image.format
+            image.verify()
+    except Exception:
+        # UnidentifiedImageError, fichier tronqué ou corrompu, bombe de décompression...
+        raise AvatarError("Le contenu de la photo n'est pas une image")
+    finally:
+        file.seek(0)
+    if image_format not in AVATAR_FORMATS:
+        raise AvatarError(f"Format de photo non accepté : {', '.join(AVATAR_FORMATS)}")
+    return AVATAR_FORMATS[image_format][0]
+
+
+def avatar_content_type(name):
+    """Content-Type servi pour une photo stockée, ou None si son extension n'est pas celle d'un format accepté."""
+    return AVATAR_CONTENT_TYPES.get(os.path.splitext(name)[1].lower())
+
+
+def store_avatar(utilisateur, content=None, file=None):
+    """
+    Enregistre la photo (octets `content` ou fichier uploadé `file`) dans le stockage des
+    médias sous un nom adressé par le contenu (avatars/ab/<sha256>.<ext>) et la rattache à
+    `utilisateur`, sans le sauvegarder. Un contenu déjà stocké n'est pas réécrit.
+    """
+    if file is None:
+        file = ContentFile(content)
+    digest = hash_file(file)
+    name = f'avatars/{digest[:2]}/{digest}{_extension(file)}'
+    if not default_storage.exists(name):
+        name = default_storage.save(name, file)
+    utilisateur.picture.name = name
+    return name
+
+
+def avatar_etag(name):
+    # Le nom contient le SHA-256 du contenu
+    return os.path.splitext(os.path.basename(name))[0]
@@ -0,0 +1,179 @@
+import hashlib
+import os
+import uuid
+from datetime import timedelta
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .jobs import enqueue, register
+from .models import Campaign, CampaignImage, Image, ImageUpload, ImageVariant
+from .playlist import playlist_index
+from .pubsub import CAMPAIGN, publish
+from .response_cache import invalidate
+from .sync import record_changes
+
+
+def hash_file(file):
+    """SHA-256 du fichier, calculé morceau par morceau."""
+    digest = hashlib.sha256()
+    for piece in file.chunks():
+        digest.update(piece)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+class HashingFile(File):
+    """Fichier dont le SHA-256 est calculé au fil de sa lecture par le stockage."""
+
+    def __init__(self, file, name=None):
+        super().__init__(file, name)
+        self._digest = hashlib.sha256()
+
+    def read(self, *args):
+        data = self.file.read(*args)
+        self._digest.update(data)
+        return data
+
+    def seek(self, offset, *args):
+        if offset == 0 and not args:
+            # Relecture depuis le début (chunks(), stockage qui relit) : empreinte repartie de zéro
+            self._digest = hashlib.sha256()
+        return self.file.seek(offset, *args)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def blob_name(key, filename):
+    # Relatif à upload_to ('campaign_images/') : campaign_images/ab/abcdef....png
+    extension = os.path.splitext(filename)[1].lower()
+    return f'{key[:2]}/{key}{extension}'
+
+
+def store_image(file, filename=None, checksum=None, **fields):
+    """
+    Crée une Image en une seule lecture du fichier : le SHA-256 est calculé pendant l'écriture
+    dans le stockage. Si ce contenu était déjà stocké, le fichier écrit est supprimé et la
+    nouvelle Image référence l'existant. `checksum` : SHA-256 attendu (ChecksumError sinon).
+    """
+    source = HashingFile(file, name=filename or file.name)
+    image_obj = Image(**fields)
+    image_obj.image.save(blob_name(uuid.uuid4().hex, source.name), source, save=False)
+    digest = source.hexdigest()
+    if checksum and digest != checksum.lower():
+        default_storage.delete(image_obj.image.name)
+        raise ChecksumError("Checksum du fichier invalide")
+    image_obj.content_hash = digest
+    existing = (
+        Image.objects.filter(content_hash=digest)
+        .exclude(image='').values_list('image', flat=True).first()
+    )
+    if existing and existing != image_obj.image.name and default_storage.exists(existing):
+        default_storage.delete(image_obj.image.name)
+        image_obj.image.name = existing
+    image_obj.save()
+    return image_obj
+
+
+def release_images(image_ids):
+    """
+    Supprime les Images en une transaction, en un nombre de requêtes constant : pas de
+    suppression ligne par ligne ni de signal par ligne. Journal des changements, cache des
+    réponses, playlists et abonnés sont prévenus une fois pour toutes les lignes. Les fichiers
+    et variantes qui ne sont plus référencés par aucune autre Image sont supprimés après le
+    commit par une tâche de fond (delete_files).
+    """
+    images = list(Image.objects.filter(pk__in=image_ids).values_list('pk', 'image', 'content_hash'))
+    if not images:
+        return
+    image_ids = [pk for pk, _, _ in images]
+    variant_names = list(ImageVariant.objects.filter(id_image__in=image_ids).values_list('file', flat=True))
+    with transaction.atomic():
+        campaign_images = list(
+            CampaignImage.objects.filter(id_image__in=image_ids).values_list('pk', 'id_campaign_id')
+        )
+        campaign_ids = list(Campaign.objects.filter(id_image__in=image_ids).values_list('pk', flat=True))
+        uploads = ImageUpload.objects.filter(id_image__in=image_ids).update(id_image=None)
+        # on_delete de Campaign.id_image et ImageUpload.id_image (SET_NULL), des CampaignImage et
+        # ImageVariant (CASCADE), faits ici : _raw_delete n'envoie aucun signal
+        if campaign_ids:
+            Campaign.objects.filter(pk__in=campaign_ids).update(id_image=None)
+        CampaignImage.objects.filter(id_image__in=image_ids)._raw_delete(CampaignImage.objects.db)
+        ImageVariant.objects.filter(id_image__in=image_ids)._raw_delete(ImageVariant.objects.db)
+        Image.objects.filter(pk__in=image_ids)._raw_delete(Image.objects.db)
+
+        record_changes(Image, image_ids, deleted=True)
+        record_changes(CampaignImage, [pk for pk, _ in campaign_images], deleted=True)
+        record_changes(Campaign, campaign_ids)
+        changed = [Image, ImageVariant, CampaignImage]
+        if campaign_ids:
+            changed.append(Campaign)
+        if uploads:
+            changed.append(ImageUpload)
+        invalidate(*changed)
+        publish(CAMPAIGN, campaign_ids)
+        marked = sorted({campaign_id for _, campaign_id in campaign_images} | set(campaign_ids))
+        if marked:
+            transaction.on_commit(lambda: playlist_index.mark_campaigns(marked))
+
+        hashes = {content_hash for _, _, content_hash in images if content_hash}
+        used_hashes = set(Image.objects.filter(content_hash__in=hashes).values_list('content_hash', flat=True))
+        unhashed = {name for _, name, content_hash in images if name and not content_hash}
+        used_names = set(Image.objects.filter(image__in=unhashed).values_list('image', flat=True))
+        still_used = set(ImageVariant.objects.filter(file__in=variant_names).values_list('file', flat=True))
+
+        orphans = {name for name in variant_names if name not in still_used}
+        orphans.update(
+            name for _, name, content_hash in images
+            if name and (content_hash not in used_hashes if content_hash else name not in used_names)
+        )
+        if orphans:
+            # Tâche visible seulement au commit : rien n'est supprimé si la transaction échoue
+            enqueue('delete_files', names=sorted(orphans))
+
+
+@register('delete_files')
+def delete_files(names):
+    # Un fichier a pu être de nouveau référencé depuis la suppression des Images
+    referenced = set(Image.objects.filter(image__in=names).values_list('image', flat=True))
+    referenced.update(ImageVariant.objects.filter(file__in=names).values_list('file', flat=True))
+    for name in names:
+        if name and name not in referenced and default_storage.exists(name):
+            default_storage.delete(name)
+
+
+def _walk(directory):
+    directories, files = default_storage.listdir(directory)
+    for name in files:
+        yield f'{directory}/{name}'
+    for name in directories:
+        yield from _walk(f'{directory}/{name}')
+
+
+def collect_orphan_files(grace=timedelta(hours=1), dry_run=False):
+    """
+    Supprime les fichiers de campaign_images/ qu'aucune Image ni ImageVariant ne référence.
+    Les fichiers plus récents que `grace` sont ignorés (upload dont la transaction n'est pas
+    encore validée). Renvoie la liste des fichiers orphelins.
+    """
+    root = Image._meta.get_field('image').upload_to.rstrip('/')
+    if not default_storage.exists(root):
+        return []
+    referenced = set(Image.objects.exclude(image='').values_list('image', flat=True).iterator())
+    referenced.update(ImageVariant.objects.values_list('file', flat=True).iterator())
+    limit = timezone.now() - grace
+    orphans = [
+        name for name in _walk(root)
+        if name not in referenced and default_storage.get_modified_time(name) < limit
+    ]
+    if not dry_run:
+        for name in orphans:
+            default_storage.delete(name)
+    return orphans
@@ -0,0 +1,192 @@
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from graphql import (
+    FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError, GraphQLInt,
+    InlineFragmentNode, get_named_type, get_nullable_type, get_operation_ast, is_list_type,
+    is_object_type, value_from_ast,
+)
+
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, CountableConnection, estimated_rows
+from .schema import ChangesPage
+
+logger = logging.getLogger(__name__)
+
+
+class _TableRows:
+    """
+    Nombre de lignes des tables, jamais compté pendant la requête. Sous PostgreSQL il vient
+    de pg_class (statistiques d'ANALYZE). Ailleurs, un thread d'arrière-plan fait le
+    COUNT(*) quand la valeur a plus de GRAPHQL_COST_STATS_TTL secondes ; la requête utilise
+    en attendant la dernière valeur connue, ou None avant le premier comptage.
+    """
+
+    def __init__(self):
+        self._rows = {}
+        self._stale = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def get(self, model):
+        with self._lock:
+            rows, expires = self._rows.get(model, (None, 0))
+        if expires > time.monotonic():
+            return rows
+        estimate = estimated_rows(model)
+        if estimate is not None:
+            self._set(model, estimate)
+            return estimate
+        with self._lock:
+            self._stale.add(model)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='cost-table-rows', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return rows
+
+    def _set(self, model, rows):
+        with self._lock:
+            self._rows[model] = (rows, time.monotonic() + settings.GRAPHQL_COST_STATS_TTL)
+
+    def refresh(self):
+        """Compte les tables en attente (fait par le thread d'arrière-plan)."""
+        with self._lock:
+            models, self._stale = self._stale, set()
+        for model in models:
+            self._set(model, model._default_manager.count())
+
+    def _run(self):
+        from django.db import close_old_connections
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                close_old_connections()
+                self.refresh()
+            except Exception:
+                # Tables recomptées à la prochaine requête qui les utilise
+                logger.exception("Échec du comptage des lignes pour l'estimation du coût")
+
+
+_table_rows = _TableRows()
+
+
+def table_rows(model):
+    """Nombre de lignes de la table du modèle, ou None s'il n'est pas encore connu."""
+    return _table_rows.get(model)
+
+
+def _model(graphql_type):
+    meta = getattr(getattr(graphql_type, 'graphene_type', None), '_meta', None)
+    return getattr(meta, 'model', None)
+
+
+def _is_connection(graphql_type):
+    # Types paginés par `first` : connexions et pages de changesSince
+    graphene_type = getattr(graphql_type, 'graphene_type', None)
+    return isinstance(graphene_type, type) and issubclass(graphene_type, (CountableConnection, ChangesPage))
+
+
+def _page_size(field_node, variables):
+    for argument in field_node.arguments:
+        if argument.name.value == 'first':
+            first = value_from_ast(argument.value, GraphQLInt, variables)
+            if isinstance(first, int) and first > 0:
+                return min(first, MAX_PAGE_SIZE)
+    return DEFAULT_PAGE_SIZE
+
+
+def _list_size(parent_model, model):
+    """
+    Cardinalité moyenne d'une liste : taille de la table rapportée au nombre de parents.
+    DEFAULT_PAGE_SIZE tant que les tailles des tables ne sont pas connues.
+    """
+    rows = table_rows(model) if model is not None else None
+    if rows is None:
+        return DEFAULT_PAGE_SIZE
+    if parent_model is None:
+        return max(rows, 1)
+    parent_rows = table_rows(parent_model)
+    if parent_rows is None:
+        return DEFAULT_PAGE_SIZE
+    return max(math.ceil(rows / max(parent_rows, 1)), 1)
+
+
+def estimate(schema, document, operation_name=None, variables=None):
+    """
+    Renvoie (profondeur, coût) de l'opération. Chaque objet renvoyé coûte 1, multiplié par la
+    cardinalité estimée des listes qui le contiennent (taille de page pour les connexions,
+    statistiques des tables pour les relations inverses).
+    """
+    operation = get_operation_ast(document, operation_name)
+    if operation is None:
+        return 0, 0
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+    root_type = schema.get_root_type(operation.operation)
+
+    def fields(selection_set, parent_type):
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield selection, parent_type
+            elif isinstance(selection, InlineFragmentNode):
+                condition = selection.type_condition
+                yield from fields(selection.selection_set, schema.get_type(condition.name.value) if condition else parent_type)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = fragments.get(selection.name.value)
+                if fragment is not None:
+                    yield from fields(fragment.selection_set, schema.get_type(fragment.type_condition.name.value))
+
+    def visit(selection_set, parent_type, in_connection=False):
+        max_depth, total = 0, 0
+        for field_node, field_parent in fields(selection_set, parent_type):
+            name = field_node.name.value
+            if name.startswith('__'):
+                continue
+            field = field_parent.fields.get(name)
+            if field is None:
+                continue
+            named_type = get_named_type(field.type)
+            if not is_object_type(named_type) or not field_node.selection_set:
+                max_depth = max(max_depth, 1)
+                continue
+
+            if _is_connection(named_type):
+                multiplier = _page_size(field_node, variables)
+            elif is_list_type(get_nullable_type(field.type)) and not in_connection:
+                multiplier = _list_size(_model(field_parent), _model(named_type))
+            else:
+                multiplier = 1
+            depth, cost = visit(field_node.selection_set, named_type, _is_connection(named_type))
+            max_depth = max(max_depth, depth + 1)
+            total += multiplier * (1 + cost)
+        return max_depth, total
+
+    return visit(operation.selection_set, root_type)
+
+
+def check_query_cost(schema, document, operation_name=None, variables=None):
+    """
+    Refuse l'opération si elle dépasse GRAPHQL_MAX_DEPTH ou GRAPHQL_MAX_COST, avant l'exécution
+    de tout resolver. Renvoie l'estimation à publier dans `extensions`.
+    """
+    depth, cost = estimate(schema, document, operation_name, variables)
+    limits = {'depth': depth, 'maxDepth': settings.GRAPHQL_MAX_DEPTH, 'cost': cost, 'maxCost': settings.GRAPHQL_MAX_COST}
+    if depth > settings.GRAPHQL_MAX_DEPTH:
+        raise GraphQLError(
+            f"Requête trop profonde ({depth} niveaux, maximum {settings.GRAPHQL_MAX_DEPTH})",
+            extensions={'code': 'QUERY_TOO_DEEP', **limits},
+        )
+    if cost > settings.GRAPHQL_MAX_COST:
+        raise GraphQLError(
+            f"Requête trop coûteuse (coût estimé {cost}, maximum {settings.GRAPHQL_MAX_COST})",
+            extensions={'code': 'QUERY_TOO_COSTLY', **limits},
+        )
+    return limits
@@ -0,0 +1,17 @@
+import threading
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.db import connection
+
+_write_lock = threading.Lock()
+
+
+def serialized_writes():
+    """
+    Sous SQLite (SQLITE_SERIALIZE_WRITES), les mutations de ce processus s'exécutent une par
+    une au lieu de se disputer le verrou d'écriture de la base ; sans effet sur PostgreSQL.
+    """
+    if settings.SQLITE_SERIALIZE_WRITES and connection.vendor == 'sqlite':
+        return _write_lock
+    return nullcontext()
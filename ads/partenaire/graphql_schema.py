@@ -1,6 +1,7 @@
 import graphene
 from partenaire.queries import Query as MainQuery
 from partenaire.mutations import Mutation as MainMutation
+from partenaire.subscriptions import Subscription as MainSubscription
 
 class Query(MainQuery, graphene.ObjectType):
     pass
@@ -8,6 +9,9 @@ class Query(MainQuery, graphene.ObjectType):
 class Mutation(MainMutation, graphene.ObjectType):
     pass
 
+class Subscription(MainSubscription, graphene.ObjectType):
+    pass
+
 
 # Objet Schema attendu par GraphQLView
-schema = graphene.Schema(query=Query, mutation=Mutation)
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
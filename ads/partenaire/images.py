@@ -0,0 +1,87 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image as PILImage, ImageOps
+
+from .jobs import enqueue, register
+from .models import Image, ImageVariant
+from .response_cache import invalidate
+
+PIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def schedule_variants(image_obj):
+    """Programme la génération des variantes ; la tâche est visible au commit de la transaction."""
+    return enqueue('image_variants', image_id=image_obj.pk)
+
+
+def _encode(picture, fmt):
+    pil_format, options = PIL_FORMATS[fmt]
+    if pil_format == 'JPEG' and picture.mode not in ('RGB', 'L'):
+        picture = picture.convert('RGB')
+    buffer = BytesIO()
+    picture.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+@register('image_variants')
+def generate_variants(image_id):
+    try:
+        image_obj = Image.objects.get(pk=image_id)
+    except Image.DoesNotExist:
+        return
+    # Même contenu déjà traité pour une autre Image : réutiliser ses fichiers de variantes
+    if image_obj.content_hash:
+        shared = ImageVariant.objects.filter(
+            id_image__content_hash=image_obj.content_hash,
+        ).exclude(id_image=image_obj).order_by('id_image', 'width', 'format')
+        donor = shared.values_list('id_image', flat=True).first()
+        if donor is not None:
+            ImageVariant.objects.bulk_create([
+                ImageVariant(
+                    id_image=image_obj, width=variant.width, height=variant.height,
+                    format=variant.format, file=variant.file.name,
+                )
+                for variant in shared.filter(id_image=donor)
+            ], ignore_conflicts=True)
+            # bulk_create n'envoie pas post_save
+            invalidate(ImageVariant)
+            return
+
+    with image_obj.image.open('rb') as source:
+        original = ImageOps.exif_transpose(PILImage.open(source))
+        original.load()
+
+    base = os.path.splitext(os.path.basename(image_obj.image.name))[0]
+    existing = set(image_obj.variants.values_list('width', 'format'))
+    # Pas d'agrandissement : l'original sert au-delà de sa propre largeur
+    widths = sorted({min(width, original.width) for width in settings.IMAGE_VARIANT_WIDTHS})
+    for width in widths:
+        height = max(1, round(original.height * width / original.width))
+        resized = original if width == original.width else original.resize((width, height), PILImage.LANCZOS)
+        for fmt in settings.IMAGE_VARIANT_FORMATS:
+            if (width, fmt) in existing:
+                continue
+            variant = ImageVariant(id_image=image_obj, width=width, height=height, format=fmt)
+            variant.file.save(f'{base}_{width}.{fmt}', ContentFile(_encode(resized, fmt)), save=True)
+
+
+def best_variant(variants, size=None, fmt=None):
+    """
+    Plus petite variante prête d'au moins `size` pixels de large dans le format demandé,
+    sinon la plus grande disponible ; None si aucune (l'original est alors servi).
+    """
+    candidates = [variant for variant in variants if fmt is None or variant.format == fmt]
+    if not candidates:
+        return None
+    if size is None:
+        return max(candidates, key=lambda variant: variant.width)
+    large_enough = [variant for variant in candidates if variant.width >= size]
+    if large_enough:
+        return min(large_enough, key=lambda variant: variant.width)
+    return max(candidates, key=lambda variant: variant.width)
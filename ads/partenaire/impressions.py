@@ -0,0 +1,276 @@
+"""
+Impressions envoyées par les écrans : authentification de l'appelant, journal sur disque et
+cumul en mémoire, écriture différée en base.
+
+Le journal est verrouillé avec fcntl.flock : ce module (et donc /impressions/) ne fonctionne
+que sur un système POSIX.
+"""
+import atexit
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .jwt_auth import authenticate_request
+from .models import CampaignDisplay, Display, ImpressionFlush, Utilisateur
+from .pubsub import CAMPAIGN_DISPLAY, publish
+from .response_cache import invalidate
+
+logger = logging.getLogger(__name__)
+
+# Couples (campagne, display) mis à jour par un même UPDATE ... CASE
+UPDATE_CHUNK_SIZE = 500
+# Durée de conservation des segments appliqués (table impressionFlush)
+FLUSH_RETENTION = timedelta(days=7)
+
+
+# En-tête des écrans : Authorization: Display <clé>
+DISPLAY_AUTH_SCHEME = 'Display'
+
+
+class ImpressionError(Exception):
+    pass
+
+
+class ImpressionForbidden(ImpressionError):
+    pass
+
+
+def display_key_hash(key):
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def caller_displays(request):
+    """
+    Displays pour lesquels la requête peut envoyer des impressions, sous forme de filtre de
+    CampaignDisplay : le display de la clé `Authorization: Display <clé>`, ou ceux du
+    partenaire connecté (session ou jeton JWT d'un compte dont l'email est celui d'un
+    Utilisateur partenaire actif). None si la requête n'est pas authentifiée.
+    """
+    scheme, _, key = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme == DISPLAY_AUTH_SCHEME:
+        display = (
+            Display.objects.filter(cle_impressions=display_key_hash(key.strip()), actif=True)
+            .values_list('pk', flat=True).first()
+        )
+        return Q(id_display_id=display) if display is not None else None
+
+    authenticate_request(request)
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated or not user.email:
+        return None
+    partner = (
+        Utilisateur.objects.filter(email=user.email, role='partenaire', actif=True)
+        .values_list('pk', flat=True).first()
+    )
+    return Q(id_display__id_utilisateur_partenaire=partner) if partner is not None else None
+
+
+def check_pairs(events, allowed):
+    """Refuse le lot si un couple (campagne, display) n'est pas une diffusion des displays `allowed`."""
+    pairs = {(id_campaign, id_display) for id_campaign, id_display, _, _ in events}
+    found = set(
+        CampaignDisplay.objects.filter(
+            allowed,
+            id_campaign__in={id_campaign for id_campaign, _ in pairs},
+            id_display__in={id_display for _, id_display in pairs},
+        ).values_list('id_campaign_id', 'id_display_id')
+    )
+    missing = sorted(pairs - found)
+    if missing:
+        id_campaign, id_display = missing[0]
+        raise ImpressionForbidden(f"Campagne {id_campaign} non diffusée sur le display {id_display} de l'appelant")
+
+
+def parse_events(events):
+    """Valide les événements reçus et renvoie [(id_campaign, id_display, count, timestamp)]."""
+    if not isinstance(events, list):
+        raise ImpressionError("`events` doit être une liste")
+    if len(events) > settings.IMPRESSION_MAX_EVENTS_PER_REQUEST:
+        raise ImpressionError(f"Au plus {settings.IMPRESSION_MAX_EVENTS_PER_REQUEST} événements par requête")
+    parsed = []
+    for index, event in enumerate(events):
+        try:
+            campaign, display = int(event['campaign']), int(event['display'])
+            count = int(event.get('count', 1))
+        except (KeyError, TypeError, ValueError):
+            raise ImpressionError(f"Événement {index} invalide")
+        if count <= 0:
+            raise ImpressionError(f"Événement {index} : count doit être positif")
+        parsed.append((campaign, display, count, event.get('timestamp')))
+    return parsed
+
+
+def apply_counts(counts, segment):
+    """
+    Ajoute `counts` {(id_campaign, id_display): n} à nombre_affichages, un UPDATE ... CASE par
+    paquet de couples, dans la transaction qui enregistre le segment. Renvoie False si le
+    segment avait déjà été appliqué.
+    """
+    pairs = list(counts.items())
+    try:
+        with transaction.atomic():
+            ImpressionFlush.objects.create(segment=segment)
+            for start in range(0, len(pairs), UPDATE_CHUNK_SIZE):
+                chunk = pairs[start:start + UPDATE_CHUNK_SIZE]
+                condition = Q()
+                whens = []
+                for (id_campaign, id_display), count in chunk:
+                    condition |= Q(id_campaign_id=id_campaign, id_display_id=id_display)
+                    whens.append(When(id_campaign_id=id_campaign, id_display_id=id_display, then=Value(count)))
+                CampaignDisplay.objects.filter(condition).update(
+                    nombre_affichages=F('nombre_affichages') + Case(*whens, default=Value(0), output_field=IntegerField()),
+                )
+            # update() n'envoie pas post_save
+            invalidate(CampaignDisplay)
+            publish(CAMPAIGN_DISPLAY, counts)
+    except IntegrityError:
+        return False
+    return True
+
+
+def _read_segment(path):
+    counts = Counter()
+    with open(path) as wal:
+        for line in wal:
+            try:
+                events = json.loads(line)
+            except ValueError:
+                # Dernière ligne tronquée par le crash : jamais acquittée au client
+                continue
+            for id_campaign, id_display, count, _ in events:
+                counts[(id_campaign, id_display)] += count
+    return counts
+
+
+def _segment_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class ImpressionBuffer:
+    """
+    Impressions reçues par ce processus, additionnées par couple (campagne, display) en mémoire
+    et écrites en base toutes les IMPRESSION_FLUSH_INTERVAL secondes.
+
+    Chaque lot reçu est d'abord ajouté (et synchronisé sur disque) au segment courant du
+    journal, verrouillé par ce processus. Au flush un nouveau segment est ouvert, l'ancien est
+    appliqué en base avec son identifiant puis supprimé ; un segment laissé par un flush en
+    échec ou un processus arrêté est rejoué par replay_segments (commande flush_impressions).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counts = Counter()
+        self._segment = None
+        self._wal = None
+        self._thread = None
+        self._wake = threading.Event()
+
+    def _open_segment(self):
+        os.makedirs(settings.IMPRESSION_WAL_DIR, exist_ok=True)
+        self._segment = uuid.uuid4().hex
+        self._wal = open(os.path.join(settings.IMPRESSION_WAL_DIR, f'{self._segment}.wal'), 'a')
+        fcntl.flock(self._wal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def record(self, events):
+        line = json.dumps(events, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._wal is None:
+                self._open_segment()
+                self._start()
+            self._wal.write(line)
+            self._wal.flush()
+            if settings.IMPRESSION_WAL_FSYNC:
+                os.fsync(self._wal.fileno())
+            for id_campaign, id_display, count, _ in events:
+                self._counts[(id_campaign, id_display)] += count
+            pending = len(self._counts)
+        if pending >= settings.IMPRESSION_MAX_PENDING_PAIRS:
+            self._wake.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if self._wal is None:
+                    return 0
+                counts, segment, wal = self._counts, self._segment, self._wal
+                self._counts, self._segment, self._wal = Counter(), None, None
+            # Le verrou est gardé jusqu'à la suppression : replay_segments ignore ce segment
+            try:
+                if counts:
+                    apply_counts(counts, segment)
+                os.remove(wal.name)
+            finally:
+                wal.close()
+            return sum(counts.values())
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='impressions-flush', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        from django.db import close_old_connections
+        while True:
+            self._wake.wait(settings.IMPRESSION_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                close_old_connections()
+                self.flush()
+                # Segments d'un flush en échec ou d'un processus arrêté
+                replay_segments()
+            except Exception:
+                # Le segment reste sur disque et sera rejoué au prochain passage
+                logger.exception("Échec de l'écriture des impressions")
+
+
+buffer = ImpressionBuffer()
+
+
+def record_impressions(events):
+    buffer.record(events)
+    return len(events)
+
+
+def replay_segments():
+    """Applique les segments du journal qu'aucun processus ne tient verrouillés. Renvoie le nombre d'impressions."""
+    directory = settings.IMPRESSION_WAL_DIR
+    if not os.path.isdir(directory):
+        return 0
+    total = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.wal'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            wal = open(path)
+        except FileNotFoundError:
+            continue  # appliqué entre-temps par son processus
+        with wal:
+            try:
+                fcntl.flock(wal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # segment courant d'un processus actif
+            if not os.path.exists(path):
+                continue
+            counts = _read_segment(path)
+            if counts and apply_counts(counts, _segment_name(path)):
+                total += sum(counts.values())
+            os.remove(path)
+    return total
+
+
+def purge_flushes():
+    ImpressionFlush.objects.filter(date_creation__lt=timezone.now() - FLUSH_RETENTION).delete()
@@ -0,0 +1,74 @@
+import logging
+from datetime import timedelta
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+# Une tâche 'running' sans nouvelle depuis ce délai est considérée comme abandonnée (worker arrêté)
+STALE_AFTER = timedelta(minutes=15)
+
+HANDLERS = {}
+
+
+def register(kind):
+    """Déclare la fonction qui exécute les tâches de type `kind`."""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, **payload):
+    return Job.objects.create(kind=kind, payload=payload)
+
+
+def claim(limit):
+    """
+    Réserve jusqu'à `limit` tâches prêtes. La réservation est un UPDATE conditionnel sur le
+    statut : deux workers ne peuvent pas prendre la même tâche, quel que soit le moteur SQL.
+    """
+    now = timezone.now()
+    candidates = list(
+        Job.objects.filter(status='queued', run_after__lte=now)
+        .order_by('id').values_list('id', flat=True)[:limit]
+    )
+    claimed = [
+        pk for pk in candidates
+        if Job.objects.filter(pk=pk, status='queued').update(
+            status='running', attempts=F('attempts') + 1, date_modification=now,
+        )
+    ]
+    return list(Job.objects.filter(pk__in=claimed).order_by('id'))
+
+
+def requeue_stale():
+    return Job.objects.filter(
+        status='running', date_modification__lt=timezone.now() - STALE_AFTER,
+    ).update(status='queued', date_modification=timezone.now())
+
+
+def run_job(job):
+    handler = HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"Aucun handler pour la tâche {job.kind}")
+        handler(**job.payload)
+    except Exception as e:
+        logger.exception("Échec de la tâche %s #%s", job.kind, job.pk)
+        now = timezone.now()
+        if job.attempts >= MAX_ATTEMPTS:
+            Job.objects.filter(pk=job.pk).update(status='failed', last_error=str(e), date_modification=now)
+        else:
+            # Nouvelle tentative plus tard, avec un délai croissant
+            Job.objects.filter(pk=job.pk).update(
+                status='queued', last_error=str(e), date_modification=now,
+                run_after=now + timedelta(seconds=30 * 2 ** job.attempts),
+            )
+        return False
+    Job.objects.filter(pk=job.pk).delete()
+    return True
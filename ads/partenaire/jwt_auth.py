@@ -0,0 +1,142 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.utils import get_http_authorization, get_payload, get_user_by_payload
+
+
+class _TokenCache:
+    """
+    Jetons déjà vérifiés -> utilisateur, pour JWT_USER_CACHE_TTL secondes au plus (jamais
+    au-delà de l'expiration du jeton), JWT_USER_CACHE_SIZE entrées au plus. Cache propre au
+    processus : un changement fait ailleurs est pris en compte au plus tard après le TTL.
+    Chaque requête reçoit sa propre copie de l'utilisateur.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Utilisateur -> ses jetons en cache, pour n'oublier que ceux-là
+        self._tokens = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return copy.copy(entry[0])
+            self.misses += 1
+        return None
+
+    def set(self, token, user, expires):
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (copy.copy(user), min(expires, time.time() + settings.JWT_USER_CACHE_TTL))
+            self._tokens.setdefault(user.pk, set()).add(token)
+            while len(self._entries) > settings.JWT_USER_CACHE_SIZE:
+                self._remove(next(iter(self._entries)))
+
+    def forget_user(self, user_id):
+        with self._lock:
+            for token in self._tokens.get(user_id, set()).copy():
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens.clear()
+
+    def _remove(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._tokens[entry[0].pk]
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[entry[0].pk]
+
+
+token_cache = _TokenCache()
+
+
+def invalidate_user_tokens(user_id):
+    """
+    Oublie les jetons en cache d'un utilisateur modifié ou supprimé (actif, permissions...).
+    Après la validation : avant, une requête concurrente relirait l'ancien état.
+    """
+    transaction.on_commit(lambda: token_cache.forget_user(user_id))
+
+
+def _verify(token, request):
+    # Vérification complète de graphql_jwt : signature, expiration, utilisateur actif
+    payload = get_payload(token, request)
+    user = get_user_by_payload(payload)
+    if user is not None:
+        token_cache.set(token, user, payload.get('exp', float('inf')))
+    return user
+
+
+def authenticate_request(request):
+    """
+    Authentifie la requête par son jeton JWT une seule fois : le résultat (utilisateur ou
+    erreur) est mémorisé sur la requête pour tous les champs et toutes les opérations.
+    """
+    if hasattr(request, 'jwt_auth_result'):
+        return request.jwt_auth_result
+    result = None
+    user = getattr(request, 'user', None)
+    if user is None or user.is_anonymous:
+        token = get_http_authorization(request)
+        if token:
+            try:
+                result = token_cache.get(token) or _verify(token, request)
+            except JSONWebTokenError as e:
+                result = e
+            if result is not None and not isinstance(result, Exception):
+                request.user = result
+        elif user is None:
+            request.user = AnonymousUser()
+    request.jwt_auth_result = result
+    return result
+
+
+class JSONWebTokenMiddleware:
+    """
+    Remplace graphql_jwt.middleware.JSONWebTokenMiddleware : même vérification, mais faite
+    une fois par requête (et servie par token_cache pour les requêtes suivantes) au lieu
+    d'une fois par champ. Le jeton passé en argument (JWT_ALLOW_ARGUMENT) n'est pas géré.
+    """
+
+    def resolve(self, next, root, info, **kwargs):
+        result = authenticate_request(info.context)
+        if isinstance(result, Exception) and root is None:
+            # Jeton invalide : erreur sur chaque champ racine, comme graphql_jwt
+            raise result
+        return next(root, info, **kwargs)
+
+
+def _user_saved(sender, instance, update_fields=None, **kwargs):
+    # Connexion (update_last_login) : rien qui change l'accès
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_user_tokens(instance.pk)
+
+
+def _user_deleted(sender, instance, **kwargs):
+    invalidate_user_tokens(instance.pk)
+
+
+def connect_signals():
+    user_model = get_user_model()
+    post_save.connect(_user_saved, sender=user_model, dispatch_uid='jwt-user-save')
+    post_delete.connect(_user_deleted, sender=user_model, dispatch_uid='jwt-user-delete')
@@ -0,0 +1,69 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Campaign, CampaignImage
+from .playlist import playlist_index
+from .pubsub import CAMPAIGN, publish
+from .response_cache import invalidate
+from .sync import record_changes
+from .uploads import IMAGES_FOR_PENDING
+
+
+def _transition(queryset, status):
+    """Passe les campagnes de `queryset` au statut `status` ; deux requêtes quel que soit leur nombre."""
+    ids = list(queryset.values_list('id', flat=True))
+    if not ids:
+        return 0
+    now = timezone.now()
+    # Conditions de `queryset` reprises : une campagne annulée ou modifiée depuis la lecture
+    # n'est pas écrasée
+    updated = queryset.filter(pk__in=ids).update(status=status, date_modification=now)
+    if updated < len(ids):
+        ids = list(
+            Campaign.objects.filter(pk__in=ids, status=status, date_modification=now).values_list('id', flat=True)
+        )
+    if ids:
+        playlist_index.mark_campaigns(ids)
+        publish(CAMPAIGN, ids)
+        record_changes(Campaign, ids)
+    return len(ids)
+
+
+def reconcile_image_counts():
+    """Recalcule nombre_images des campagnes en 'upload' (images supprimées par cascade)."""
+    counts = (
+        CampaignImage.objects.filter(id_campaign=OuterRef('pk'))
+        .order_by().values('id_campaign').annotate(total=Count('id')).values('total')
+    )
+    actual = Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+    # Seules les campagnes dont le compteur est faux sont réécrites (et inscrites au journal)
+    ids = list(
+        Campaign.objects.filter(status='upload').annotate(actual=actual)
+        .exclude(nombre_images=F('actual')).values_list('id', flat=True)
+    )
+    if ids:
+        Campaign.objects.filter(pk__in=ids, status='upload').update(nombre_images=actual, date_modification=timezone.now())
+        record_changes(Campaign, ids)
+    return len(ids)
+
+
+def apply_transitions(today=None):
+    """
+    Transitions de statut dépendant des dates et des images, appliquées en masse :
+    'submitted' -> 'completed' à la date de fin (idx_campaign_status, idx_campaign_dates),
+    'upload' -> 'pending' dès IMAGES_FOR_PENDING images. Renvoie le nombre de campagnes par transition.
+    """
+    today = today or timezone.localdate()
+    reconcile_image_counts()
+    changed = {
+        'completed': _transition(
+            Campaign.objects.filter(status='submitted', end_date__lte=today), 'completed',
+        ),
+        'pending': _transition(
+            Campaign.objects.filter(status='upload', nombre_images__gte=IMAGES_FOR_PENDING), 'pending',
+        ),
+    }
+    # update() n'envoie pas post_save
+    invalidate(Campaign)
+    return changed
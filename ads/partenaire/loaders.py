@@ -0,0 +1,187 @@
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist
+
+from .middleware import in_event_loop
+
+
+def get_model_field(model, name):
+    """Champ Django correspondant à un nom de champ GraphQL (snake_case), ou None."""
+    # Les relations inverses sans related_name sont exposées en `<modèle>_set`
+    if name.endswith('_set'):
+        name = name[:-len('_set')]
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+class DataLoader:
+    """Charge des objets par clé en regroupant toutes les clés en attente dans une seule requête."""
+
+    def __init__(self, batch_load_fn, default=None):
+        self.batch_load_fn = batch_load_fn
+        self.default = default
+        self._cache = {}
+        self._pending = set()
+
+    def prime(self, keys):
+        for key in keys:
+            if key is not None and key not in self._cache:
+                self._pending.add(key)
+
+    def load(self, key):
+        if key is None:
+            return self.default() if callable(self.default) else self.default
+        if key not in self._cache:
+            self._pending.add(key)
+            self.dispatch()
+        return self._cache[key]
+
+    def is_loaded(self, key):
+        return key is None or key in self._cache
+
+    def dispatch(self):
+        if not self._pending:
+            return
+        keys = list(self._pending)
+        self._pending.clear()
+        results = self.batch_load_fn(keys)
+        for key in keys:
+            if key in results:
+                self._cache[key] = results[key]
+            else:
+                self._cache[key] = self.default() if callable(self.default) else self.default
+
+
+class RequestLoaders:
+    """
+    Loaders d'une requête GraphQL, rattachés à info.context.
+
+    Chaque lot d'instances (une page de la liste racine, ou les résultats d'un loader)
+    est enregistré ensemble : quand une relation est demandée pour une instance, les clés
+    de toutes ses voisines sont collectées et la relation est résolue avec un seul
+    `IN (...)` par niveau.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+
+    def register(self, instances):
+        instances = list(instances)
+        for instance in instances:
+            instance._loader_batch = instances
+        return instances
+
+    def _siblings(self, instance):
+        return getattr(instance, '_loader_batch', None) or [instance]
+
+    def _model_loader(self, model):
+        key = (model, None)
+        if key not in self._loaders:
+            def batch_load(keys):
+                objects = model._default_manager.in_bulk(keys)
+                self.register(objects.values())
+                return objects
+            self._loaders[key] = DataLoader(batch_load)
+        return self._loaders[key]
+
+    def _reverse_loader(self, model, field_name):
+        key = (model, field_name)
+        if key not in self._loaders:
+            attname = model._meta.get_field(field_name).attname
+
+            def batch_load(keys):
+                objects = self.register(
+                    model._default_manager.filter(**{f'{field_name}__in': keys}).order_by('pk')
+                )
+                grouped = defaultdict(list)
+                for obj in objects:
+                    grouped[getattr(obj, attname)].append(obj)
+                return grouped
+            self._loaders[key] = DataLoader(batch_load, default=list)
+        return self._loaders[key]
+
+    def prime(self, model, keys):
+        """Annonce des clés de `model` qui seront chargées dans le même lot."""
+        self._model_loader(model).prime(keys)
+
+    def load(self, model, key):
+        return self._model_loader(model).load(key)
+
+    def is_loaded(self, instance, field_name):
+        """Vrai si load_related répond sans requête (jointure, préchargement ou lot déjà chargé)."""
+        field = get_model_field(instance.__class__, field_name)
+        if field.many_to_one:
+            if field.is_cached(instance):
+                return True
+            loader = self._loaders.get((field.related_model, None))
+            key = getattr(instance, field.attname)
+        else:
+            if field.get_accessor_name() in getattr(instance, '_prefetched_objects_cache', {}):
+                return True
+            loader = self._loaders.get((field.related_model, field.field.name))
+            key = instance.pk
+        return key is None or (loader is not None and loader.is_loaded(key))
+
+    def load_related(self, instance, field_name):
+        """Résout la relation `field_name` (FK directe ou relation inverse) de `instance`."""
+        field = get_model_field(instance.__class__, field_name)
+        siblings = self._siblings(instance)
+
+        if field.many_to_one:
+            # Relation déjà chargée (select_related ou accès précédent)
+            if field.is_cached(instance):
+                related = getattr(instance, field.name)
+                if related is not None and not hasattr(related, '_loader_batch'):
+                    # Les objets joints aux voisines forment un lot pour les relations suivantes
+                    self.register(
+                        getattr(obj, field.name) for obj in siblings
+                        if field.is_cached(obj) and getattr(obj, field.name) is not None
+                    )
+                return related
+            loader = self._model_loader(field.related_model)
+            loader.prime(getattr(obj, field.attname) for obj in siblings)
+            return loader.load(getattr(instance, field.attname))
+
+        accessor = field.get_accessor_name()
+        prefetched = getattr(instance, '_prefetched_objects_cache', {})
+        if accessor in prefetched:
+            if accessor not in getattr(instance, '_prefetched_batches', ()):
+                # Les objets préchargés de toutes les voisines forment un seul lot
+                self.register(
+                    obj for sibling in siblings
+                    for obj in getattr(sibling, '_prefetched_objects_cache', {}).get(accessor, [])
+                )
+                for sibling in siblings:
+                    sibling._prefetched_batches = getattr(sibling, '_prefetched_batches', set()) | {accessor}
+            return list(prefetched[accessor])
+        loader = self._reverse_loader(field.related_model, field.field.name)
+        loader.prime(obj.pk for obj in siblings)
+        return loader.load(instance.pk)
+
+
+def get_loaders(info):
+    context = info.context
+    loaders = getattr(context, 'loaders', None)
+    if loaders is None:
+        loaders = RequestLoaders()
+        context.loaders = loaders
+    return loaders
+
+
+def resolve_related(info, instance, field_name):
+    """
+    Resolver d'une relation par les loaders de la requête. Dans la boucle d'événements, seule
+    une relation à charger en base passe par un thread (sync_to_async).
+    """
+    loaders = get_loaders(info)
+    if in_event_loop() and not loaders.is_loaded(instance, field_name):
+        return sync_to_async(loaders.load_related)(instance, field_name)
+    return loaders.load_related(instance, field_name)
+
+
+def reset_loaders(context):
+    # Après une mutation, les objets déjà chargés pour la requête peuvent être périmés
+    context.loaders = None
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from partenaire.blobs import collect_orphan_files
+
+
+class Command(BaseCommand):
+    help = "Supprime les fichiers de campaign_images/ qui ne sont plus référencés en base (à lancer périodiquement)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=60, help="Ignorer les fichiers modifiés depuis moins de N minutes")
+        parser.add_argument('--dry-run', action='store_true', help="Lister les fichiers sans les supprimer")
+
+    def handle(self, *args, **options):
+        orphans = collect_orphan_files(timedelta(minutes=options['grace']), dry_run=options['dry_run'])
+        for name in orphans:
+            self.stdout.write(name)
+        verb = "à supprimer" if options['dry_run'] else "supprimés"
+        self.stdout.write(self.style.SUCCESS(f"{len(orphans)} fichiers orphelins {verb}"))
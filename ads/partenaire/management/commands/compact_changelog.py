@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from partenaire.sync import compact_changelog
+
+
+class Command(BaseCommand):
+    help = "Supprime du journal de changesSince les entrées remplacées par une plus récente (à lancer périodiquement)."
+
+    def handle(self, *args, **options):
+        deleted = compact_changelog()
+        self.stdout.write(self.style.SUCCESS(f"{deleted} entrées supprimées du journal"))
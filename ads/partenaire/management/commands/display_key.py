@@ -0,0 +1,19 @@
+import secrets
+
+from django.core.management.base import BaseCommand, CommandError
+
+from partenaire.impressions import DISPLAY_AUTH_SCHEME, display_key_hash
+from partenaire.models import Display
+
+
+class Command(BaseCommand):
+    help = "Génère la clé d'envoi des impressions d'un display (remplace la précédente) et l'affiche une seule fois."
+
+    def add_arguments(self, parser):
+        parser.add_argument('display_id', type=int)
+
+    def handle(self, *args, **options):
+        key = secrets.token_urlsafe(32)
+        if not Display.objects.filter(pk=options['display_id']).update(cle_impressions=display_key_hash(key)):
+            raise CommandError(f"Display {options['display_id']} introuvable")
+        self.stdout.write(f"Authorization: {DISPLAY_AUTH_SCHEME} {key}")
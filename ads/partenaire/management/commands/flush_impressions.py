@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from partenaire.impressions import purge_flushes, replay_segments
+
+
+class Command(BaseCommand):
+    help = "Rejoue les segments du journal d'impressions laissés par des processus arrêtés."
+
+    def handle(self, *args, **options):
+        total = replay_segments()
+        purge_flushes()
+        self.stdout.write(self.style.SUCCESS(f"{total} impressions appliquées"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from partenaire.models import RevenueRollup
+from partenaire.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recalcule la table des revenus agrégés (revenueRollup) à partir de la table revenue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuild_rollups(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{RevenueRollup.objects.count()} lignes d'agrégats reconstruites"
+        ))
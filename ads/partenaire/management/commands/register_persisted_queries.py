@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from graphql import parse, validate
+
+from partenaire.graphql_schema import schema
+from partenaire.models import PersistedQuery
+from partenaire.persisted import query_hash
+
+
+class Command(BaseCommand):
+    help = "Enregistre des requêtes GraphQL (fichiers .graphql) comme requêtes persistées autorisées."
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+')
+
+    def handle(self, *args, **options):
+        for path in options['files']:
+            with open(path, encoding='utf-8') as f:
+                query = f.read()
+            errors = validate(schema.graphql_schema, parse(query))
+            if errors:
+                raise CommandError(f"{path}: {errors[0].message}")
+            digest = query_hash(query)
+            PersistedQuery.objects.update_or_create(sha256=digest, defaults={'query': query, 'automatique': False})
+            self.stdout.write(f"{digest}  {path}")
@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from partenaire.jobs import claim, requeue_stale, run_job
+
+
+def _run(job):
+    try:
+        return run_job(job)
+    finally:
+        # Chaque thread du pool a sa propre connexion : la fermer après la tâche
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Exécute les tâches de fond (table job) sur un pool de threads local."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--interval', type=float, default=2.0, help="Attente (s) quand la file est vide")
+        parser.add_argument('--once', action='store_true', help="Vider la file puis s'arrêter")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        requeue_stale()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                close_old_connections()
+                jobs = claim(workers)
+                if jobs:
+                    results = list(pool.map(_run, jobs))
+                    self.stdout.write(f"{results.count(True)}/{len(results)} tâches exécutées")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
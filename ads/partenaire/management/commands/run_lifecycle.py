@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from partenaire.lifecycle import apply_transitions
+
+
+class Command(BaseCommand):
+    help = "Applique périodiquement les changements de statut des campagnes (dates de fin, images)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=60.0, help="Attente (s) entre deux passages")
+        parser.add_argument('--once', action='store_true', help="Un seul passage puis s'arrêter")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            changed = apply_transitions()
+            if any(changed.values()):
+                self.stdout.write(", ".join(f"{count} -> {status}" for status, count in changed.items()))
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,60 @@
+import asyncio
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from graphene.types.resolver import get_default_resolver
+from graphene_django.fields import DjangoListField
+from graphql import default_field_resolver
+
+
+def _stays_in_loop(resolver, root):
+    """
+    Resolver `async_capable`, ou lecture d'attribut d'un objet déjà chargé, y compris derrière
+    les enveloppes de graphene-django : DjangoListField (partial de list_resolver) et champs
+    à choix (@wraps).
+    """
+    while True:
+        if getattr(resolver, 'async_capable', False):
+            return True
+        if resolver is default_field_resolver or (
+            isinstance(resolver, partial) and resolver.func is get_default_resolver()
+        ):
+            return root is not None
+        if isinstance(resolver, partial) and resolver.func is DjangoListField.list_resolver:
+            resolver = resolver.args[1]
+        elif hasattr(resolver, '__wrapped__'):
+            resolver = resolver.__wrapped__
+        else:
+            return False
+
+
+def in_event_loop():
+    """Vrai dans la boucle d'événements (AsyncGraphQLView), faux dans un thread (vue WSGI, sync_to_async)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def async_capable(resolver):
+    """
+    Marque un resolver qui ne lit pas la base de façon synchrone : dans la boucle d'événements
+    il renvoie un awaitable (ORM asynchrone) et il y est appelé directement, sans thread.
+    """
+    resolver.async_capable = True
+    return resolver
+
+
+class SyncResolverMiddleware:
+    """
+    Exécution asynchrone du schéma : les resolvers synchrones (ORM, loaders, middleware JWT)
+    sont exécutés via sync_to_async pour ne jamais bloquer la boucle d'événements. Les champs
+    simples (lecture d'attribut) et les resolvers `async_capable` restent dans la boucle.
+    Doit être le premier middleware de la liste : `next` est alors le resolver lui-même.
+    """
+
+    def resolve(self, next, root, info, **kwargs):
+        if _stays_in_loop(next, root):
+            return next(root, info, **kwargs)
+        return sync_to_async(next)(root, info, **kwargs)
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partenaire', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(upload_to='campaign_images/'),
+        ),
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('day', 'Jour'), ('week', 'Semaine'), ('month', 'Mois')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('nombre', models.IntegerField(default=0)),
+                ('id_campaign', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='partenaire.campaign')),
+                ('id_display', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='partenaire.display')),
+                ('id_utilisateur_partenaire', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='revenue_rollups', to='partenaire.utilisateur')),
+            ],
+            options={
+                'db_table': 'revenueRollup',
+                'indexes': [models.Index(fields=['granularity', 'period_start'], name='idx_revenue_rollup_period')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partenaire', '0005_image_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersistedQuery',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('query', models.TextField()),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'persistedQuery',
+            },
+        ),
+    ]
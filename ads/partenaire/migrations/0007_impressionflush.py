@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partenaire', '0006_persistedquery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImpressionFlush',
+            fields=[
+                ('segment', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'impressionFlush',
+            },
+        ),
+    ]
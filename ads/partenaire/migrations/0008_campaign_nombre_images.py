@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:46
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_nombre_images(apps, schema_editor):
+    Campaign = apps.get_model('partenaire', 'Campaign')
+    CampaignImage = apps.get_model('partenaire', 'CampaignImage')
+    counts = (
+        CampaignImage.objects.filter(id_campaign=OuterRef('pk'))
+        .order_by().values('id_campaign').annotate(total=Count('id')).values('total')
+    )
+    Campaign.objects.update(
+        nombre_images=Coalesce(Subquery(counts, output_field=models.IntegerField()), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partenaire', '0007_impressionflush'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='nombre_images',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_nombre_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partenaire', '0008_campaign_nombre_images'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='campaigndisplay',
+            index=models.Index(fields=['id_display', 'date_debut_affichage'], name='idx_campaign_display_display'),
+        ),
+        migrations.AddIndex(
+            model_name='display',
+            index=models.Index(condition=models.Q(('actif', True)), fields=['-id'], name='idx_display_actif'),
+        ),
+        migrations.AddIndex(
+            model_name='display',
+            index=models.Index(condition=models.Q(('actif', True)), fields=['id_utilisateur_partenaire', '-id'], name='idx_display_partenaire_actif'),
+        ),
+        migrations.AddIndex(
+            model_name='display',
+            index=models.Index(condition=models.Q(('actif', False)), fields=['id'], name='idx_display_inactif'),
+        ),
+        migrations.AddIndex(
+            model_name='revenue',
+            index=models.Index(fields=['id_utilisateur_partenaire', '-date_revenue', '-id'], name='idx_revenue_partenaire_date'),
+        ),
+        migrations.AddIndex(
+            model_name='revenue',
+            index=models.Index(fields=['id_campaign', '-date_revenue', '-id'], name='idx_revenue_campaign_date'),
+        ),
+        migrations.AddIndex(
+            model_name='revenue',
+            index=models.Index(fields=['id_display', '-date_revenue', '-id'], name='idx_revenue_display_date'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:02
+
+import base64
+import hashlib
+import json
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+# Formats d'image acceptés -> extension (copie figée de partenaire.avatars.AVATAR_FORMATS)
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+# Valeurs non convertibles (URL, base64 invalide, autre chose qu'une image), gardées telles
+# quelles dans le stockage des médias : {id utilisateur: ancienne valeur de picture}
+UNDECODED_NAME = 'avatars/legacy/0010_undecoded_pictures.json'
+
+
+def _decode(value):
+    if value.startswith('data:') and ',' in value:
+        value = value.split(',', 1)[1]
+    content = base64.b64decode(value, validate=False)
+    from PIL import Image as PILImage
+    with PILImage.open(BytesIO(content)) as image:
+        image_format = image.format
+        image.verify()
+    return content, EXTENSIONS[image_format]
+
+
+def move_pictures(apps, schema_editor):
+    """
+    Écrit les photos base64 dans le stockage des médias, par paquets de BATCH_SIZE lignes. Les
+    valeurs non convertibles sont sauvegardées dans UNDECODED_NAME avant la suppression de
+    la colonne.
+    """
+    Utilisateur = apps.get_model('partenaire', 'Utilisateur')
+    users = Utilisateur.objects.exclude(picture__isnull=True).exclude(picture='').order_by('pk')
+    last_pk = 0
+    undecoded = {}
+    while True:
+        # Seules les colonnes utiles sont chargées, un paquet à la fois
+        batch = list(users.filter(pk__gt=last_pk).only('id', 'picture')[:BATCH_SIZE])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        for utilisateur in batch:
+            try:
+                content, extension = _decode(utilisateur.picture)
+            except Exception:
+                undecoded[utilisateur.pk] = utilisateur.picture
+                continue
+            digest = hashlib.sha256(content).hexdigest()
+            name = f'avatars/{digest[:2]}/{digest}{extension}'
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(content))
+            utilisateur.avatar = name
+        Utilisateur.objects.bulk_update([u for u in batch if u.avatar], ['avatar'])
+    if undecoded:
+        name = default_storage.save(UNDECODED_NAME, ContentFile(json.dumps(undecoded, indent=2).encode('utf-8')))
+        logger.warning("%d photos non convertibles sauvegardées dans %s", len(undecoded), name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partenaire', '0009_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='utilisateur',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, upload_to='avatars/'),
+        ),
+        migrations.RunPython(move_pictures, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='utilisateur',
+            name='picture',
+        ),
+        migrations.RenameField(
+            model_name='utilisateur',
+            old_name='avatar',
+            new_name='picture',
+        ),
+    ]
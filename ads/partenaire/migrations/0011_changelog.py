@@ -0,0 +1,75 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:58
+
+from django.db import migrations, models
+from django.db.models import F
+
+BATCH_SIZE = 1000
+# Nom dans le journal -> modèle (partenaire.sync.SYNCED_MODELS)
+SYNCED_MODELS = {
+    'campaign': 'Campaign',
+    'display': 'Display',
+    'image': 'Image',
+    'campaign_image': 'CampaignImage',
+}
+
+
+def fill_changelog(apps, schema_editor):
+    """Une entrée par objet existant : la première synchronisation (jeton vide) les renvoie tous."""
+    ChangeLogEntry = apps.get_model('partenaire', 'ChangeLogEntry')
+    apps.get_model('partenaire', 'Campaign').objects.update(date_modification=F('date_creation'))
+    apps.get_model('partenaire', 'Display').objects.update(date_modification=F('date_creation'))
+    apps.get_model('partenaire', 'Image').objects.update(date_modification=F('date_upload'))
+    for name, model_name in SYNCED_MODELS.items():
+        ids = apps.get_model('partenaire', model_name).objects.order_by('pk').values_list('pk', flat=True)
+        batch = []
+        for object_id in ids.iterator(chunk_size=BATCH_SIZE):
+            batch.append(ChangeLogEntry(model=name, object_id=object_id))
+            if len(batch) == BATCH_SIZE:
+                ChangeLogEntry.objects.bulk_create(batch)
+                batch = []
+        ChangeLogEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partenaire', '0010_utilisateur_picture_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='date_modification',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='campaignimage',
+            name='date_modification',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='display',
+            name='date_modification',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='date_modification',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=30)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'changeLog',
+                'indexes': [models.Index(fields=['model', 'object_id'], name='idx_changelog_object')],
+            },
+        ),
+        migrations.RunPython(fill_changelog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:14
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+KEY = ('granularity', 'period_start', 'id_utilisateur_partenaire', 'id_campaign', 'id_display')
+
+
+def merge_duplicates(apps, schema_editor):
+    """Regroupe les lignes créées en double pour une même clé avant d'ajouter la contrainte."""
+    RevenueRollup = apps.get_model('partenaire', 'RevenueRollup')
+    duplicates = (
+        RevenueRollup.objects.values(*KEY)
+        .annotate(lignes=Count('id'), keep=Min('id'), sum_total=Sum('total'), sum_nombre=Sum('nombre'))
+        .filter(lignes__gt=1)
+        .order_by()
+    )
+    for row in duplicates:
+        keys = {field: row[field] for field in KEY}
+        RevenueRollup.objects.filter(pk=row['keep']).update(total=row['sum_total'], nombre=row['sum_nombre'])
+        RevenueRollup.objects.filter(**keys).exclude(pk=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partenaire', '0011_changelog'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='revenuerollup',
+            constraint=models.UniqueConstraint(models.F('granularity'), models.F('period_start'), django.db.models.functions.comparison.Coalesce('id_utilisateur_partenaire', models.Value(0)), django.db.models.functions.comparison.Coalesce('id_campaign', models.Value(0)), django.db.models.functions.comparison.Coalesce('id_display', models.Value(0)), name='unique_revenue_rollup_key'),
+        ),
+    ]
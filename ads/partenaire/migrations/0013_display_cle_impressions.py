@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partenaire', '0012_revenuerollup_unique_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='display',
+            name='cle_impressions',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+def mark_existing_automatic(apps, schema_editor):
+    # Entrées APQ et requêtes de register_persisted_queries indiscernables jusqu'ici : aucune
+    # n'est plus autorisée d'office, la commande est à relancer pour la liste d'autorisation
+    PersistedQuery = apps.get_model('partenaire', 'PersistedQuery')
+    PersistedQuery.objects.update(automatique=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partenaire', '0013_display_cle_impressions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='persistedquery',
+            name='automatique',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_existing_automatic, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,9 @@
+import uuid
+
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 class Utilisateur(models.Model):
     ROLE_CHOICES = [
@@ -29,7 +34,8 @@ class Utilisateur(models.Model):
     contact = models.CharField(max_length=150, blank=True, null=True)
     pays = models.CharField(max_length=150, blank=True, null=True)
     ville = models.CharField(max_length=150, blank=True, null=True)
-    picture = models.TextField(blank=True, null=True)
+    # Photo de profil dans le stockage des médias (nom adressé par le contenu, cf. avatars.py)
+    picture = models.ImageField(upload_to='avatars/', blank=True, null=True)
     last_connexion = models.DateTimeField(auto_now=True)
     icone = models.CharField(max_length=50, blank=True, null=True)
     date_creation = models.DateTimeField(auto_now_add=True)
@@ -42,9 +48,12 @@ class Utilisateur(models.Model):
 
 class Image(models.Model):
     image = models.ImageField(upload_to='campaign_images/')
+    # SHA-256 du contenu : les images identiques partagent le même fichier
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)
     description = models.TextField(blank=True, null=True)
     id_utilisateur_partenaire = models.ForeignKey(Utilisateur, on_delete=models.CASCADE, related_name='images', blank=True, null=True)
     date_upload = models.DateTimeField(auto_now_add=True)
+    date_modification = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'image'
@@ -54,10 +63,23 @@ class Display(models.Model):
     localisation = models.TextField(blank=True, null=True)
     id_utilisateur_partenaire = models.ForeignKey(Utilisateur, on_delete=models.CASCADE, related_name='displays', blank=True, null=True)
     actif = models.BooleanField(default=True)
+    # SHA-256 de la clé d'envoi des impressions (commande display_key) ; la clé n'est pas gardée
+    cle_impressions = models.CharField(max_length=64, unique=True, blank=True, null=True)
     date_creation = models.DateTimeField(auto_now_add=True)
+    date_modification = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'display'
+        indexes = [
+            # allDisplays(actif: true) trié par id décroissant, par partenaire ou non
+            models.Index(fields=['-id'], condition=models.Q(actif=True), name='idx_display_actif'),
+            models.Index(
+                fields=['id_utilisateur_partenaire', '-id'], condition=models.Q(actif=True),
+                name='idx_display_partenaire_actif',
+            ),
+            # Displays désactivés (peu nombreux), lus par l'index des playlists
+            models.Index(fields=['id'], condition=models.Q(actif=False), name='idx_display_inactif'),
+        ]
 
 class Campaign(models.Model):
     STATUS_CHOICES = [
@@ -75,7 +97,10 @@ class Campaign(models.Model):
     description = models.TextField(blank=True, null=True)
     id_utilisateur_createur = models.ForeignKey(Utilisateur, on_delete=models.CASCADE, related_name='created_campaigns', blank=True, null=True)
     id_image = models.ForeignKey(Image, on_delete=models.SET_NULL, blank=True, null=True)
+    # Nombre de CampaignImage rattachées, tenu à jour à chaque rattachement (partenaire.lifecycle)
+    nombre_images = models.IntegerField(default=0)
     date_creation = models.DateTimeField(auto_now_add=True)
+    date_modification = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'campaign'
@@ -108,6 +133,8 @@ class CampaignDisplay(models.Model):
         ]
         indexes = [
             models.Index(fields=['date_debut_affichage', 'date_fin_affichage'], name='idx_campaign_displays_dates'),
+            # Fenêtres de diffusion d'un display
+            models.Index(fields=['id_display', 'date_debut_affichage'], name='idx_campaign_display_display'),
         ]
 
 class Revenue(models.Model):
@@ -123,13 +150,146 @@ class Revenue(models.Model):
         db_table = 'revenue'
         indexes = [
             models.Index(fields=['date_revenue'], name='idx_revenue_date'),
+            # allRevenues filtré par partenaire, campagne ou display et trié par date
+            models.Index(fields=['id_utilisateur_partenaire', '-date_revenue', '-id'], name='idx_revenue_partenaire_date'),
+            models.Index(fields=['id_campaign', '-date_revenue', '-id'], name='idx_revenue_campaign_date'),
+            models.Index(fields=['id_display', '-date_revenue', '-id'], name='idx_revenue_display_date'),
         ]
 
 class CampaignImage(models.Model):
     id_campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE)
     id_image = models.ForeignKey(Image, on_delete=models.CASCADE)
     ordre_affichage = models.IntegerField(default=1)
+    date_modification = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'campaignImage'
         unique_together = ('id_campaign', 'id_image')
+
+class RevenueRollup(models.Model):
+    """Revenus pré-agrégés par période et par (partenaire, campagne, display)."""
+    GRANULARITY_CHOICES = [
+        ('day', 'Jour'),
+        ('week', 'Semaine'),
+        ('month', 'Mois'),
+    ]
+    granularity = models.CharField(max_length=5, choices=GRANULARITY_CHOICES)
+    period_start = models.DateField()
+    id_utilisateur_partenaire = models.ForeignKey(Utilisateur, on_delete=models.CASCADE, related_name='revenue_rollups', blank=True, null=True)
+    id_campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, blank=True, null=True)
+    id_display = models.ForeignKey(Display, on_delete=models.CASCADE, blank=True, null=True)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    nombre = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'revenueRollup'
+        constraints = [
+            # Une seule ligne par clé : une dimension absente (NULL) compte comme une valeur
+            models.UniqueConstraint(
+                'granularity', 'period_start',
+                Coalesce('id_utilisateur_partenaire', Value(0)),
+                Coalesce('id_campaign', Value(0)),
+                Coalesce('id_display', Value(0)),
+                name='unique_revenue_rollup_key',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['granularity', 'period_start'], name='idx_revenue_rollup_period'),
+        ]
+
+class ImageUpload(models.Model):
+    """Upload d'image en plusieurs morceaux, reprenable après une coupure."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('completed', 'Completed'),
+    ]
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    received_size = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    description = models.TextField(blank=True, null=True)
+    id_utilisateur_partenaire = models.ForeignKey(Utilisateur, on_delete=models.CASCADE, related_name='image_uploads', blank=True, null=True)
+    id_campaign = models.ForeignKey(Campaign, on_delete=models.SET_NULL, blank=True, null=True)
+    id_image = models.ForeignKey(Image, on_delete=models.SET_NULL, blank=True, null=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_modification = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'imageUpload'
+
+class ImageVariant(models.Model):
+    """Version redimensionnée / recompressée d'une Image, générée en tâche de fond."""
+    FORMAT_CHOICES = [
+        ('webp', 'WebP'),
+        ('jpeg', 'JPEG'),
+    ]
+    id_image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='variants')
+    width = models.IntegerField()
+    height = models.IntegerField()
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    file = models.ImageField(upload_to='campaign_images/variants/')
+    date_creation = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'imageVariant'
+        unique_together = ('id_image', 'width', 'format')
+
+class Job(models.Model):
+    """Tâche de fond stockée en base, exécutée par la commande `run_jobs`."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('failed', 'Failed'),
+    ]
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_modification = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'job'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='idx_job_status'),
+        ]
+
+class PersistedQuery(models.Model):
+    """Texte d'une requête GraphQL persistée, identifiée par son SHA-256."""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    query = models.TextField()
+    # Enregistrée par un client (APQ) et non par register_persisted_queries : hors liste
+    # d'autorisation, supprimée au-delà de GRAPHQL_AUTOMATIC_PERSISTED_QUERIES_MAX
+    automatique = models.BooleanField(default=False)
+    date_creation = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'persistedQuery'
+
+class ImpressionFlush(models.Model):
+    """Segment du journal d'impressions déjà appliqué : le rejeu après un crash est idempotent."""
+    segment = models.CharField(max_length=64, primary_key=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'impressionFlush'
+
+class ChangeLogEntry(models.Model):
+    """
+    Création, modification ou suppression d'un objet synchronisé par changesSince
+    (partenaire.sync). L'id croissant sert de jeton de synchronisation.
+    """
+    model = models.CharField(max_length=30)
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    date_creation = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'changeLog'
+        indexes = [
+            # Compactage : dernière entrée de chaque objet
+            models.Index(fields=['model', 'object_id'], name='idx_changelog_object'),
+        ]
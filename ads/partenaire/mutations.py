@@ -1,13 +1,26 @@
 from graphene_file_upload.scalars import Upload
 import graphene
-from .models import Utilisateur, Image, Display, Campaign, CampaignDisplay, Revenue, CampaignImage
+from .models import Utilisateur, Image, Display, Campaign, CampaignDisplay, Revenue, CampaignImage, ImageUpload
 from .schema import (
     UtilisateurType, ImageType, DisplayType, CampaignType,
-    CampaignDisplayType, RevenueType, CampaignImageType
+    CampaignDisplayType, RevenueType, CampaignImageType, ImageUploadType
 )
 import os
-from django.contrib.auth.hashers import check_password
+from decimal import Decimal
 from django.core.files.storage import default_storage
+from django.db import transaction
+from graphql import GraphQLError
+from .auth import LoginThrottled, verify_password
+from .avatars import AvatarError, decode_picture, store_avatar
+from .blobs import release_images, store_image
+from .images import schedule_variants
+from .loaders import get_loaders
+from .playlist import playlist_index
+from .pubsub import CAMPAIGN, publish
+from .response_cache import invalidate
+from .rollups import apply_revenue
+from .sync import record_changes
+from .uploads import UploadError, append_chunk, attach_image_to_campaign, finalize_upload, init_upload
 
 # LOGIN
 class LoginUtilisateur(graphene.Mutation):
@@ -22,15 +35,34 @@ class LoginUtilisateur(graphene.Mutation):
     def mutate(self, info, email, mot_de_passe):
         try:
             utilisateur = Utilisateur.objects.get(email=email)
-            # Si mot_de_passe est hashé, utiliser check_password, sinon comparer directement
-            if utilisateur.mot_de_passe == mot_de_passe or check_password(mot_de_passe, utilisateur.mot_de_passe):
+            # Vérification dans le pool de processus ; un mot de passe encore stocké en clair
+            # (ou avec un hasher obsolète) est re-hashé après une connexion réussie
+            ok, nouveau_hash = verify_password(email, mot_de_passe, utilisateur.mot_de_passe)
+            if ok:
+                if nouveau_hash:
+                    utilisateur.mot_de_passe = nouveau_hash
+                    utilisateur.save(update_fields=['mot_de_passe'])
                 return LoginUtilisateur(utilisateur=utilisateur, ok=True, message="Login réussi")
             else:
                 return LoginUtilisateur(utilisateur=None, ok=False, message="Mot de passe incorrect")
         except Utilisateur.DoesNotExist:
             return LoginUtilisateur(utilisateur=None, ok=False, message="Utilisateur non trouvé")
+        except LoginThrottled as e:
+            return LoginUtilisateur(utilisateur=None, ok=False, message=str(e))
 
 # --- Utilisateur ---
+def _set_picture(utilisateur, picture=None, picture_file=None):
+    # La photo est écrite dans le stockage des médias, la ligne ne garde que son nom
+    try:
+        if picture_file is not None:
+            store_avatar(utilisateur, file=picture_file)
+        elif picture:
+            store_avatar(utilisateur, content=decode_picture(picture))
+        elif picture == '':
+            utilisateur.picture = None
+    except AvatarError as e:
+        raise GraphQLError(str(e))
+
 class CreateUtilisateur(graphene.Mutation):
     class Arguments:
         nom = graphene.String(required=True)
@@ -43,16 +75,20 @@ class CreateUtilisateur(graphene.Mutation):
         contact = graphene.String()
         pays = graphene.String()
         ville = graphene.String()
+        # Photo en base64 (ancien format) ou fichier multipart
         picture = graphene.String()
+        picture_file = Upload()
         icone = graphene.String()
 
     utilisateur = graphene.Field(UtilisateurType)
 
     def mutate(self, info, **kwargs):
         mot_de_passe = kwargs.pop('mot_de_passe', None)
+        picture, picture_file = kwargs.pop('picture', None), kwargs.pop('picture_file', None)
         utilisateur = Utilisateur(**kwargs)
         if mot_de_passe:
             utilisateur.set_password(mot_de_passe)
+        _set_picture(utilisateur, picture, picture_file)
         utilisateur.save()
         return CreateUtilisateur(utilisateur=utilisateur)
 
@@ -70,6 +106,7 @@ class UpdateUtilisateur(graphene.Mutation):
         pays = graphene.String()
         ville = graphene.String()
         picture = graphene.String()
+        picture_file = Upload()
         icone = graphene.String()
 
     utilisateur = graphene.Field(UtilisateurType)
@@ -78,10 +115,12 @@ class UpdateUtilisateur(graphene.Mutation):
         try:
             utilisateur = Utilisateur.objects.get(pk=id)
             mot_de_passe = kwargs.pop('mot_de_passe', None)
+            picture, picture_file = kwargs.pop('picture', None), kwargs.pop('picture_file', None)
             for k, v in kwargs.items():
                 setattr(utilisateur, k, v)
             if mot_de_passe:
                 utilisateur.set_password(mot_de_passe)
+            _set_picture(utilisateur, picture, picture_file)
             utilisateur.save()
             return UpdateUtilisateur(utilisateur=utilisateur)
         except Utilisateur.DoesNotExist:
@@ -113,25 +152,80 @@ class UploadImage(graphene.Mutation):
 
     def mutate(self, info, file, description=None, id_utilisateur_partenaire=None, id_campaign=None):
         try:
-            image_obj = Image.objects.create(
-                image=file,
+            image_obj = store_image(
+                file,
                 description=description,
                 id_utilisateur_partenaire_id=id_utilisateur_partenaire
             )
+            schedule_variants(image_obj)
             # Si une campagne est précisée, rattacher l'image à la campagne
             if id_campaign:
-                campaign = Campaign.objects.get(pk=id_campaign)
-                CampaignImage.objects.create(id_campaign=campaign, id_image=image_obj)
-                # Compter le nombre d'images rattachées à cette campagne
-                nb_images = CampaignImage.objects.filter(id_campaign=campaign).count()
-                # Si la campagne était en 'upload' et a au moins 3 images, passer à 'pending'
-                if campaign.status == 'upload' and nb_images >= 3:
-                    campaign.status = 'pending'
-                    campaign.save()
+                attach_image_to_campaign(image_obj, id_campaign)
             return UploadImage(image_obj=image_obj, ok=True, message="Image uploadée avec succès")
         except Exception as e:
             return UploadImage(image_obj=None, ok=False, message=f"Erreur upload: {e}")
 
+# Upload en plusieurs morceaux : init -> append (autant de fois que nécessaire) -> finalize.
+# Après une coupure, imageUploadStatus donne l'offset à partir duquel reprendre.
+class InitImageUpload(graphene.Mutation):
+    class Arguments:
+        filename = graphene.String(required=True)
+        total_size = graphene.Float(required=True)
+        description = graphene.String()
+        id_utilisateur_partenaire = graphene.Int()
+        id_campaign = graphene.Int()
+
+    upload = graphene.Field(ImageUploadType)
+    ok = graphene.Boolean()
+    message = graphene.String()
+
+    def mutate(self, info, filename, total_size, **kwargs):
+        try:
+            upload = init_upload(filename, int(total_size), **kwargs)
+            return InitImageUpload(upload=upload, ok=True, message="Upload initialisé")
+        except UploadError as e:
+            return InitImageUpload(upload=None, ok=False, message=str(e))
+
+class AppendImageChunk(graphene.Mutation):
+    class Arguments:
+        upload_id = graphene.UUID(required=True)
+        offset = graphene.Float(required=True)
+        chunk = Upload(required=True)
+        checksum = graphene.String(required=True)
+
+    upload = graphene.Field(ImageUploadType)
+    ok = graphene.Boolean()
+    message = graphene.String()
+
+    def mutate(self, info, upload_id, offset, chunk, checksum):
+        try:
+            upload = append_chunk(upload_id, int(offset), chunk, checksum)
+            return AppendImageChunk(upload=upload, ok=True, message="Morceau reçu")
+        except ImageUpload.DoesNotExist:
+            return AppendImageChunk(upload=None, ok=False, message="Upload introuvable")
+        except UploadError as e:
+            return AppendImageChunk(upload=None, ok=False, message=str(e))
+
+class FinalizeImageUpload(graphene.Mutation):
+    class Arguments:
+        upload_id = graphene.UUID(required=True)
+        checksum = graphene.String()
+
+    image_obj = graphene.Field(ImageType)
+    ok = graphene.Boolean()
+    message = graphene.String()
+
+    def mutate(self, info, upload_id, checksum=None):
+        try:
+            image_obj = finalize_upload(upload_id, checksum)
+            return FinalizeImageUpload(image_obj=image_obj, ok=True, message="Image uploadée avec succès")
+        except ImageUpload.DoesNotExist:
+            return FinalizeImageUpload(image_obj=None, ok=False, message="Upload introuvable")
+        except UploadError as e:
+            return FinalizeImageUpload(image_obj=None, ok=False, message=str(e))
+        except Exception as e:
+            return FinalizeImageUpload(image_obj=None, ok=False, message=f"Erreur upload: {e}")
+
 # --- Display ---
 class CreateDisplay(graphene.Mutation):
     class Arguments:
@@ -212,25 +306,25 @@ class UpdateCampaign(graphene.Mutation):
         id_image = graphene.Int()
     campaign = graphene.Field(CampaignType)
     def mutate(self, info, id, **kwargs):
-        from datetime import date
         try:
             campaign = Campaign.objects.get(pk=id)
             status = kwargs.get('status', None)
             # Si le commercial annule (status 'cancelled'), repasser à 'upload' et supprimer les images rattachées
             if status == 'cancelled':
-                campaign_images = CampaignImage.objects.filter(id_campaign=campaign)
-                for ci in campaign_images:
-                    if ci.id_image and ci.id_image.image:
-                        ci.id_image.image.delete(save=False)
-                        ci.id_image.delete()
-                    ci.delete()
+                # Suppression en masse ; les fichiers sans autre référence sont supprimés
+                # après le commit par une tâche de fond
+                with transaction.atomic():
+                    image_ids = list(
+                        CampaignImage.objects.filter(id_campaign=campaign).values_list('id_image', flat=True)
+                    )
+                    # Les CampaignImage sont supprimées avec les Images
+                    release_images(image_ids)
                 kwargs['status'] = 'upload'
+                kwargs['nombre_images'] = 0
             # Si le commercial valide, passer à 'submitted'
             elif status == 'submitted':
                 kwargs['status'] = 'submitted'
-            # Si la campagne est soumise et la date de fin est passée, passer à 'completed'
-            elif campaign.status == 'submitted' and campaign.end_date and campaign.end_date <= date.today():
-                kwargs['status'] = 'completed'
+            # Le passage 'submitted' -> 'completed' à la date de fin est appliqué par run_lifecycle
             for k, v in kwargs.items():
                 if v is not None:
                     setattr(campaign, k, v)
@@ -238,6 +332,87 @@ class UpdateCampaign(graphene.Mutation):
             return UpdateCampaign(campaign=campaign)
         except Campaign.DoesNotExist:
             return None
+class CampaignInput(graphene.InputObjectType):
+    campaign_name = graphene.String(required=True)
+    status = graphene.String()
+    start_date = graphene.types.datetime.Date()
+    end_date = graphene.types.datetime.Date()
+    budget = graphene.Float()
+    description = graphene.String()
+    id_utilisateur_createur = graphene.Int()
+    id_image = graphene.Int()
+    id_displays = graphene.List(graphene.Int, required=False)
+
+class BulkCampaignResult(graphene.ObjectType):
+    index = graphene.Int()
+    ok = graphene.Boolean()
+    message = graphene.String()
+    campaign = graphene.Field(CampaignType)
+
+# Création de nombreuses campagnes : les ids référencés sont validés en une requête par table,
+# puis Campaign et CampaignDisplay sont écrits par bulk_create dans une seule transaction.
+class BulkCreateCampaigns(graphene.Mutation):
+    class Arguments:
+        campaigns = graphene.List(graphene.NonNull(CampaignInput), required=True)
+    results = graphene.List(BulkCampaignResult)
+    ok = graphene.Boolean()
+
+    def mutate(self, info, campaigns):
+        display_ids = {pk for item in campaigns for pk in (item.get('id_displays') or [])}
+        existing_displays = set(Display.objects.filter(pk__in=display_ids).values_list('pk', flat=True))
+        user_ids = {item.get('id_utilisateur_createur') for item in campaigns} - {None}
+        existing_users = set(Utilisateur.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        image_ids = {item.get('id_image') for item in campaigns} - {None}
+        existing_images = set(Image.objects.filter(pk__in=image_ids).values_list('pk', flat=True))
+        statuses = {value for value, _ in Campaign.STATUS_CHOICES}
+
+        results = []
+        valid = []
+        for index, item in enumerate(campaigns):
+            item = dict(item)
+            id_displays = item.pop('id_displays', None) or []
+            missing = sorted(set(id_displays) - existing_displays)
+            error = None
+            if missing:
+                error = f"Displays introuvables: {missing}"
+            elif item.get('id_utilisateur_createur') is not None and item['id_utilisateur_createur'] not in existing_users:
+                error = "Utilisateur créateur introuvable"
+            elif item.get('id_image') is not None and item['id_image'] not in existing_images:
+                error = "Image introuvable"
+            elif item.get('status') is not None and item['status'] not in statuses:
+                error = f"Statut invalide: {item['status']}"
+            elif item.get('start_date') and item.get('end_date') and item['start_date'] > item['end_date']:
+                error = "La date de début doit précéder la date de fin"
+            if error:
+                results.append(BulkCampaignResult(index=index, ok=False, message=error))
+                continue
+            if item.get('budget') is not None:
+                item['budget'] = Decimal(str(item['budget']))
+            item['id_utilisateur_createur_id'] = item.pop('id_utilisateur_createur', None)
+            item['id_image_id'] = item.pop('id_image', None)
+            if item.get('status') is None:
+                item.pop('status', None)
+            valid.append((index, Campaign(**item), list(dict.fromkeys(id_displays))))
+
+        with transaction.atomic():
+            created = Campaign.objects.bulk_create([campaign for _, campaign, _ in valid])
+            CampaignDisplay.objects.bulk_create([
+                CampaignDisplay(id_campaign=campaign, id_display_id=display_id)
+                for campaign, (_, _, id_displays) in zip(created, valid)
+                for display_id in id_displays
+            ])
+            # bulk_create n'envoie pas post_save
+            invalidate(Campaign, CampaignDisplay)
+            transaction.on_commit(lambda: playlist_index.mark_campaigns([campaign.pk for campaign in created]))
+            publish(CAMPAIGN, [campaign.pk for campaign in created])
+            record_changes(Campaign, [campaign.pk for campaign in created])
+
+        get_loaders(info).register(created)
+        for campaign, (index, _, _) in zip(created, valid):
+            results.append(BulkCampaignResult(index=index, ok=True, message="Campagne créée", campaign=campaign))
+        results.sort(key=lambda result: result.index)
+        return BulkCreateCampaigns(results=results, ok=all(result.ok for result in results))
+
 class DeleteCampaign(graphene.Mutation):
     class Arguments:
         id = graphene.Int(required=True)
@@ -262,15 +437,17 @@ class CreateRevenue(graphene.Mutation):
         id_display = graphene.Int()
     revenue_obj = graphene.Field(RevenueType)
     def mutate(self, info, revenue, source=None, description=None, date_revenue=None, id_utilisateur_partenaire=None, id_campaign=None, id_display=None):
-        revenue_obj = Revenue.objects.create(
-            revenue=revenue,
-            source=source,
-            description=description,
-            date_revenue=date_revenue,
-            id_utilisateur_partenaire_id=id_utilisateur_partenaire,
-            id_campaign_id=id_campaign,
-            id_display_id=id_display
-        )
+        with transaction.atomic():
+            revenue_obj = Revenue.objects.create(
+                revenue=revenue,
+                source=source,
+                description=description,
+                date_revenue=date_revenue,
+                id_utilisateur_partenaire_id=id_utilisateur_partenaire,
+                id_campaign_id=id_campaign,
+                id_display_id=id_display
+            )
+            apply_revenue(revenue_obj)
         return CreateRevenue(revenue_obj=revenue_obj)
 class UpdateRevenue(graphene.Mutation):
     class Arguments:
@@ -285,11 +462,15 @@ class UpdateRevenue(graphene.Mutation):
     revenue_obj = graphene.Field(RevenueType)
     def mutate(self, info, id, **kwargs):
         try:
-            revenue_obj = Revenue.objects.get(pk=id)
-            for k, v in kwargs.items():
-                if v is not None:
-                    setattr(revenue_obj, k, v)
-            revenue_obj.save()
+            with transaction.atomic():
+                revenue_obj = Revenue.objects.select_for_update().get(pk=id)
+                # Retirer l'ancienne valeur des agrégats avant d'appliquer la nouvelle
+                apply_revenue(revenue_obj, -1)
+                for k, v in kwargs.items():
+                    if v is not None:
+                        setattr(revenue_obj, k, v)
+                revenue_obj.save()
+                apply_revenue(revenue_obj)
             return UpdateRevenue(revenue_obj=revenue_obj)
         except Revenue.DoesNotExist:
             return None
@@ -299,7 +480,10 @@ class DeleteRevenue(graphene.Mutation):
     ok = graphene.Boolean()
     def mutate(self, info, id):
         try:
-            Revenue.objects.get(pk=id).delete()
+            with transaction.atomic():
+                revenue_obj = Revenue.objects.select_for_update().get(pk=id)
+                apply_revenue(revenue_obj, -1)
+                revenue_obj.delete()
             return DeleteRevenue(ok=True)
         except Revenue.DoesNotExist:
             return DeleteRevenue(ok=False)
@@ -313,6 +497,9 @@ class Mutation(graphene.ObjectType):
 
     # Image
     upload_image = UploadImage.Field()
+    init_image_upload = InitImageUpload.Field()
+    append_image_chunk = AppendImageChunk.Field()
+    finalize_image_upload = FinalizeImageUpload.Field()
 
     # Display
     create_display = CreateDisplay.Field()
@@ -321,6 +508,7 @@ class Mutation(graphene.ObjectType):
 
     # Campaign
     create_campaign = CreateCampaign.Field()
+    bulk_create_campaigns = BulkCreateCampaigns.Field()
     update_campaign = UpdateCampaign.Field()
     delete_campaign = DeleteCampaign.Field()
 
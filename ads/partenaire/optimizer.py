@@ -0,0 +1,89 @@
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language.ast import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+from .loaders import get_model_field
+
+
+def _selected_fields(field_nodes, info):
+    """Regroupe par nom les sous-champs sélectionnés (fragments compris)."""
+    selected = {}
+
+    def visit(selection_set):
+        if selection_set is None:
+            return
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                selected.setdefault(selection.name.value, []).append(selection)
+            elif isinstance(selection, FragmentSpreadNode):
+                visit(info.fragments[selection.name.value].selection_set)
+            elif isinstance(selection, InlineFragmentNode):
+                visit(selection.selection_set)
+
+    for node in field_nodes:
+        visit(node.selection_set)
+    return selected
+
+
+class _Plan:
+    def __init__(self):
+        self.only = set()
+        self.select_related = set()
+        self.prefetches = []
+
+
+def _collect(model, field_nodes, info, plan, prefix=''):
+    plan.only.add(prefix + model._meta.pk.name)
+    complete = True
+    for name, nodes in _selected_fields(field_nodes, info).items():
+        if name.startswith('__'):
+            continue
+        field = get_model_field(model, to_snake_case(name))
+        if field is None:
+            # Champ calculé par un resolver : on ne sait pas quelles colonnes il lit
+            complete = False
+        elif field.many_to_one:
+            plan.only.add(prefix + field.name)
+            plan.select_related.add(prefix + field.name)
+            _collect(field.related_model, nodes, info, plan, prefix + field.name + '__')
+        elif field.one_to_many:
+            inner = optimize_queryset(
+                field.related_model._default_manager.all(), info,
+                field_nodes=nodes, required=[field.field.name],
+            )
+            plan.prefetches.append(Prefetch(prefix + field.get_accessor_name(), queryset=inner))
+        elif field.concrete:
+            plan.only.add(prefix + field.name)
+    if not complete:
+        plan.only.update(prefix + f.name for f in model._meta.concrete_fields)
+
+
+def optimize_queryset(queryset, info, field_nodes=None, required=()):
+    """
+    Adapte `queryset` à la sélection GraphQL : only() sur les colonnes demandées,
+    select_related() pour les FK directes et Prefetch() pour les relations inverses.
+    """
+    if field_nodes is None:
+        field_nodes = info.field_nodes
+    plan = _Plan()
+    _collect(queryset.model, field_nodes, info, plan)
+    plan.only.update(required)
+    if plan.select_related:
+        queryset = queryset.select_related(*sorted(plan.select_related))
+    if plan.prefetches:
+        queryset = queryset.prefetch_related(*plan.prefetches)
+    return queryset.only(*sorted(plan.only))
+
+
+def connection_node_fields(info):
+    """Sous-champs `edges { node { ... } }` d'un champ de type connexion."""
+    edges = _selected_fields(info.field_nodes, info).get('edges', [])
+    return _selected_fields(edges, info).get('node', [])
+
+
+def is_selected(info, *path):
+    """Vrai si le sous-champ désigné par `path` (noms GraphQL) est demandé sous le champ courant."""
+    nodes = info.field_nodes
+    for name in path:
+        nodes = _selected_fields(nodes, info).get(name, [])
+    return bool(nodes)
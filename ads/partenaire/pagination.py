@@ -0,0 +1,137 @@
+import base64
+import json
+
+import graphene
+from django.db import connection
+from django.db.models import Q
+from graphql import GraphQLError
+
+from .loaders import get_loaders
+from .middleware import in_event_loop
+from .optimizer import connection_node_fields, is_selected, optimize_queryset
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Au-delà, le total d'une liste non filtrée est l'estimation du planificateur (PostgreSQL)
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+def estimated_rows(model):
+    """Nombre de lignes de la table d'après les statistiques de PostgreSQL (ANALYZE), ou None."""
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [model._meta.db_table])
+        row = cursor.fetchone()
+    # -1 : table jamais analysée
+    return row[0] if row and row[0] >= 0 else None
+
+
+class CountableConnection(graphene.relay.Connection):
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int(description=(
+        f"Nombre total d'éléments. Sans filtre, au-delà de {ESTIMATED_COUNT_THRESHOLD} lignes sous PostgreSQL : "
+        "estimation des statistiques de la table. Sinon COUNT exact sur les index des filtres."
+    ))
+
+    def resolve_total_count(root, info):
+        # Calculé seulement s'il est demandé
+        queryset = root.queryset
+        if not queryset.query.where:
+            # Non filtré : un COUNT parcourrait toute la table
+            estimate = estimated_rows(queryset.model)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return queryset.count()
+
+
+def _cursor_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def encode_cursor(obj, ordering):
+    values = [_cursor_value(getattr(obj, field.lstrip('-'))) for field in ordering]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, ordering):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise GraphQLError("Curseur invalide")
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise GraphQLError("Curseur invalide")
+    return values
+
+
+def _after_filter(ordering, values):
+    # (a, b) > (va, vb)  <=>  a > va OR (a = va AND b > vb), sens inversé pour les champs en '-'
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f'{name}__{lookup}': values[i]})
+        for previous, value in zip(ordering[:i], values[:i]):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    return condition
+
+
+def paginate(queryset, info, connection_type, ordering, first=None, after=None):
+    """
+    Pagination par curseur (keyset) : la page suivante repart des valeurs de tri de la
+    dernière ligne au lieu d'un OFFSET, le coût d'une page ne dépend donc pas de sa position.
+    Pagination vers l'avant seulement (`first` / `after`, pas de `last` / `before`).
+    Dans la boucle d'événements (AsyncGraphQLView), renvoie un awaitable.
+    """
+    if first is None:
+        first = DEFAULT_PAGE_SIZE
+    if first < 0:
+        raise GraphQLError("`first` doit être positif")
+    first = min(first, MAX_PAGE_SIZE)
+
+    page = queryset.order_by(*ordering)
+    previous = None
+    if after:
+        after_filter = _after_filter(ordering, decode_cursor(after, ordering))
+        page = page.filter(after_filter)
+        if is_selected(info, 'pageInfo', 'hasPreviousPage'):
+            # Lignes au niveau du curseur ou avant (une seule lecture d'index)
+            previous = queryset.filter(~after_filter)
+    page = optimize_queryset(
+        page, info,
+        field_nodes=connection_node_fields(info),
+        required=[field.lstrip('-') for field in ordering],
+    )[:first + 1]
+    if in_event_loop():
+        return _apaginate(queryset, info, connection_type, ordering, first, page, previous)
+    rows = list(page)
+    return _connection(queryset, info, connection_type, ordering, first, rows, previous is not None and previous.exists())
+
+
+async def _apaginate(queryset, info, connection_type, ordering, first, page, previous):
+    # AsyncGraphQLView : mêmes requêtes par l'ORM asynchrone, sans occuper de thread
+    rows = [row async for row in page]
+    has_previous_page = previous is not None and await previous.aexists()
+    return _connection(queryset, info, connection_type, ordering, first, rows, has_previous_page)
+
+
+def _connection(queryset, info, connection_type, ordering, first, rows, has_previous_page):
+    nodes = get_loaders(info).register(rows[:first])
+    edges = [
+        connection_type.Edge(node=node, cursor=encode_cursor(node, ordering))
+        for node in nodes
+    ]
+    connection = connection_type(
+        edges=edges,
+        page_info=graphene.relay.PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_previous_page,
+            has_next_page=len(rows) > first,
+        ),
+    )
+    connection.queryset = queryset
+    return connection
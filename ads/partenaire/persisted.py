@@ -0,0 +1,199 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from graphql import parse, validate
+
+from .models import PersistedQuery
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+class DocumentCache:
+    """
+    Cache LRU des documents GraphQL déjà analysés et validés, indexé par le SHA-256 du texte :
+    une requête déjà vue n'est ni re-parsée ni re-validée.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_document(self, schema, query, digest=None, validation_rules=None, max_errors=None):
+        """Renvoie (document, erreurs). Seuls les documents valides sont mis en cache."""
+        digest = digest or query_hash(query)
+        with self._lock:
+            entry = self._documents.get(digest)
+            if entry is not None:
+                self._documents.move_to_end(digest)
+                self.hits += 1
+                return entry[1], []
+            self.misses += 1
+
+        try:
+            document = parse(query)
+        except Exception as e:
+            return None, [e]
+        errors = validate(schema, document, validation_rules, max_errors)
+        if errors:
+            return document, errors
+
+        with self._lock:
+            self._documents[digest] = (query, document)
+            self._documents.move_to_end(digest)
+            while len(self._documents) > self.maxsize:
+                self._documents.popitem(last=False)
+                self.evictions += 1
+        return document, []
+
+    def get_query(self, digest):
+        with self._lock:
+            entry = self._documents.get(digest)
+            return entry[0] if entry is not None else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._documents),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+document_cache = DocumentCache(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+
+
+class RegisteredQueries:
+    """
+    Hashes présents dans la table PersistedQuery (restreinte par `filters`), mémorisés une fois
+    vérifiés ; les absents le sont GRAPHQL_PERSISTED_QUERIES_MISS_TTL secondes. Un document du
+    cache LRU a seulement été analysé et validé (HTTP hors liste, WebSocket), il n'est pas
+    enregistré pour autant.
+    """
+
+    def __init__(self, **filters):
+        self.filters = filters
+        self._digests = set()
+        self._misses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, digest):
+        now = time.monotonic()
+        with self._lock:
+            if digest in self._digests:
+                return True
+            if self._misses.get(digest, 0) > now:
+                return False
+        if not PersistedQuery.objects.filter(sha256=digest, **self.filters).exists():
+            with self._lock:
+                self._misses[digest] = now + settings.GRAPHQL_PERSISTED_QUERIES_MISS_TTL
+                self._misses.move_to_end(digest)
+                while len(self._misses) > settings.GRAPHQL_DOCUMENT_CACHE_SIZE:
+                    self._misses.popitem(last=False)
+            return False
+        self.add(digest)
+        return True
+
+    def add(self, digest):
+        with self._lock:
+            self._digests.add(digest)
+            self._misses.pop(digest, None)
+
+    def discard(self, digest):
+        with self._lock:
+            self._digests.discard(digest)
+
+
+# Toutes les requêtes enregistrées (protocole APQ), et la liste d'autorisation seule
+registered_queries = RegisteredQueries()
+allowed_queries = RegisteredQueries(automatique=False)
+
+
+def register_query(digest, query):
+    """
+    Enregistre une requête envoyée avec son hash (APQ), une fois analysée et validée ; au-delà de
+    GRAPHQL_AUTOMATIC_PERSISTED_QUERIES_MAX, les plus anciennes sont supprimées.
+    """
+    if digest in registered_queries:
+        return
+    _, created = PersistedQuery.objects.get_or_create(sha256=digest, defaults={'query': query, 'automatique': True})
+    if created:
+        stale = (
+            PersistedQuery.objects.filter(automatique=True).order_by('-date_creation')
+            .values_list('sha256', flat=True)[settings.GRAPHQL_AUTOMATIC_PERSISTED_QUERIES_MAX:]
+        )
+        PersistedQuery.objects.filter(sha256__in=list(stale)).delete()
+
+
+class PersistedQueryError(Exception):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+def resolve_persisted_query(query, extensions):
+    """
+    Protocole « automatic persisted queries » : le client envoie le hash seul ; s'il est inconnu,
+    il renvoie la requête complète avec le hash, à enregistrer (register_query) une fois validée.
+    Renvoie (texte de la requête, hash, à enregistrer).
+    """
+    persisted = (extensions or {}).get('persistedQuery')
+    allowlist = settings.GRAPHQL_PERSISTED_QUERIES_ALLOWLIST
+    known = allowed_queries if allowlist else registered_queries
+    if not persisted:
+        if allowlist and query:
+            digest = query_hash(query)
+            if digest not in allowed_queries:
+                raise PersistedQueryError("PersistedQueryNotAllowed", 'PERSISTED_QUERY_NOT_ALLOWED')
+            return query, digest, False
+        return query, None, False
+
+    digest = persisted.get('sha256Hash')
+    if not digest:
+        raise PersistedQueryError("persistedQuery.sha256Hash manquant", 'BAD_REQUEST')
+    if query:
+        if query_hash(query) != digest:
+            raise PersistedQueryError("provided sha does not match query", 'BAD_REQUEST')
+        if allowlist:
+            if digest not in allowed_queries:
+                raise PersistedQueryError("PersistedQueryNotAllowed", 'PERSISTED_QUERY_NOT_ALLOWED')
+            return query, digest, False
+        return query, digest, True
+
+    if digest not in known:
+        raise PersistedQueryError("PersistedQueryNotFound", 'PERSISTED_QUERY_NOT_FOUND')
+    # Texte repris du cache LRU s'il y est encore, sinon de la table
+    stored = document_cache.get_query(digest)
+    if stored is None:
+        stored = PersistedQuery.objects.filter(sha256=digest).values_list('query', flat=True).first()
+    if stored is None:
+        raise PersistedQueryError("PersistedQueryNotFound", 'PERSISTED_QUERY_NOT_FOUND')
+    return stored, digest, False
+
+
+def _persisted_query_saved(sender, instance, **kwargs):
+    registered_queries.add(instance.sha256)
+    if instance.automatique:
+        allowed_queries.discard(instance.sha256)
+    else:
+        allowed_queries.add(instance.sha256)
+
+
+def _persisted_query_deleted(sender, instance, **kwargs):
+    registered_queries.discard(instance.sha256)
+    allowed_queries.discard(instance.sha256)
+
+
+def connect_signals():
+    post_save.connect(_persisted_query_saved, sender=PersistedQuery, dispatch_uid='persisted-query-save')
+    post_delete.connect(_persisted_query_deleted, sender=PersistedQuery, dispatch_uid='persisted-query-delete')
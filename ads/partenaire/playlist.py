@@ -0,0 +1,188 @@
+import bisect
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from .models import Campaign, CampaignDisplay, CampaignImage, Display
+
+# Seules les campagnes validées par le commercial sont diffusées ('completed' : date de fin passée)
+PLAYABLE_STATUSES = ('submitted',)
+
+PlaylistEntry = namedtuple(
+    'PlaylistEntry', ['id_campaign', 'id_image', 'ordre_affichage', 'date_debut_affichage', 'date_fin_affichage'],
+)
+_Window = namedtuple('_Window', ['start', 'end', 'id_campaign'])
+
+
+class PlaylistIndex:
+    """
+    Index en mémoire des fenêtres de diffusion (campagne, display) des campagnes diffusables.
+
+    Pour chaque display, les fenêtres sont triées par date de début : une recherche par date
+    est une bissection suivie d'un filtre sur la date de fin, sans accès à la base. Les
+    modifications faites dans ce processus (signaux) ne rechargent que les displays et
+    campagnes touchés ; l'index est reconstruit en entier après PLAYLIST_INDEX_MAX_AGE
+    secondes pour prendre en compte les écritures des autres processus.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._windows = {}
+        self._starts = {}
+        self._creatives = {}
+        self._inactive_displays = set()
+        self._dirty_displays = set()
+        self._dirty_campaigns = set()
+
+    # --- Chargement ---
+
+    def _load_windows(self, display_ids=None):
+        queryset = CampaignDisplay.objects.filter(id_campaign__status__in=PLAYABLE_STATUSES)
+        if display_ids is not None:
+            queryset = queryset.filter(id_display__in=display_ids)
+        windows = defaultdict(list)
+        rows = queryset.values_list(
+            'id_display', 'id_campaign', 'date_debut_affichage', 'date_fin_affichage',
+            'id_campaign__start_date', 'id_campaign__end_date',
+        )
+        for id_display, id_campaign, debut, fin, start_date, end_date in rows.iterator():
+            # Sans dates propres au display, la fenêtre est celle de la campagne
+            start = debut or start_date or date.min
+            end = fin or end_date or date.max
+            windows[id_display].append(_Window(start, end, id_campaign))
+        return windows
+
+    def _set_windows(self, id_display, windows):
+        if windows:
+            windows.sort()
+            self._windows[id_display] = windows
+            self._starts[id_display] = [window.start for window in windows]
+        else:
+            self._windows.pop(id_display, None)
+            self._starts.pop(id_display, None)
+
+    def _load_creatives(self, campaign_ids=None):
+        queryset = CampaignImage.objects.order_by('ordre_affichage', 'id')
+        if campaign_ids is not None:
+            queryset = queryset.filter(id_campaign__in=campaign_ids)
+        creatives = defaultdict(list)
+        for id_campaign, id_image, ordre in queryset.values_list('id_campaign', 'id_image', 'ordre_affichage').iterator():
+            creatives[id_campaign].append((ordre, id_image))
+        return creatives
+
+    def _rebuild(self):
+        self._windows, self._starts = {}, {}
+        for id_display, windows in self._load_windows().items():
+            self._set_windows(id_display, windows)
+        self._creatives = dict(self._load_creatives())
+        self._inactive_displays = set(Display.objects.filter(actif=False).values_list('id', flat=True))
+        self._dirty_displays.clear()
+        self._dirty_campaigns.clear()
+        self._built_at = time.monotonic()
+
+    def _refresh(self):
+        if self._built_at is None or time.monotonic() - self._built_at > settings.PLAYLIST_INDEX_MAX_AGE:
+            self._rebuild()
+            return
+        if not self._dirty_displays and not self._dirty_campaigns:
+            return
+
+        campaigns = set(self._dirty_campaigns)
+        displays = set(self._dirty_displays)
+        self._dirty_campaigns.clear()
+        self._dirty_displays.clear()
+        if campaigns:
+            creatives = self._load_creatives(campaigns)
+            for id_campaign in campaigns:
+                self._creatives[id_campaign] = creatives.get(id_campaign, [])
+            # Le statut et les dates de la campagne changent les fenêtres de tous ses displays
+            displays.update(
+                CampaignDisplay.objects.filter(id_campaign__in=campaigns).values_list('id_display', flat=True)
+            )
+            displays.update(
+                id_display for id_display, windows in self._windows.items()
+                if any(window.id_campaign in campaigns for window in windows)
+            )
+        if displays:
+            windows = self._load_windows(displays)
+            for id_display in displays:
+                self._set_windows(id_display, windows.get(id_display, []))
+            inactive = set(Display.objects.filter(id__in=displays, actif=False).values_list('id', flat=True))
+            self._inactive_displays = (self._inactive_displays - displays) | inactive
+
+    # --- Signaux ---
+
+    def mark_displays(self, display_ids):
+        with self._lock:
+            self._dirty_displays.update(display_ids)
+
+    def mark_campaigns(self, campaign_ids):
+        with self._lock:
+            self._dirty_campaigns.update(campaign_ids)
+
+    # --- Lecture ---
+
+    def playlist(self, id_display, at):
+        """Créations à diffuser sur le display à la date `at`, dans l'ordre de diffusion."""
+        with self._lock:
+            self._refresh()
+            if id_display in self._inactive_displays or id_display not in self._windows:
+                return []
+            windows = self._windows[id_display]
+            active = [
+                window for window in windows[:bisect.bisect_right(self._starts[id_display], at)]
+                if window.end >= at
+            ]
+            entries = [
+                PlaylistEntry(
+                    window.id_campaign, id_image, ordre,
+                    None if window.start == date.min else window.start,
+                    None if window.end == date.max else window.end,
+                )
+                for window in active
+                for ordre, id_image in self._creatives.get(window.id_campaign, ())
+            ]
+        entries.sort(key=lambda entry: (entry.ordre_affichage, entry.id_campaign))
+        return entries
+
+
+playlist_index = PlaylistIndex()
+
+
+def _on_commit(callback, ids):
+    # Recharger après le commit, pour lire l'état validé
+    transaction.on_commit(lambda: callback(ids))
+
+
+def _campaign_display_changed(sender, instance, **kwargs):
+    _on_commit(playlist_index.mark_displays, [instance.id_display_id])
+
+
+def _display_changed(sender, instance, **kwargs):
+    _on_commit(playlist_index.mark_displays, [instance.pk])
+
+
+def _campaign_changed(sender, instance, **kwargs):
+    _on_commit(playlist_index.mark_campaigns, [instance.pk])
+
+
+def _campaign_image_changed(sender, instance, **kwargs):
+    _on_commit(playlist_index.mark_campaigns, [instance.id_campaign_id])
+
+
+def connect_signals():
+    handlers = (
+        (CampaignDisplay, _campaign_display_changed),
+        (Display, _display_changed),
+        (Campaign, _campaign_changed),
+        (CampaignImage, _campaign_image_changed),
+    )
+    for model, handler in handlers:
+        post_save.connect(handler, sender=model, dispatch_uid=f'playlist-save-{model.__name__}')
+        post_delete.connect(handler, sender=model, dispatch_uid=f'playlist-delete-{model.__name__}')
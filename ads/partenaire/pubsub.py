@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils.module_loading import import_string
+
+from .models import Campaign, CampaignDisplay
+
+logger = logging.getLogger(__name__)
+
+# Sujets publiés : clés = id de campagne / couple (id_campaign, id_display)
+CAMPAIGN = 'campaign'
+CAMPAIGN_DISPLAY = 'campaign_display'
+
+
+class SubscriptionOverflow(Exception):
+    pass
+
+
+class Subscriber:
+    """
+    File d'attente d'un abonnement, consommée dans la boucle d'événements de la connexion.
+
+    Les clés reçues sont filtrées par `accept` puis fusionnées : un client lent ne reçoit
+    qu'une fois un objet modifié plusieurs fois entre deux envois. Au-delà de
+    SUBSCRIPTION_MAX_PENDING clés en attente l'abonnement est interrompu (SubscriptionOverflow)
+    plutôt que de laisser la file grossir sans limite.
+    """
+
+    def __init__(self, accept=None):
+        self._loop = asyncio.get_running_loop()
+        self._accept = accept
+        self._pending = {}
+        self._ready = asyncio.Event()
+        self._overflow = False
+
+    def push(self, keys):
+        # Appelé depuis n'importe quel thread (signaux, écoute du canal)
+        try:
+            self._loop.call_soon_threadsafe(self._add, keys)
+        except RuntimeError:
+            pass  # boucle fermée : la connexion est terminée
+
+    def _add(self, keys):
+        for key in keys:
+            if self._accept is None or self._accept(key):
+                self._pending[key] = None
+        if len(self._pending) > settings.SUBSCRIPTION_MAX_PENDING:
+            self._overflow = True
+        if self._pending or self._overflow:
+            self._ready.set()
+
+    async def batches(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            if self._overflow:
+                raise SubscriptionOverflow("Client trop lent : abonnement interrompu")
+            keys, self._pending = list(self._pending), {}
+            if keys:
+                yield keys
+
+
+class LocalBroker:
+    """Diffusion des changements aux abonnés de ce processus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, topic, subscriber):
+        with self._lock:
+            self._subscribers[topic].add(subscriber)
+
+    def unsubscribe(self, topic, subscriber):
+        with self._lock:
+            self._subscribers[topic].discard(subscriber)
+
+    def send(self, topic, keys):
+        self.deliver(topic, keys)
+
+    def deliver(self, topic, keys):
+        with self._lock:
+            subscribers = list(self._subscribers[topic])
+        for subscriber in subscribers:
+            subscriber.push(keys)
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Diffusion entre processus par LISTEN / NOTIFY PostgreSQL : les écritures faites par les
+    workers WSGI, run_lifecycle ou flush_impressions atteignent les abonnés du serveur ASGI.
+    Une connexion dédiée écoute le canal dans un thread, démarré au premier abonnement.
+    """
+
+    CHANNEL = 'partenaire_events'
+    # Clés par notification (charge utile limitée à 8000 octets)
+    CHUNK_SIZE = 200
+
+    def __init__(self):
+        super().__init__()
+        self._thread = None
+
+    def subscribe(self, topic, subscriber):
+        super().subscribe(topic, subscriber)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='pubsub-listen', daemon=True)
+                self._thread.start()
+
+    def send(self, topic, keys):
+        with connections['default'].cursor() as cursor:
+            for start in range(0, len(keys), self.CHUNK_SIZE):
+                payload = json.dumps({'topic': topic, 'keys': keys[start:start + self.CHUNK_SIZE]})
+                cursor.execute('SELECT pg_notify(%s, %s)', [self.CHANNEL, payload])
+
+    def _notified(self, payload):
+        message = json.loads(payload)
+        # Les couples arrivent sous forme de listes JSON
+        keys = [tuple(key) if isinstance(key, list) else key for key in message['keys']]
+        self.deliver(message['topic'], keys)
+
+    def _listen(self):
+        from django.db.backends.postgresql.base import Database
+        from django.db.backends.postgresql.psycopg_any import is_psycopg3
+        while True:
+            try:
+                raw = Database.connect(**connections['default'].get_connection_params())
+                raw.autocommit = True
+                raw.cursor().execute(f'LISTEN {self.CHANNEL}')
+                while True:
+                    if is_psycopg3:
+                        for notify in raw.notifies(timeout=5):
+                            self._notified(notify.payload)
+                    elif select.select([raw], [], [], 5) != ([], [], []):
+                        raw.poll()
+                        while raw.notifies:
+                            self._notified(raw.notifies.pop(0).payload)
+            except Exception:
+                logger.exception("Écoute du canal %s interrompue, reconnexion", self.CHANNEL)
+                time.sleep(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.SUBSCRIPTION_BROKER)()
+        return _broker
+
+
+def publish(topic, keys):
+    """Publie les clés modifiées après le commit, pour que les abonnés relisent l'état validé."""
+    keys = list(keys)
+    if keys:
+        transaction.on_commit(lambda: get_broker().send(topic, keys))
+
+
+def _campaign_changed(sender, instance, **kwargs):
+    publish(CAMPAIGN, [instance.pk])
+
+
+def _campaign_display_changed(sender, instance, **kwargs):
+    publish(CAMPAIGN_DISPLAY, [(instance.id_campaign_id, instance.id_display_id)])
+
+
+def connect_signals():
+    for model, handler in ((Campaign, _campaign_changed), (CampaignDisplay, _campaign_display_changed)):
+        post_save.connect(handler, sender=model, dispatch_uid=f'pubsub-save-{model.__name__}')
+        post_delete.connect(handler, sender=model, dispatch_uid=f'pubsub-delete-{model.__name__}')
@@ -1,91 +1,241 @@
 import graphene
-from .models import Utilisateur, Image, Display, Campaign, CampaignDisplay, Revenue, CampaignImage
+from django.utils import timezone
+from graphql import GraphQLError
+from .models import Utilisateur, Image, Display, Campaign, CampaignDisplay, Revenue, CampaignImage, ImageUpload
+from .loaders import get_loaders
+from .middleware import async_capable, in_event_loop
+from .optimizer import optimize_queryset
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate
+from .playlist import playlist_index
+from .rollups import DIMENSIONS, GRANULARITIES, summarize
+from .sync import changes_since
 from .schema import (
     UtilisateurType, ImageType, DisplayType, CampaignType,
-    CampaignDisplayType, RevenueType, CampaignImageType
+    CampaignDisplayType, RevenueType, CampaignImageType, RevenueSummaryType, ImageUploadType, PlaylistItemType,
+    ChangesPage,
+    UtilisateurConnection, ImageConnection, DisplayConnection, CampaignConnection,
+    CampaignDisplayConnection, RevenueConnection, CampaignImageConnection,
 )
 
+# Tri des listes paginées : toujours terminé par `id` pour que le curseur soit unique.
+# L'ordre par id suit date_creation (auto_now_add) et s'appuie sur la clé primaire.
+DEFAULT_ORDERING = ('-id',)
+REVENUE_ORDERING = ('-date_revenue', '-id')  # idx_revenue_date
+
+
+def get_or_none(queryset, pk):
+    """Objet `pk` de `queryset` ou None ; awaitable dans la boucle d'événements (AsyncGraphQLView)."""
+    if in_event_loop():
+        return _aget_or_none(queryset, pk)
+    try:
+        return queryset.get(pk=pk)
+    except queryset.model.DoesNotExist:
+        return None
+
+
+async def _aget_or_none(queryset, pk):
+    try:
+        return await queryset.aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        return None
+
+
 class Query(graphene.ObjectType):
-    all_utilisateurs = graphene.List(UtilisateurType)
+    all_utilisateurs = graphene.Field(
+        UtilisateurConnection, first=graphene.Int(), after=graphene.String(),
+        role=graphene.String(),
+    )
     utilisateur_by_id = graphene.Field(UtilisateurType, id=graphene.Int(required=True))
 
-    all_images = graphene.List(ImageType)
+    all_images = graphene.Field(
+        ImageConnection, first=graphene.Int(), after=graphene.String(),
+        id_utilisateur_partenaire=graphene.Int(),
+    )
     image_by_id = graphene.Field(ImageType, id=graphene.Int(required=True))
 
-    all_displays = graphene.List(DisplayType)
-    display_by_id = graphene.Field(DisplayType, id=graphene.Int(required=True))
+    # État d'un upload en plusieurs morceaux (offset de reprise)
+    image_upload_status = graphene.Field(ImageUploadType, upload_id=graphene.UUID(required=True))
 
-    all_campaigns = graphene.List(CampaignType)
+    all_displays = graphene.Field(
+        DisplayConnection, first=graphene.Int(), after=graphene.String(),
+        actif=graphene.Boolean(), id_utilisateur_partenaire=graphene.Int(),
+    )
+    display_by_id = graphene.Field(DisplayType, id=graphene.Int(required=True))
+    # Créations à diffuser sur un display à une date (aujourd'hui par défaut), dans l'ordre
+    playlist_for_display = graphene.List(
+        PlaylistItemType, display_id=graphene.Int(required=True), at=graphene.types.datetime.Date(),
+    )
+
+    all_campaigns = graphene.Field(
+        CampaignConnection, first=graphene.Int(), after=graphene.String(),
+        status=graphene.String(), start_date_gte=graphene.types.datetime.Date(),
+        end_date_lte=graphene.types.datetime.Date(), id_utilisateur_createur=graphene.Int(),
+    )
     campaign_by_id = graphene.Field(CampaignType, id=graphene.Int(required=True))
 
-    all_campaign_displays = graphene.List(CampaignDisplayType)
+    all_campaign_displays = graphene.Field(
+        CampaignDisplayConnection, first=graphene.Int(), after=graphene.String(),
+        id_campaign=graphene.Int(), id_display=graphene.Int(),
+    )
     campaign_display_by_id = graphene.Field(CampaignDisplayType, id=graphene.Int(required=True))
 
-    all_revenues = graphene.List(RevenueType)
+    all_revenues = graphene.Field(
+        RevenueConnection, first=graphene.Int(), after=graphene.String(),
+        date_from=graphene.types.datetime.Date(), date_to=graphene.types.datetime.Date(),
+        id_utilisateur_partenaire=graphene.Int(), id_campaign=graphene.Int(), id_display=graphene.Int(),
+    )
     revenue_by_id = graphene.Field(RevenueType, id=graphene.Int(required=True))
-
-    all_campaign_images = graphene.List(CampaignImageType)
+    # Revenus agrégés par période (day, week, month), groupés par partenaire, campaign et/ou display
+    revenue_summary = graphene.List(
+        RevenueSummaryType, granularity=graphene.String(required=True),
+        date_from=graphene.types.datetime.Date(), date_to=graphene.types.datetime.Date(),
+        group_by=graphene.List(graphene.String),
+        id_utilisateur_partenaire=graphene.Int(), id_campaign=graphene.Int(), id_display=graphene.Int(),
+        description=(
+            "Revenus par période entre dateFrom et dateTo inclus. Une semaine ou un mois coupé par "
+            "une borne ne compte que ses jours compris dans l'intervalle ; periodStart reste le "
+            "début de la période."
+        ),
+    )
+
+    all_campaign_images = graphene.Field(
+        CampaignImageConnection, first=graphene.Int(), after=graphene.String(),
+        id_campaign=graphene.Int(),
+    )
     campaign_image_by_id = graphene.Field(CampaignImageType, id=graphene.Int(required=True))
 
-    def resolve_all_utilisateurs(root, info):
-        return Utilisateur.objects.all()
+    # Synchronisation incrémentale : changements depuis le jeton (vide pour tout recevoir)
+    changes_since = graphene.Field(ChangesPage, token=graphene.String(), first=graphene.Int())
+
+    @async_capable
+    def resolve_all_utilisateurs(root, info, first=None, after=None, role=None):
+        queryset = Utilisateur.objects.all()
+        if role:
+            queryset = queryset.filter(role=role)  # idx_utilisateurs_role
+        return paginate(queryset, info, UtilisateurConnection, DEFAULT_ORDERING, first, after)
 
+    @async_capable
     def resolve_utilisateur_by_id(root, info, id):
-        try:
-            return Utilisateur.objects.get(pk=id)
-        except Utilisateur.DoesNotExist:
-            return None
+        return get_or_none(optimize_queryset(Utilisateur.objects.all(), info), id)
 
-    def resolve_all_images(root, info):
-        return Image.objects.all()
+    @async_capable
+    def resolve_all_images(root, info, first=None, after=None, id_utilisateur_partenaire=None):
+        queryset = Image.objects.all()
+        if id_utilisateur_partenaire:
+            queryset = queryset.filter(id_utilisateur_partenaire_id=id_utilisateur_partenaire)
+        return paginate(queryset, info, ImageConnection, DEFAULT_ORDERING, first, after)
 
+    @async_capable
     def resolve_image_by_id(root, info, id):
-        try:
-            return Image.objects.get(pk=id)
-        except Image.DoesNotExist:
-            return None
+        return get_or_none(optimize_queryset(Image.objects.all(), info), id)
 
-    def resolve_all_displays(root, info):
-        return Display.objects.all()
-
-    def resolve_display_by_id(root, info, id):
+    def resolve_image_upload_status(root, info, upload_id):
         try:
-            return Display.objects.get(pk=id)
-        except Display.DoesNotExist:
+            return ImageUpload.objects.get(upload_id=upload_id)
+        except ImageUpload.DoesNotExist:
             return None
 
-    def resolve_all_campaigns(root, info):
-        return Campaign.objects.all()
+    @async_capable
+    def resolve_all_displays(root, info, first=None, after=None, actif=None, id_utilisateur_partenaire=None):
+        queryset = Display.objects.all()
+        if actif is not None:
+            queryset = queryset.filter(actif=actif)
+        if id_utilisateur_partenaire:
+            queryset = queryset.filter(id_utilisateur_partenaire_id=id_utilisateur_partenaire)
+        return paginate(queryset, info, DisplayConnection, DEFAULT_ORDERING, first, after)
 
+    @async_capable
+    def resolve_display_by_id(root, info, id):
+        return get_or_none(optimize_queryset(Display.objects.all(), info), id)
+
+    @async_capable
+    def resolve_all_campaigns(root, info, first=None, after=None, status=None,
+                              start_date_gte=None, end_date_lte=None, id_utilisateur_createur=None):
+        queryset = Campaign.objects.all()
+        if status:
+            queryset = queryset.filter(status=status)  # idx_campaign_status
+        # idx_campaign_dates
+        if start_date_gte:
+            queryset = queryset.filter(start_date__gte=start_date_gte)
+        if end_date_lte:
+            queryset = queryset.filter(end_date__lte=end_date_lte)
+        if id_utilisateur_createur:
+            queryset = queryset.filter(id_utilisateur_createur_id=id_utilisateur_createur)
+        return paginate(queryset, info, CampaignConnection, DEFAULT_ORDERING, first, after)
+
+    @async_capable
     def resolve_campaign_by_id(root, info, id):
-        try:
-            return Campaign.objects.get(pk=id)
-        except Campaign.DoesNotExist:
-            return None
-
-    def resolve_all_campaign_displays(root, info):
-        return CampaignDisplay.objects.all()
-
+        return get_or_none(optimize_queryset(Campaign.objects.all(), info), id)
+
+    @async_capable
+    def resolve_all_campaign_displays(root, info, first=None, after=None, id_campaign=None, id_display=None):
+        queryset = CampaignDisplay.objects.all()
+        if id_campaign:
+            queryset = queryset.filter(id_campaign_id=id_campaign)
+        if id_display:
+            queryset = queryset.filter(id_display_id=id_display)
+        return paginate(queryset, info, CampaignDisplayConnection, DEFAULT_ORDERING, first, after)
+
+    @async_capable
     def resolve_campaign_display_by_id(root, info, id):
-        try:
-            return CampaignDisplay.objects.get(pk=id)
-        except CampaignDisplay.DoesNotExist:
-            return None
-
-    def resolve_all_revenues(root, info):
-        return Revenue.objects.all()
-
+        return get_or_none(optimize_queryset(CampaignDisplay.objects.all(), info), id)
+
+    @async_capable
+    def resolve_all_revenues(root, info, first=None, after=None, date_from=None, date_to=None,
+                             id_utilisateur_partenaire=None, id_campaign=None, id_display=None):
+        queryset = Revenue.objects.all()
+        # idx_revenue_date
+        if date_from:
+            queryset = queryset.filter(date_revenue__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(date_revenue__lte=date_to)
+        if id_utilisateur_partenaire:
+            queryset = queryset.filter(id_utilisateur_partenaire_id=id_utilisateur_partenaire)
+        if id_campaign:
+            queryset = queryset.filter(id_campaign_id=id_campaign)
+        if id_display:
+            queryset = queryset.filter(id_display_id=id_display)
+        return paginate(queryset, info, RevenueConnection, REVENUE_ORDERING, first, after)
+
+    @async_capable
     def resolve_revenue_by_id(root, info, id):
-        try:
-            return Revenue.objects.get(pk=id)
-        except Revenue.DoesNotExist:
-            return None
-
-    def resolve_all_campaign_images(root, info):
-        return CampaignImage.objects.all()
-
+        return get_or_none(optimize_queryset(Revenue.objects.all(), info), id)
+
+    def resolve_playlist_for_display(root, info, display_id, at=None):
+        entries = playlist_index.playlist(display_id, at or timezone.localdate())
+        loaders = get_loaders(info)
+        loaders.prime(Campaign, {entry.id_campaign for entry in entries})
+        loaders.prime(Image, {entry.id_image for entry in entries})
+        return entries
+
+    def resolve_revenue_summary(root, info, granularity, date_from=None, date_to=None, group_by=None,
+                                id_utilisateur_partenaire=None, id_campaign=None, id_display=None):
+        if granularity not in GRANULARITIES:
+            raise GraphQLError(f"Granularité inconnue: {granularity}")
+        group_by = group_by or []
+        for dimension in group_by:
+            if dimension not in DIMENSIONS:
+                raise GraphQLError(f"Regroupement inconnu: {dimension}")
+        # Liste déjà évaluée : sous AsyncGraphQLView elle est parcourue dans la boucle d'événements
+        return summarize(
+            granularity, date_from, date_to, group_by,
+            partenaire=id_utilisateur_partenaire, campaign=id_campaign, display=id_display,
+        )
+
+    @async_capable
+    def resolve_all_campaign_images(root, info, first=None, after=None, id_campaign=None):
+        queryset = CampaignImage.objects.all()
+        if id_campaign:
+            queryset = queryset.filter(id_campaign_id=id_campaign)
+        return paginate(queryset, info, CampaignImageConnection, DEFAULT_ORDERING, first, after)
+
+    @async_capable
     def resolve_campaign_image_by_id(root, info, id):
-        try:
-            return CampaignImage.objects.get(pk=id)
-        except CampaignImage.DoesNotExist:
-            return None
+        return get_or_none(optimize_queryset(CampaignImage.objects.all(), info), id)
+
+    def resolve_changes_since(root, info, token=None, first=None):
+        if first is None:
+            first = DEFAULT_PAGE_SIZE
+        if first <= 0:
+            raise GraphQLError("`first` doit être positif")
+        return changes_since(token, min(first, MAX_PAGE_SIZE))
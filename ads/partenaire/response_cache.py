@@ -0,0 +1,220 @@
+import hashlib
+import json
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from graphql import (
+    FieldNode, FragmentDefinitionNode, FragmentSpreadNode, InlineFragmentNode, OperationType,
+    get_named_type, get_operation_ast, is_object_type, print_ast,
+)
+from graphql_jwt.utils import get_http_authorization
+
+from .models import (
+    Campaign, CampaignDisplay, CampaignImage, Display, Image, ImageUpload, ImageVariant,
+    Revenue, RevenueRollup, Utilisateur,
+)
+
+# Modèles dont les changements invalident les réponses en cache
+CACHED_MODELS = (
+    Utilisateur, Image, ImageVariant, Display, Campaign, CampaignDisplay, Revenue, CampaignImage,
+    ImageUpload,
+)
+
+# Types GraphQL calculés à partir de modèles qu'ils n'exposent pas directement
+TYPE_DEPENDENCIES = {
+    'ImageType': (ImageVariant,),  # champ url
+    'RevenueSummaryType': (Revenue, RevenueRollup),
+    'PlaylistItemType': (Campaign, CampaignDisplay, CampaignImage, Display),
+}
+
+# Types dont la réponse dépend aussi de l'heure (SYNC_SETTLE_SECONDS) : jamais mis en cache
+UNCACHED_TYPES = {'ChangesPage'}
+
+
+def _cache():
+    return caches[settings.GRAPHQL_RESPONSE_CACHE_ALIAS]
+
+
+def _version_key(model):
+    return f'gql:version:{model._meta.label_lower}'
+
+
+def _bump(models):
+    # Jeton aléatoire plutôt qu'un compteur : une version évincée du cache ne peut jamais
+    # redonner une ancienne clé.
+    _cache().set_many({_version_key(model): uuid.uuid4().hex for model in models}, None)
+
+
+class _PendingBump:
+    """Modèles modifiés par la transaction en cours, dont la version change une fois au commit."""
+
+    def __init__(self, run_on_commit):
+        self.run_on_commit = run_on_commit
+        self.models = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        _bump(self.models)
+
+
+_local = threading.local()
+
+
+def _pending():
+    pending = getattr(_local, 'pending', None)
+    # Liste des callbacks remplacée au commit et au rollback : transaction terminée
+    if pending is None or pending.done or pending.run_on_commit is not connection.run_on_commit:
+        return None
+    return pending
+
+
+def invalidate(*models):
+    """
+    Change la version des modèles : les réponses qui en dépendent ne sont plus atteignables.
+    Dans une transaction, une seule écriture par modèle, au commit, quel que soit le nombre de
+    lignes modifiées ; d'ici là, la transaction ne lit ni n'écrit en cache les réponses qui
+    dépendent de ces modèles.
+    """
+    if not settings.GRAPHQL_RESPONSE_CACHE_ALIAS:
+        return
+    if not connection.in_atomic_block:
+        _bump(models)
+        return
+    pending = _pending()
+    if pending is None:
+        pending = _local.pending = _PendingBump(connection.run_on_commit)
+        transaction.on_commit(pending)
+    pending.models.update(models)
+
+
+def _on_change(sender, **kwargs):
+    invalidate(sender)
+
+
+def connect_signals():
+    for model in CACHED_MODELS:
+        post_save.connect(_on_change, sender=model, dispatch_uid=f'gql-cache-save-{model.__name__}')
+        post_delete.connect(_on_change, sender=model, dispatch_uid=f'gql-cache-delete-{model.__name__}')
+
+
+class _Uncached(Exception):
+    pass
+
+
+def _dependencies(schema, document, operation):
+    """Modèles lus par l'opération, déduits des types GraphQL de la sélection."""
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+    models = set()
+
+    def visit(selection_set, parent_type):
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field = parent_type.fields.get(selection.name.value)
+                if field is None:
+                    continue
+                named_type = get_named_type(field.type)
+                if named_type.name in UNCACHED_TYPES:
+                    raise _Uncached
+                meta = getattr(getattr(named_type, 'graphene_type', None), '_meta', None)
+                if getattr(meta, 'model', None) is not None:
+                    models.add(meta.model)
+                models.update(TYPE_DEPENDENCIES.get(named_type.name, ()))
+                if selection.selection_set and is_object_type(named_type):
+                    visit(selection.selection_set, named_type)
+            elif isinstance(selection, InlineFragmentNode):
+                condition = selection.type_condition
+                visit(selection.selection_set, schema.get_type(condition.name.value) if condition else parent_type)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = fragments[selection.name.value]
+                visit(fragment.selection_set, schema.get_type(fragment.type_condition.name.value))
+
+    visit(operation.selection_set, schema.query_type)
+    return sorted(models, key=lambda model: model._meta.label_lower)
+
+
+class _QueryInfo:
+    """Forme normalisée et dépendances de chaque document, calculées une seule fois."""
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, schema, document, digest, operation_name):
+        key = (digest, operation_name)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        operation = get_operation_ast(document, operation_name)
+        if operation is None or operation.operation != OperationType.QUERY:
+            entry = None
+        else:
+            normalized = hashlib.sha256(print_ast(document).encode()).hexdigest()
+            try:
+                entry = (normalized, _dependencies(schema, document, operation))
+            except _Uncached:
+                entry = None
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+
+_query_info = _QueryInfo()
+
+
+def _identity(request):
+    user = getattr(request, 'user', None)
+    user_id = user.pk if user is not None and user.is_authenticated else 'anon'
+    token = get_http_authorization(request) or ''
+    return f'{user_id}:{hashlib.sha256(token.encode()).hexdigest()}'
+
+
+def cache_key(schema, request, document, digest, operation_name, variables):
+    """Clé de cache de la réponse, ou None si l'opération n'est pas une lecture cachable."""
+    if not settings.GRAPHQL_RESPONSE_CACHE_ALIAS or getattr(request, 'FILES', None):
+        return None
+    info = _query_info.get(schema, document, digest, operation_name)
+    if info is None:
+        return None
+    normalized, models = info
+    pending = _pending()
+    if pending is not None and pending.models.intersection(models):
+        # Écritures de la transaction pas encore publiées : l'ancienne version serait relue
+        return None
+
+    cache = _cache()
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        versions.update(cache.get_many(list(missing)))
+
+    parts = json.dumps(
+        [normalized, operation_name, variables or {}, _identity(request), [versions.get(key) for key in keys]],
+        sort_keys=True, cls=DjangoJSONEncoder,
+    )
+    return f'gql:response:{hashlib.sha256(parts.encode()).hexdigest()}'
+
+
+def get_response(key):
+    return _cache().get(key)
+
+
+def store_response(key, data):
+    _cache().set(key, data)
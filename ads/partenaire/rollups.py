@@ -0,0 +1,154 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+from .models import Revenue, RevenueRollup
+from .response_cache import invalidate
+
+GRANULARITIES = ('day', 'week', 'month')
+
+TRUNC_FUNCTIONS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+DIMENSIONS = {
+    'partenaire': 'id_utilisateur_partenaire',
+    'campaign': 'id_campaign',
+    'display': 'id_display',
+}
+
+
+def period_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_period_start(day, granularity):
+    start = period_start(day, granularity)
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def apply_revenue(revenue_obj, sign=1):
+    """Ajoute (sign=1) ou retire (sign=-1) un revenu des agrégats, par incrément atomique."""
+    if revenue_obj.date_revenue is None or revenue_obj.revenue is None:
+        return
+    amount = Decimal(str(revenue_obj.revenue)) * sign
+    for granularity in GRANULARITIES:
+        keys = {
+            'granularity': granularity,
+            'period_start': period_start(revenue_obj.date_revenue, granularity),
+            'id_utilisateur_partenaire_id': revenue_obj.id_utilisateur_partenaire_id,
+            'id_campaign_id': revenue_obj.id_campaign_id,
+            'id_display_id': revenue_obj.id_display_id,
+        }
+        increment = {'total': F('total') + amount, 'nombre': F('nombre') + sign}
+        if RevenueRollup.objects.filter(**keys).update(**increment):
+            continue
+        try:
+            with transaction.atomic():
+                RevenueRollup.objects.create(total=amount, nombre=sign, **keys)
+        except IntegrityError:
+            # Ligne créée entre-temps par une écriture concurrente (unique_revenue_rollup_key)
+            RevenueRollup.objects.filter(**keys).update(**increment)
+
+
+def rebuild_rollups(batch_size=1000):
+    """Recalcule entièrement la table d'agrégats à partir de `Revenue`."""
+    with transaction.atomic():
+        RevenueRollup.objects.all().delete()
+        for granularity in GRANULARITIES:
+            rows = (
+                Revenue.objects
+                .annotate(period=TRUNC_FUNCTIONS[granularity]('date_revenue'))
+                .values('period', 'id_utilisateur_partenaire', 'id_campaign', 'id_display')
+                .annotate(total=Sum('revenue'), nombre=Count('id'))
+                .order_by()
+            )
+            RevenueRollup.objects.bulk_create(
+                (
+                    RevenueRollup(
+                        granularity=granularity,
+                        period_start=row['period'],
+                        id_utilisateur_partenaire_id=row['id_utilisateur_partenaire'],
+                        id_campaign_id=row['id_campaign'],
+                        id_display_id=row['id_display'],
+                        total=row['total'],
+                        nombre=row['nombre'],
+                    )
+                    for row in rows.iterator()
+                ),
+                batch_size=batch_size,
+            )
+        invalidate(RevenueRollup)
+
+
+def _rollup_rows(granularity, fields, filters, period_filter):
+    queryset = RevenueRollup.objects.filter(period_filter, granularity=granularity)
+    for dimension, value in filters.items():
+        if value:
+            queryset = queryset.filter(**{f'{DIMENSIONS[dimension]}_id': value})
+    return queryset.values(*fields).annotate(total=Sum('total'), nombre=Sum('nombre')).order_by()
+
+
+def summarize(granularity, date_from=None, date_to=None, group_by=(), **filters):
+    """
+    Somme des revenus par période (et par dimensions de `group_by`) lue dans les agrégats.
+
+    Les périodes entièrement comprises entre date_from et date_to sont lues dans les agrégats
+    de la granularité demandée. Une période coupée par une borne ne compte que ses jours
+    compris dans l'intervalle, lus dans les agrégats journaliers ; elle garde son
+    period_start (début de semaine ou de mois).
+    """
+    fields = ['period_start'] + [DIMENSIONS[dimension] for dimension in group_by]
+    # Périodes complètes : [first_full, after_full[
+    first_full = after_full = None
+    full = Q()
+    if date_from:
+        first_full = period_start(date_from, granularity)
+        if first_full != date_from:
+            first_full = next_period_start(date_from, granularity)
+        full &= Q(period_start__gte=first_full)
+    if date_to:
+        after_full = period_start(date_to + timedelta(days=1), granularity)
+        full &= Q(period_start__lt=after_full)
+    rows = {}
+    for row in _rollup_rows(granularity, fields, filters, full):
+        rows[tuple(row[field] for field in fields)] = row
+
+    # Jours des périodes coupées, sans sortir de l'intervalle (bornes dans la même période)
+    edges = Q()
+    if first_full is not None and first_full != date_from:
+        edges |= Q(period_start__lt=first_full)
+    if after_full is not None and after_full <= date_to:
+        edges |= Q(period_start__gte=after_full)
+    if granularity != 'day' and edges:
+        if date_from:
+            edges &= Q(period_start__gte=date_from)
+        if date_to:
+            edges &= Q(period_start__lte=date_to)
+        for row in _rollup_rows('day', fields, filters, edges):
+            row['period_start'] = period_start(row['period_start'], granularity)
+            key = tuple(row[field] for field in fields)
+            if key in rows:
+                rows[key]['total'] += row['total']
+                rows[key]['nombre'] += row['nombre']
+            else:
+                rows[key] = row
+
+    # Tri sur les clés : les dimensions peuvent être nulles
+    return [
+        rows[key] for key in sorted(rows, key=lambda key: [(value is None, value) for value in key])
+        if rows[key]['nombre'] > 0
+    ]
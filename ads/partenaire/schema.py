@@ -1,38 +1,261 @@
 import graphene
+from django.urls import reverse
 from graphene_django import DjangoObjectType
-from .models import Utilisateur, Image, Display, Campaign, CampaignDisplay, Revenue, CampaignImage
+from .models import Utilisateur, Image, Display, Campaign, CampaignDisplay, Revenue, CampaignImage, ImageUpload
+from .avatars import avatar_etag
+from .images import best_variant
+from .loaders import get_loaders, resolve_related
+from .middleware import async_capable
+from .pagination import CountableConnection
+
+# Les relations (FK et relations inverses) passent par les loaders de la requête
+# pour être résolues avec une seule requête par niveau au lieu d'une par objet.
+# Elles sont `async_capable` : sous AsyncGraphQLView, une relation déjà chargée est
+# résolue dans la boucle d'événements, sans passer par un thread.
 
 class UtilisateurType(DjangoObjectType):
     class Meta:
         model = Utilisateur
-        fields = "__all__"
+        # Uploads en cours : lus seulement par imageUploadStatus
+        exclude = ('image_uploads',)
+
+    # URL de la photo (servie avec ETag / Last-Modified), versionnée par le hash du contenu
+    picture_url = graphene.String()
+
+    def resolve_picture_url(root, info):
+        if not root.picture:
+            return None
+        url = f"{reverse('avatar', args=[root.pk])}?v={avatar_etag(root.picture.name)[:12]}"
+        if hasattr(info.context, 'build_absolute_uri'):
+            url = info.context.build_absolute_uri(url)
+        return url
+
+    @async_capable
+    def resolve_images(root, info):
+        return resolve_related(info, root, 'images')
+
+    @async_capable
+    def resolve_displays(root, info):
+        return resolve_related(info, root, 'displays')
+
+    @async_capable
+    def resolve_created_campaigns(root, info):
+        return resolve_related(info, root, 'created_campaigns')
+
+    @async_capable
+    def resolve_revenues(root, info):
+        return resolve_related(info, root, 'revenues')
 
 class ImageType(DjangoObjectType):
     class Meta:
         model = Image
-        fields = "__all__"
+        # Uploads en cours : lus seulement par imageUploadStatus
+        exclude = ('imageupload_set',)
+
+    # URL de la meilleure variante prête pour la taille / le format demandés, sinon de l'original
+    url = graphene.String(size=graphene.Int(), format=graphene.String())
+
+    def resolve_url(root, info, size=None, format=None):
+        variants = get_loaders(info).load_related(root, 'variants')
+        variant = best_variant(variants, size, format)
+        file = variant.file if variant else root.image
+        if not file:
+            return None
+        url = file.url
+        if hasattr(info.context, 'build_absolute_uri'):
+            url = info.context.build_absolute_uri(url)
+        return url
+
+    @async_capable
+    def resolve_id_utilisateur_partenaire(root, info):
+        return resolve_related(info, root, 'id_utilisateur_partenaire')
+
+    @async_capable
+    def resolve_campaign_set(root, info):
+        return resolve_related(info, root, 'campaign_set')
+
+    @async_capable
+    def resolve_campaignimage_set(root, info):
+        return resolve_related(info, root, 'campaignimage_set')
 
 class DisplayType(DjangoObjectType):
     class Meta:
         model = Display
-        fields = "__all__"
+        exclude = ('cle_impressions',)
+
+    @async_capable
+    def resolve_id_utilisateur_partenaire(root, info):
+        return resolve_related(info, root, 'id_utilisateur_partenaire')
+
+    @async_capable
+    def resolve_campaigndisplay_set(root, info):
+        return resolve_related(info, root, 'campaigndisplay_set')
+
+    @async_capable
+    def resolve_revenue_set(root, info):
+        return resolve_related(info, root, 'revenue_set')
 
 class CampaignType(DjangoObjectType):
     class Meta:
         model = Campaign
-        fields = "__all__"
+        # Uploads en cours : lus seulement par imageUploadStatus
+        exclude = ('imageupload_set',)
+
+    @async_capable
+    def resolve_id_utilisateur_createur(root, info):
+        return resolve_related(info, root, 'id_utilisateur_createur')
+
+    @async_capable
+    def resolve_id_image(root, info):
+        return resolve_related(info, root, 'id_image')
+
+    @async_capable
+    def resolve_campaigndisplay_set(root, info):
+        return resolve_related(info, root, 'campaigndisplay_set')
+
+    @async_capable
+    def resolve_revenue_set(root, info):
+        return resolve_related(info, root, 'revenue_set')
+
+    @async_capable
+    def resolve_campaignimage_set(root, info):
+        return resolve_related(info, root, 'campaignimage_set')
 
 class CampaignDisplayType(DjangoObjectType):
     class Meta:
         model = CampaignDisplay
         fields = "__all__"
 
+    @async_capable
+    def resolve_id_campaign(root, info):
+        return resolve_related(info, root, 'id_campaign')
+
+    @async_capable
+    def resolve_id_display(root, info):
+        return resolve_related(info, root, 'id_display')
+
 class RevenueType(DjangoObjectType):
     class Meta:
         model = Revenue
         fields = "__all__"
 
+    @async_capable
+    def resolve_id_utilisateur_partenaire(root, info):
+        return resolve_related(info, root, 'id_utilisateur_partenaire')
+
+    @async_capable
+    def resolve_id_campaign(root, info):
+        return resolve_related(info, root, 'id_campaign')
+
+    @async_capable
+    def resolve_id_display(root, info):
+        return resolve_related(info, root, 'id_display')
+
 class CampaignImageType(DjangoObjectType):
     class Meta:
         model = CampaignImage
         fields = "__all__"
+
+    @async_capable
+    def resolve_id_campaign(root, info):
+        return resolve_related(info, root, 'id_campaign')
+
+    @async_capable
+    def resolve_id_image(root, info):
+        return resolve_related(info, root, 'id_image')
+
+class ImageUploadType(DjangoObjectType):
+    class Meta:
+        model = ImageUpload
+        fields = ("upload_id", "filename", "total_size", "received_size", "status", "id_image", "date_modification")
+
+    @async_capable
+    def resolve_id_image(root, info):
+        return resolve_related(info, root, 'id_image')
+
+class RevenueSummaryType(graphene.ObjectType):
+    period_start = graphene.types.datetime.Date()
+    id_utilisateur_partenaire = graphene.Int()
+    id_campaign = graphene.Int()
+    id_display = graphene.Int()
+    total = graphene.Decimal()
+    nombre = graphene.Int()
+
+
+class PlaylistItemType(graphene.ObjectType):
+    """Création à diffuser sur un display (voir partenaire.playlist)."""
+    ordre_affichage = graphene.Int()
+    date_debut_affichage = graphene.types.datetime.Date()
+    date_fin_affichage = graphene.types.datetime.Date()
+    id_campaign = graphene.Field(CampaignType)
+    id_image = graphene.Field(ImageType)
+
+    def resolve_id_campaign(root, info):
+        return get_loaders(info).load(Campaign, root.id_campaign)
+
+    def resolve_id_image(root, info):
+        return get_loaders(info).load(Image, root.id_image)
+
+
+# --- Connexions (pagination par curseur des listes) ---
+class UtilisateurConnection(CountableConnection):
+    class Meta:
+        node = UtilisateurType
+
+class ImageConnection(CountableConnection):
+    class Meta:
+        node = ImageType
+
+class DisplayConnection(CountableConnection):
+    class Meta:
+        node = DisplayType
+
+class CampaignConnection(CountableConnection):
+    class Meta:
+        node = CampaignType
+
+class CampaignDisplayConnection(CountableConnection):
+    class Meta:
+        node = CampaignDisplayType
+
+class RevenueConnection(CountableConnection):
+    class Meta:
+        node = RevenueType
+
+class CampaignImageConnection(CountableConnection):
+    class Meta:
+        node = CampaignImageType
+
+# --- Synchronisation incrémentale (changesSince) ---
+
+class TombstoneType(graphene.ObjectType):
+    # Nom du modèle dans le journal : campaign, display, image, campaign_image
+    model = graphene.String()
+    id = graphene.Int()
+
+class ChangesPage(graphene.ObjectType):
+    """Page de partenaire.sync.changes_since : objets à jour par modèle et suppressions."""
+    campaigns = graphene.List(graphene.NonNull(CampaignType))
+    displays = graphene.List(graphene.NonNull(DisplayType))
+    images = graphene.List(graphene.NonNull(ImageType))
+    campaign_images = graphene.List(graphene.NonNull(CampaignImageType))
+    tombstones = graphene.List(graphene.NonNull(TombstoneType))
+    # Jeton à renvoyer au prochain appel ; has_more : page pleine, d'autres changements suivent
+    token = graphene.String()
+    has_more = graphene.Boolean()
+
+    @async_capable
+    def resolve_campaigns(root, info):
+        return get_loaders(info).register(root['campaign'])
+
+    @async_capable
+    def resolve_displays(root, info):
+        return get_loaders(info).register(root['display'])
+
+    @async_capable
+    def resolve_images(root, info):
+        return get_loaders(info).register(root['image'])
+
+    @async_capable
+    def resolve_campaign_images(root, info):
+        return get_loaders(info).register(root['campaign_image'])
@@ -0,0 +1,56 @@
+import graphene
+from asgiref.sync import sync_to_async
+from .models import Campaign, CampaignDisplay
+from .loaders import get_loaders, reset_loaders
+from .pubsub import CAMPAIGN, CAMPAIGN_DISPLAY, Subscriber, get_broker
+from .schema import CampaignType, CampaignDisplayType
+
+# Abonnements servis en WebSocket (partenaire.websocket, protocole graphql-transport-ws).
+# Chaque événement est l'objet relu en base après le commit de la modification.
+
+
+async def _changes(topic, accept=None):
+    """Lots de clés modifiées sur `topic`, jusqu'à la fin de l'abonnement."""
+    subscriber = Subscriber(accept)
+    broker = get_broker()
+    broker.subscribe(topic, subscriber)
+    try:
+        async for keys in subscriber.batches():
+            yield keys
+    finally:
+        broker.unsubscribe(topic, subscriber)
+
+
+@sync_to_async
+def _load(info, queryset):
+    # Nouveaux loaders à chaque lot : les relations sont relues avec l'objet
+    reset_loaders(info.context)
+    return get_loaders(info).register(queryset)
+
+
+class Subscription(graphene.ObjectType):
+    # Statut, dates, nombre d'images... : remplace l'interrogation périodique de campaign_by_id
+    campaign_updated = graphene.Field(CampaignType, ids=graphene.List(graphene.NonNull(graphene.Int)))
+    # Compteurs d'affichage (nombre_affichages), écrits par lots par partenaire.impressions
+    campaign_display_updated = graphene.Field(
+        CampaignDisplayType, campaign_id=graphene.Int(), display_id=graphene.Int(),
+    )
+
+    async def subscribe_campaign_updated(root, info, ids=None):
+        wanted = set(ids) if ids else None
+        async for keys in _changes(CAMPAIGN, None if wanted is None else wanted.__contains__):
+            for campaign in await _load(info, Campaign.objects.filter(pk__in=keys).order_by('pk')):
+                yield campaign
+
+    async def subscribe_campaign_display_updated(root, info, campaign_id=None, display_id=None):
+        def accept(key):
+            return (campaign_id is None or key[0] == campaign_id) and (display_id is None or key[1] == display_id)
+
+        async for keys in _changes(CAMPAIGN_DISPLAY, accept):
+            pairs = set(keys)
+            queryset = CampaignDisplay.objects.filter(
+                id_campaign__in={key[0] for key in pairs}, id_display__in={key[1] for key in pairs},
+            ).order_by('pk')
+            for campaign_display in await _load(info, queryset):
+                if (campaign_display.id_campaign_id, campaign_display.id_display_id) in pairs:
+                    yield campaign_display
@@ -0,0 +1,104 @@
+import base64
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from graphql import GraphQLError
+
+from .models import Campaign, CampaignImage, ChangeLogEntry, Display, Image
+
+# Objets synchronisés par changesSince : nom dans le journal -> modèle
+SYNCED_MODELS = {
+    'campaign': Campaign,
+    'display': Display,
+    'image': Image,
+    'campaign_image': CampaignImage,
+}
+_NAMES = {model: name for name, model in SYNCED_MODELS.items()}
+
+
+def record_changes(model, ids, deleted=False):
+    """
+    Inscrit au journal les objets créés / modifiés (ou supprimés) de `model`, dans la
+    transaction de l'écriture. À appeler après les update() et bulk_create, sans signaux.
+    """
+    entries = [ChangeLogEntry(model=_NAMES[model], object_id=object_id, deleted=deleted) for object_id in ids]
+    if entries:
+        ChangeLogEntry.objects.bulk_create(entries)
+
+
+def _on_save(sender, instance, **kwargs):
+    record_changes(sender, [instance.pk])
+
+
+def _on_delete(sender, instance, **kwargs):
+    record_changes(sender, [instance.pk], deleted=True)
+
+
+def connect_signals():
+    for model in SYNCED_MODELS.values():
+        post_save.connect(_on_save, sender=model, dispatch_uid=f'sync-save-{model.__name__}')
+        post_delete.connect(_on_delete, sender=model, dispatch_uid=f'sync-delete-{model.__name__}')
+
+
+def encode_token(entry_id):
+    return base64.urlsafe_b64encode(json.dumps(['sync', entry_id]).encode()).decode()
+
+
+def decode_token(token):
+    if not token:
+        return 0
+    try:
+        kind, entry_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        raise GraphQLError("Jeton de synchronisation invalide")
+    if kind != 'sync' or not isinstance(entry_id, int):
+        raise GraphQLError("Jeton de synchronisation invalide")
+    return entry_id
+
+
+def changes_since(token, limit):
+    """
+    Changements inscrits au journal après `token`, au plus `limit` entrées : objets à jour
+    par modèle (clés de SYNCED_MODELS), objets supprimés (`tombstones`) et jeton de la page
+    suivante. Le coût dépend du nombre de changements, pas de la taille des tables.
+    """
+    entries = ChangeLogEntry.objects.filter(id__gt=decode_token(token)).order_by('id')
+    if settings.SYNC_SETTLE_SECONDS:
+        # Un id plus petit peut encore être dans une transaction non validée : on attend
+        # que les entrées récentes soient stables avant de les renvoyer
+        entries = entries.filter(date_creation__lte=timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS))
+    entries = list(entries.values_list('id', 'model', 'object_id', 'deleted')[:limit])
+
+    # Seule la dernière entrée de chaque objet compte
+    latest = {}
+    for _, name, object_id, deleted in entries:
+        latest[(name, object_id)] = deleted
+    page = {}
+    tombstones = []
+    for name, model in SYNCED_MODELS.items():
+        ids = [object_id for (entry_name, object_id), deleted in latest.items() if entry_name == name and not deleted]
+        objects = model._default_manager.in_bulk(ids)
+        page[name] = [objects[object_id] for object_id in ids if object_id in objects]
+        # Supprimé depuis : la suppression est plus loin dans le journal, on l'annonce déjà
+        tombstones.extend({'model': name, 'id': object_id} for object_id in ids if object_id not in objects)
+    tombstones.extend(
+        {'model': name, 'id': object_id} for (name, object_id), deleted in latest.items() if deleted
+    )
+    page['tombstones'] = tombstones
+    page['token'] = encode_token(entries[-1][0]) if entries else (token or encode_token(0))
+    page['has_more'] = len(entries) == limit
+    return page
+
+
+def compact_changelog():
+    """
+    Supprime les entrées remplacées par une entrée plus récente du même objet. Un jeton reste
+    valable : tout objet modifié après lui garde sa dernière entrée, plus récente que le jeton.
+    """
+    latest = ChangeLogEntry.objects.values('model', 'object_id').annotate(last=Max('id')).values('last')
+    deleted, _ = ChangeLogEntry.objects.exclude(id__in=latest).delete()
+    return deleted
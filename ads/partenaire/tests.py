@@ -1,3 +1,1439 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import AnonymousUser, User, update_last_login
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import caches
+from django.db import IntegrityError, connection
+from django.db.models import QuerySet
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from graphql import parse
+from graphql_jwt.shortcuts import get_token
+from PIL import Image as PILImage
+
+from .auth import LoginThrottled, _Verifier, verify_password
+from .avatars import AvatarError, store_avatar
+from .blobs import ChecksumError, _walk, collect_orphan_files, delete_files, release_images, store_image
+from .cost import check_query_cost
+from .graphql_schema import schema
+from .impressions import display_key_hash, replay_segments
+from .jwt_auth import authenticate_request, token_cache
+from .lifecycle import _transition, apply_transitions, reconcile_image_counts
+from .loaders import RequestLoaders
+from .models import (
+    Campaign, CampaignDisplay, CampaignImage, ChangeLogEntry, Display, Image, ImageUpload, ImageVariant,
+    Job, PersistedQuery, Revenue, RevenueRollup, Utilisateur,
+)
+from .persisted import RegisteredQueries, document_cache, query_hash
+from .playlist import PlaylistIndex
+from .pubsub import CAMPAIGN, LocalBroker
+from .rollups import apply_revenue, summarize
+from .sync import compact_changelog
+from .tracing import Metrics
+from .websocket import PROTOCOL, websocket_application
+from .uploads import IMAGES_FOR_PENDING, UploadError, append_chunk, finalize_upload, init_upload, temp_path
+
+
+def execute(query, variables=None, request=None):
+    if request is None:
+        request = RequestFactory().post('/graphql/')
+        request.user = AnonymousUser()
+    result = schema.execute(query, variable_values=variables, context_value=request)
+    if result.errors:
+        raise result.errors[0]
+    return result.data
+
+
+def create_campaigns(count, displays_per_campaign=2):
+    """Campagnes avec créateur, image et displays distincts pour chaque campagne."""
+    for i in range(count):
+        utilisateur = Utilisateur.objects.create(
+            nom=f'Nom {i}', prenom='Prénom', email=f'createur{Utilisateur.objects.count()}@example.com', role='client',
+        )
+        image = Image.objects.create(image=f'campaign_images/{i}.png')
+        campaign = Campaign.objects.create(
+            campaign_name=f'Campagne {i}', id_utilisateur_createur=utilisateur, id_image=image,
+        )
+        for j in range(displays_per_campaign):
+            display = Display.objects.create(display_name=f'Display {i}-{j}')
+            CampaignDisplay.objects.create(id_campaign=campaign, id_display=display)
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE_ALIAS=None)
+class LoaderQueryCountTests(TestCase):
+    QUERY = '''{
+        allCampaigns {
+            edges { node {
+                idUtilisateurCreateur { nom }
+                idImage { url }
+                campaigndisplaySet { idDisplay { displayName } }
+            } }
+        }
+    }'''
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            data = execute(self.QUERY)
+        return len(context.captured_queries), data
+
+    def test_query_count_does_not_grow_with_rows(self):
+        create_campaigns(3)
+        small, data = self.count_queries()
+        self.assertEqual(len(data['allCampaigns']['edges']), 3)
+
+        create_campaigns(20, displays_per_campaign=4)
+        large, data = self.count_queries()
+        self.assertEqual(len(data['allCampaigns']['edges']), 23)
+        self.assertEqual(small, large)
+
+    def test_relations_are_resolved_once_per_level(self):
+        create_campaigns(10)
+        # Campagnes avec créateurs et images (jointures), campaignDisplay avec leurs displays
+        # (préchargés), puis un seul IN (...) pour les variantes de toutes les images
+        with self.assertNumQueries(3):
+            data = execute(self.QUERY)
+        node = data['allCampaigns']['edges'][0]['node']
+        self.assertEqual(node['idUtilisateurCreateur']['nom'], 'Nom 9')
+        self.assertEqual(len(node['campaigndisplaySet']), 2)
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE_ALIAS=None)
+class PaginationTests(TestCase):
+    QUERY = '''query ($first: Int, $after: String, $status: String) {
+        allCampaigns(first: $first, after: $after, status: $status) {
+            totalCount
+            pageInfo { hasPreviousPage hasNextPage endCursor }
+            edges { node { campaignName } }
+        }
+    }'''
+
+    def setUp(self):
+        for i in range(7):
+            Campaign.objects.create(campaign_name=f'Campagne {i}', status='pending' if i % 2 else 'upload')
+
+    def test_pages_follow_the_cursor(self):
+        names, after, pages = [], None, []
+        while True:
+            page = execute(self.QUERY, {'first': 3, 'after': after})['allCampaigns']
+            pages.append(page)
+            names.extend(edge['node']['campaignName'] for edge in page['edges'])
+            if not page['pageInfo']['hasNextPage']:
+                break
+            after = page['pageInfo']['endCursor']
+        self.assertEqual(names, [f'Campagne {i}' for i in reversed(range(7))])
+        self.assertEqual([len(page['edges']) for page in pages], [3, 3, 1])
+        self.assertEqual([page['pageInfo']['hasPreviousPage'] for page in pages], [False, True, True])
+        self.assertEqual({page['totalCount'] for page in pages}, {7})
+
+    def test_cursor_survives_deleted_rows(self):
+        first_page = execute(self.QUERY, {'first': 2})['allCampaigns']
+        Campaign.objects.filter(campaign_name__in=['Campagne 6', 'Campagne 5']).delete()
+        page = execute(self.QUERY, {'first': 2, 'after': first_page['pageInfo']['endCursor']})['allCampaigns']
+        self.assertEqual([edge['node']['campaignName'] for edge in page['edges']], ['Campagne 4', 'Campagne 3'])
+        # Plus aucune ligne avant le curseur
+        self.assertFalse(page['pageInfo']['hasPreviousPage'])
+
+    def test_filter_and_count(self):
+        page = execute(self.QUERY, {'status': 'pending'})['allCampaigns']
+        self.assertEqual(page['totalCount'], 3)
+        self.assertEqual([edge['node']['campaignName'] for edge in page['edges']], ['Campagne 5', 'Campagne 3', 'Campagne 1'])
+
+    def test_invalid_cursor(self):
+        with self.assertRaisesMessage(Exception, 'Curseur invalide'):
+            execute(self.QUERY, {'after': 'not-a-cursor'})
+
+
+class RevenueRollupTests(TestCase):
+    def test_duplicate_key_is_rejected(self):
+        RevenueRollup.objects.create(granularity='day', period_start=date(2026, 1, 5), total=1, nombre=1)
+        with self.assertRaises(IntegrityError):
+            RevenueRollup.objects.create(granularity='day', period_start=date(2026, 1, 5), total=1, nombre=1)
+
+    def test_concurrent_first_write_is_added_to_the_existing_row(self):
+        revenue = Revenue(revenue=Decimal('10.00'), date_revenue=date(2026, 1, 5))
+        apply_revenue(revenue)
+
+        # L'UPDATE ne voit pas encore la ligne créée par l'autre écriture : l'INSERT échoue
+        # sur la contrainte et l'incrément est refait
+        real_update, calls = QuerySet.update, []
+
+        def update(queryset, **kwargs):
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update):
+            apply_revenue(revenue)
+        self.assertEqual(RevenueRollup.objects.count(), 3)
+        for row in RevenueRollup.objects.all():
+            self.assertEqual((row.total, row.nombre), (Decimal('20.00'), 2))
+
+    def add_revenues(self, *days):
+        for amount, day in enumerate(days, start=1):
+            apply_revenue(Revenue(revenue=Decimal(amount), date_revenue=day))
+
+    def totals(self, granularity, date_from=None, date_to=None):
+        return [
+            (row['period_start'], row['total'], row['nombre'])
+            for row in summarize(granularity, date_from, date_to)
+        ]
+
+    def test_summary_trims_periods_cut_by_the_bounds(self):
+        # 1 le 30/01, 2 le 31/01, 3 le 02/02, 4 le 15/02, 5 le 28/02, 6 le 01/03
+        self.add_revenues(
+            date(2026, 1, 30), date(2026, 1, 31), date(2026, 2, 2), date(2026, 2, 15),
+            date(2026, 2, 28), date(2026, 3, 1),
+        )
+        self.assertEqual(self.totals('month', date(2026, 1, 31), date(2026, 2, 28)), [
+            (date(2026, 1, 1), Decimal(2), 1), (date(2026, 2, 1), Decimal(12), 3),
+        ])
+        self.assertEqual(self.totals('month', date(2026, 2, 1), date(2026, 2, 28)), [(date(2026, 2, 1), Decimal(12), 3)])
+        # Deux bornes dans la même période
+        self.assertEqual(self.totals('month', date(2026, 2, 10), date(2026, 2, 20)), [(date(2026, 2, 1), Decimal(4), 1)])
+        self.assertEqual(self.totals('month', date_to=date(2026, 2, 14)), [
+            (date(2026, 1, 1), Decimal(3), 2), (date(2026, 2, 1), Decimal(3), 1),
+        ])
+        self.assertEqual(self.totals('month', date(2026, 2, 16)), [
+            (date(2026, 2, 1), Decimal(5), 1), (date(2026, 3, 1), Decimal(6), 1),
+        ])
+        # Semaines du lundi 26/01 et du lundi 02/02, coupées le samedi 31/01 et le mercredi 04/02
+        self.assertEqual(self.totals('week', date(2026, 1, 31), date(2026, 2, 4)), [
+            (date(2026, 1, 26), Decimal(2), 1), (date(2026, 2, 2), Decimal(3), 1),
+        ])
+        self.assertEqual(self.totals('day', date(2026, 1, 31), date(2026, 2, 2)), [
+            (date(2026, 1, 31), Decimal(2), 1), (date(2026, 2, 2), Decimal(3), 1),
+        ])
+
+    def test_trimmed_periods_keep_the_grouping(self):
+        partenaires = [
+            Utilisateur.objects.create(nom='P', prenom='P', email=f'p{i}@example.com', role='partenaire')
+            for i in range(2)
+        ]
+        for amount, (partenaire, day) in enumerate(
+            [(partenaires[0], date(2026, 1, 31)), (partenaires[1], date(2026, 1, 31)),
+             (partenaires[0], date(2026, 1, 5)), (partenaires[1], date(2026, 2, 3))], start=1,
+        ):
+            apply_revenue(Revenue(revenue=Decimal(amount), date_revenue=day, id_utilisateur_partenaire=partenaire))
+        rows = summarize('month', date(2026, 1, 10), group_by=['partenaire'])
+        self.assertEqual(
+            [(row['period_start'], row['id_utilisateur_partenaire'], row['total']) for row in rows],
+            [
+                (date(2026, 1, 1), partenaires[0].pk, Decimal(1)),
+                (date(2026, 1, 1), partenaires[1].pk, Decimal(2)),
+                (date(2026, 2, 1), partenaires[1].pk, Decimal(4)),
+            ],
+        )
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE_ALIAS=None)
+class PersistedQueryTests(TestCase):
+    def post(self, query=None, digest=None):
+        data = {}
+        if query is not None:
+            data['query'] = query
+        if digest is not None:
+            data['extensions'] = {'persistedQuery': {'version': 1, 'sha256Hash': digest}}
+        response = self.client.post('/graphql/', data, content_type='application/json')
+        return response.status_code, response.json()
+
+    def test_hash_is_registered_by_the_full_query(self):
+        query = '{ apqRegistered: allCampaigns { totalCount } }'
+        digest = query_hash(query)
+        status, body = self.post(digest=digest)
+        self.assertEqual((status, body['errors'][0]['message']), (200, 'PersistedQueryNotFound'))
+
+        status, body = self.post(query, digest)
+        self.assertEqual(body['data'], {'apqRegistered': {'totalCount': 0}})
+        self.assertTrue(PersistedQuery.objects.filter(sha256=digest).exists())
+
+        status, body = self.post(digest=digest)
+        self.assertEqual(body['data'], {'apqRegistered': {'totalCount': 0}})
+
+    def test_mismatched_hash(self):
+        status, body = self.post('{ allCampaigns { totalCount } }', '0' * 64)
+        self.assertEqual((status, body['errors'][0]['message']), (400, 'provided sha does not match query'))
+
+    @override_settings(GRAPHQL_PERSISTED_QUERIES_ALLOWLIST=True)
+    def test_allowlist_ignores_documents_only_parsed(self):
+        query = '{ apqParsed: allCampaigns { totalCount } }'
+        # Déjà analysé et validé (requête HTTP hors liste, WebSocket) mais jamais enregistré
+        document_cache.get_document(schema.graphql_schema, query)
+        status, body = self.post(query)
+        self.assertEqual((status, body['errors'][0]['message']), (400, 'PersistedQueryNotAllowed'))
+        status, body = self.post(digest=query_hash(query))
+        self.assertEqual((status, body['errors'][0]['message']), (200, 'PersistedQueryNotFound'))
+
+    @override_settings(GRAPHQL_PERSISTED_QUERIES_ALLOWLIST=True)
+    def test_allowlist_accepts_registered_queries_until_deleted(self):
+        query = '{ apqAllowed: allCampaigns { totalCount } }'
+        registered = PersistedQuery.objects.create(sha256=query_hash(query), query=query)
+        status, body = self.post(query)
+        self.assertEqual(body['data'], {'apqAllowed': {'totalCount': 0}})
+        status, body = self.post(digest=registered.sha256)
+        self.assertEqual(body['data'], {'apqAllowed': {'totalCount': 0}})
+
+        registered.delete()
+        status, body = self.post(query)
+        self.assertEqual((status, body['errors'][0]['message']), (400, 'PersistedQueryNotAllowed'))
+
+    def test_invalid_query_is_not_registered(self):
+        for query in ('{ allCampaigns { totalCount ', '{ apqInvalid: allCampaigns { nope } }'):
+            status, body = self.post(query, query_hash(query))
+            self.assertEqual(status, 400)
+            self.assertFalse(PersistedQuery.objects.filter(sha256=query_hash(query)).exists())
+
+    def test_allowlist_ignores_automatic_queries(self):
+        query = '{ apqAutomatic: allCampaigns { totalCount } }'
+        self.post(query, query_hash(query))
+        self.assertTrue(PersistedQuery.objects.get(sha256=query_hash(query)).automatique)
+        with self.settings(GRAPHQL_PERSISTED_QUERIES_ALLOWLIST=True):
+            status, body = self.post(query)
+            self.assertEqual((status, body['errors'][0]['message']), (400, 'PersistedQueryNotAllowed'))
+            status, body = self.post(digest=query_hash(query))
+            self.assertEqual((status, body['errors'][0]['message']), (200, 'PersistedQueryNotFound'))
+
+    @override_settings(GRAPHQL_AUTOMATIC_PERSISTED_QUERIES_MAX=2)
+    def test_automatic_queries_are_capped(self):
+        queries = [f'{{ apqCapped{i}: allCampaigns {{ totalCount }} }}' for i in range(3)]
+        for query in queries:
+            self.post(query, query_hash(query))
+        self.assertEqual(
+            set(PersistedQuery.objects.values_list('sha256', flat=True)), {query_hash(q) for q in queries[1:]},
+        )
+        status, body = self.post(digest=query_hash(queries[0]))
+        self.assertEqual((status, body['errors'][0]['message']), (200, 'PersistedQueryNotFound'))
+
+    def test_unknown_hash_is_looked_up_once(self):
+        queries = RegisteredQueries()
+        with self.assertNumQueries(1):
+            self.assertNotIn('0' * 64, queries)
+            self.assertNotIn('0' * 64, queries)
+        PersistedQuery.objects.create(sha256='0' * 64, query='{ allCampaigns { totalCount } }')
+        queries.add('0' * 64)
+        with self.assertNumQueries(0):
+            self.assertIn('0' * 64, queries)
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE_ALIAS='graphql')
+class ResponseCacheTests(TestCase):
+    QUERY = '{ allCampaigns { totalCount edges { node { campaignName idImage { url } } } } }'
+
+    def setUp(self):
+        caches['graphql'].clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.campaign = Campaign.objects.create(
+                campaign_name='Campagne', id_image=Image.objects.create(image='a.png'),
+            )
+
+    def post(self, query=QUERY):
+        response = self.client.post('/graphql/', {'query': query}, content_type='application/json')
+        return response.json()['data']
+
+    def test_repeated_query_is_served_from_the_cache(self):
+        first = self.post()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.post(), first)
+
+    def test_write_to_a_read_model_invalidates(self):
+        self.post()
+        with self.captureOnCommitCallbacks(execute=True):
+            Campaign.objects.create(campaign_name='Nouvelle')
+        self.assertEqual(self.post()['allCampaigns']['totalCount'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.campaign.campaign_name = 'Renommée'
+            self.campaign.save()
+        names = {edge['node']['campaignName'] for edge in self.post()['allCampaigns']['edges']}
+        self.assertEqual(names, {'Nouvelle', 'Renommée'})
+
+    def test_computed_field_dependency_invalidates(self):
+        # url dépend des variantes de l'image, modèle absent de la sélection
+        def url():
+            return self.post()['allCampaigns']['edges'][0]['node']['idImage']['url']
+
+        self.assertTrue(url().endswith('/a.png'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.campaign.id_image.variants.create(width=320, height=240, format='webp', file='a_320.webp')
+        self.assertTrue(url().endswith('/a_320.webp'))
+
+    def test_unrelated_write_keeps_the_cached_response(self):
+        self.post()
+        with self.captureOnCommitCallbacks(execute=True):
+            Display.objects.create(display_name='Display')
+        with self.assertNumQueries(0):
+            self.post()
+
+    def test_mutations_are_not_cached(self):
+        mutation = 'mutation { createCampaign(campaignName: "Créée") { campaign { campaignName } } }'
+        self.post(mutation)
+        self.post(mutation)
+        self.assertEqual(Campaign.objects.filter(campaign_name='Créée').count(), 2)
+
+    def test_versions_are_bumped_once_per_transaction(self):
+        with mock.patch('partenaire.response_cache._bump') as bump:
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(10):
+                    Campaign.objects.create(campaign_name=f'Campagne {i}')
+                Display.objects.create(display_name='Display')
+        bump.assert_called_once_with({Campaign, Display})
+
+    def test_uncommitted_writes_are_read_without_the_cache(self):
+        self.post()
+        Campaign.objects.create(campaign_name='Pas encore validée')
+        # Version inchangée jusqu'au commit : la transaction ne relit pas l'ancienne réponse
+        self.assertEqual(self.post()['allCampaigns']['totalCount'], 2)
+
+
+class QueryCostTests(TestCase):
+    def test_estimate_does_not_count_rows_in_the_request(self):
+        document = parse('{ allCampaigns { edges { node { campaigndisplaySet { idDisplay { id } } } } } }')
+        with self.assertNumQueries(0):
+            limits = check_query_cost(schema.graphql_schema, document)
+        self.assertEqual(limits['depth'], 6)
+
+    DEEP = '{ allCampaigns(first: 500) { edges { node { campaigndisplaySet { idDisplay { id } } } } } }'
+
+    def post(self, query, path='/graphql/'):
+        # Tailles des tables inconnues : estimation stable, sans comptage en arrière-plan
+        with mock.patch('partenaire.cost.table_rows', return_value=None):
+            return self.client.post(path, {'query': query}, content_type='application/json')
+
+    def expected(self, query):
+        with mock.patch('partenaire.cost.table_rows', return_value=None):
+            return check_query_cost(schema.graphql_schema, parse(query))
+
+    def rejection(self, response, code):
+        body = response.json()
+        self.assertIsNone(body.get('data'))
+        self.assertEqual(len(body['errors']), 1)
+        self.assertEqual(body['errors'][0]['extensions']['code'], code)
+        return body['errors'][0]['extensions']
+
+    @override_settings(GRAPHQL_MAX_DEPTH=5)
+    def test_too_deep_queries_are_rejected_before_execution(self):
+        for path in ('/graphql/', '/graphql/async/'):
+            with self.subTest(path=path), self.assertNumQueries(0):
+                extensions = self.rejection(self.post(self.DEEP, path), 'QUERY_TOO_DEEP')
+            self.assertEqual((extensions['depth'], extensions['maxDepth']), (6, 5))
+
+    @override_settings(GRAPHQL_MAX_COST=1000)
+    def test_too_costly_queries_are_rejected_before_execution(self):
+        cost = self.expected('{ allCampaigns(first: 1) { edges { node { id } } } }')['cost']
+        for path in ('/graphql/', '/graphql/async/'):
+            with self.subTest(path=path), self.assertNumQueries(0):
+                extensions = self.rejection(self.post(self.DEEP, path), 'QUERY_TOO_COSTLY')
+            self.assertGreater(extensions['cost'], 1000)
+            self.assertEqual(extensions['maxCost'], 1000)
+            self.assertEqual(extensions['depth'], 6)
+        # Le coût croît avec la taille de page demandée
+        self.assertLess(cost, extensions['cost'])
+
+    @override_settings(GRAPHQL_RESPONSE_CACHE_ALIAS=None)
+    def test_accepted_queries_report_their_cost(self):
+        Campaign.objects.create(campaign_name='Campagne')
+        query = '{ allCampaigns(first: 10) { edges { node { campaignName } } } }'
+        expected = self.expected(query)
+        self.assertEqual(expected['depth'], 4)
+        for path in ('/graphql/', '/graphql/async/'):
+            with self.subTest(path=path):
+                body = self.post(query, path).json()
+                self.assertNotIn('errors', body)
+                self.assertEqual(body['data']['allCampaigns']['edges'], [{'node': {'campaignName': 'Campagne'}}])
+                self.assertEqual(body['extensions']['cost'], expected)
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE_ALIAS=None, GRAPHQL_TRACING_SAMPLE_RATE=1, DEBUG=True)
+class TracingTests(TestCase):
+    QUERY = '{ a: allCampaigns { totalCount } b: allCampaigns(first: 1) { totalCount } }'
+
+    def setUp(self):
+        Campaign.objects.create(campaign_name='Campagne')
+        patcher = mock.patch('partenaire.tracing.metrics', Metrics())
+        self.metrics = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def check(self, body):
+        # Alias : un chemin par alias dans la trace de la requête, un seul champ dans les métriques
+        paths = {entry['path']: entry for entry in body['extensions']['tracing']['resolvers']}
+        self.assertEqual(paths['a.totalCount']['sqlCount'], 1)
+        self.assertEqual(paths['b.totalCount']['sqlCount'], 1)
+        fields = self.metrics.fields
+        self.assertEqual(fields['Query.allCampaigns'].calls, 2)
+        total_count = fields['CampaignConnection.totalCount']
+        self.assertEqual((total_count.calls, total_count.sql_count), (2, 2))
+        self.assertNotIn('a', fields)
+        self.assertIn('field="Query.allCampaigns"', self.metrics.render())
+
+    def test_sync_view(self):
+        self.check(self.client.post('/graphql/', {'query': self.QUERY}, content_type='application/json').json())
+
+    async def test_async_view(self):
+        response = await self.async_client.post('/graphql/async/', {'query': self.QUERY}, content_type='application/json')
+        self.check(response.json())
+
+
+@override_settings(GRAPHQL_METRICS_ENABLED=True, GRAPHQL_METRICS_TOKEN='secret')
+class MetricsViewTests(TestCase):
+    def test_disabled_by_default(self):
+        with self.settings(GRAPHQL_METRICS_ENABLED=False):
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code, 404)
+
+    def test_anonymous_and_wrong_token_are_refused(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 401)
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer other').status_code, 401)
+        self.client.force_login(User.objects.create_user('client'))
+        self.assertEqual(self.client.get('/metrics/').status_code, 401)
+
+    def test_token_and_staff_are_allowed(self):
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.client.get('/metrics/').status_code, 200)
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE_ALIAS=None)
+@mock.patch('partenaire.views.record_impressions', side_effect=len)
+class ImpressionAuthTests(TestCase):
+    def setUp(self):
+        self.partner = Utilisateur.objects.create(nom='P', prenom='P', email='partner@example.com', role='partenaire')
+        self.display = Display.objects.create(
+            display_name='Display', id_utilisateur_partenaire=self.partner, cle_impressions=display_key_hash('secret'),
+        )
+        self.other = Display.objects.create(display_name='Autre')
+        self.campaign = Campaign.objects.create(campaign_name='Campagne')
+        CampaignDisplay.objects.create(id_campaign=self.campaign, id_display=self.display)
+        CampaignDisplay.objects.create(id_campaign=self.campaign, id_display=self.other)
+
+    def post(self, *pairs, **headers):
+        events = [{'campaign': campaign.pk, 'display': display.pk, 'count': 2} for campaign, display in pairs]
+        return self.client.post('/impressions/', {'events': events}, content_type='application/json', headers=headers)
+
+    def test_anonymous_and_unknown_key_are_rejected(self, record):
+        self.assertEqual(self.post((self.campaign, self.display)).status_code, 401)
+        self.assertEqual(self.post((self.campaign, self.display), authorization='Display wrong').status_code, 401)
+        record.assert_not_called()
+
+    def test_display_sends_its_own_impressions_only(self, record):
+        response = self.post((self.campaign, self.display), authorization='Display secret')
+        self.assertEqual((response.status_code, response.json()), (202, {'accepted': 1}))
+        response = self.post((self.campaign, self.display), (self.campaign, self.other), authorization='Display secret')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(record.call_count, 1)
+
+    def test_partner_sends_impressions_of_its_displays(self, record):
+        self.client.force_login(User.objects.create_user('partner', 'partner@example.com'))
+        self.assertEqual(self.post((self.campaign, self.display)).status_code, 202)
+        self.assertEqual(self.post((self.campaign, self.other)).status_code, 403)
+        # Campagne non diffusée sur le display
+        unassigned = Campaign.objects.create(campaign_name='Non diffusée')
+        self.assertEqual(self.post((unassigned, self.display)).status_code, 403)
+
+
+class ImpressionReplayTests(TestCase):
+    def test_orphan_segment_is_applied_once(self):
+        display = Display.objects.create(display_name='Display')
+        campaign = Campaign.objects.create(campaign_name='Campagne')
+        pair = CampaignDisplay.objects.create(id_campaign=campaign, id_display=display)
+        with tempfile.TemporaryDirectory() as directory, override_settings(IMPRESSION_WAL_DIR=directory):
+            path = os.path.join(directory, 'segment.wal')
+
+            def write_segment():
+                with open(path, 'w') as wal:
+                    wal.write(json.dumps([[campaign.pk, display.pk, 3, None], [campaign.pk, display.pk, 4, None]]) + '\n')
+                    # Dernière ligne tronquée par le crash, jamais acquittée au client
+                    wal.write('[[%d, %d, 100' % (campaign.pk, display.pk))
+
+            write_segment()
+            self.assertEqual(replay_segments(), 7)
+            self.assertFalse(os.path.exists(path))
+            # Segment déjà appliqué (crash après le COMMIT, avant la suppression du fichier)
+            write_segment()
+            self.assertEqual(replay_segments(), 0)
+            self.assertFalse(os.path.exists(path))
+        pair.refresh_from_db()
+        self.assertEqual(pair.nombre_affichages, 7)
+
+
+class AvatarTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.utilisateur = Utilisateur.objects.create(nom='N', prenom='P', email='avatar@example.com', role='client')
+
+    def test_non_images_are_rejected_whatever_their_name(self):
+        for name in ('x.html', 'x.png'):
+            with self.assertRaises(AvatarError):
+                store_avatar(self.utilisateur, file=SimpleUploadedFile(name, b'<script>alert(1)</script>'))
+
+    def test_extension_and_content_type_come_from_the_content(self):
+        png = BytesIO()
+        PILImage.new('RGB', (4, 4)).save(png, 'PNG')
+        name = store_avatar(self.utilisateur, file=SimpleUploadedFile('x.html', png.getvalue()))
+        self.assertTrue(name.endswith('.png'))
+        self.utilisateur.save()
+
+        response = self.client.get(f'/avatars/{self.utilisateur.pk}/')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE_ALIAS=None, SYNC_SETTLE_SECONDS=0)
+class ChangesSinceTests(TestCase):
+    QUERY = '''query ($token: String, $first: Int) {
+        changesSince(token: $token, first: $first) {
+            campaigns { campaignName } displays { displayName } tombstones { model id } token hasMore
+        }
+    }'''
+
+    def sync(self, token=None, first=None):
+        return execute(self.QUERY, {'token': token, 'first': first})['changesSince']
+
+    def test_only_changes_after_the_token_are_returned(self):
+        campaign = Campaign.objects.create(campaign_name='Campagne')
+        display = Display.objects.create(display_name='Display')
+        page = self.sync()
+        self.assertEqual(([c['campaignName'] for c in page['campaigns']], page['hasMore']), (['Campagne'], False))
+        self.assertEqual(page['displays'], [{'displayName': 'Display'}])
+
+        empty = self.sync(page['token'])
+        self.assertEqual((empty['campaigns'], empty['displays'], empty['tombstones']), ([], [], []))
+        self.assertEqual(empty['token'], page['token'])
+
+        campaign.campaign_name = 'Renommée'
+        campaign.save()
+        display_id = display.pk
+        display.delete()
+        page = self.sync(page['token'])
+        self.assertEqual(page['campaigns'], [{'campaignName': 'Renommée'}])
+        self.assertEqual(page['displays'], [])
+        self.assertEqual(page['tombstones'], [{'model': 'display', 'id': display_id}])
+
+    def test_pages_follow_the_log(self):
+        for i in range(5):
+            Campaign.objects.create(campaign_name=f'Campagne {i}')
+        names, token = [], None
+        while True:
+            page = self.sync(token, first=2)
+            names.extend(c['campaignName'] for c in page['campaigns'])
+            token = page['token']
+            if not page['hasMore']:
+                break
+        self.assertEqual(names, [f'Campagne {i}' for i in range(5)])
+
+    def test_object_deleted_after_its_update_is_a_tombstone(self):
+        campaign = Campaign.objects.create(campaign_name='Campagne')
+        campaign_id = campaign.pk
+        page = self.sync(first=1)
+        self.assertEqual(page['campaigns'], [{'campaignName': 'Campagne'}])
+        campaign.save()
+        campaign.delete()
+        # La modification est lue alors que l'objet n'existe plus : suppression annoncée
+        page = self.sync(page['token'], first=1)
+        self.assertEqual((page['campaigns'], page['tombstones']), ([], [{'model': 'campaign', 'id': campaign_id}]))
+
+    def test_token_survives_compaction(self):
+        campaign = Campaign.objects.create(campaign_name='Campagne')
+        token = self.sync()['token']
+        for name in ('A', 'B', 'C'):
+            campaign.campaign_name = name
+            campaign.save()
+        self.assertEqual(compact_changelog(), 3)
+        self.assertEqual(self.sync(token)['campaigns'], [{'campaignName': 'C'}])
+
+    def test_invalid_token(self):
+        with self.assertRaisesMessage(Exception, 'Jeton de synchronisation invalide'):
+            self.sync('not-a-token')
+
+
+class LifecycleTests(TestCase):
+    def add_images(self, campaign, count):
+        for i in range(count):
+            CampaignImage.objects.create(id_campaign=campaign, id_image=Image.objects.create(image=f'{campaign.pk}-{i}.png'))
+
+    def test_submitted_campaigns_are_completed_at_their_end_date(self):
+        due = Campaign.objects.create(campaign_name='Due', status='submitted', end_date=date(2026, 1, 10))
+        running = Campaign.objects.create(campaign_name='En cours', status='submitted', end_date=date(2026, 1, 11))
+        cancelled = Campaign.objects.create(campaign_name='Annulée', status='cancelled', end_date=date(2026, 1, 1))
+        changed = apply_transitions(today=date(2026, 1, 10))
+        self.assertEqual(changed, {'completed': 1, 'pending': 0})
+        self.assertEqual(
+            [Campaign.objects.get(pk=c.pk).status for c in (due, running, cancelled)],
+            ['completed', 'submitted', 'cancelled'],
+        )
+
+    def test_campaigns_with_enough_images_become_pending(self):
+        ready = Campaign.objects.create(campaign_name='Prête')
+        waiting = Campaign.objects.create(campaign_name='Incomplète')
+        self.add_images(ready, IMAGES_FOR_PENDING)
+        self.add_images(waiting, IMAGES_FOR_PENDING - 1)
+        # Compteurs faux (images rattachées hors mutation) : recalculés avant la transition
+        self.assertEqual(apply_transitions()['pending'], 1)
+        ready.refresh_from_db()
+        waiting.refresh_from_db()
+        self.assertEqual((ready.status, ready.nombre_images), ('pending', IMAGES_FOR_PENDING))
+        self.assertEqual((waiting.status, waiting.nombre_images), ('upload', IMAGES_FOR_PENDING - 1))
+
+    def test_only_wrong_image_counts_are_rewritten(self):
+        correct = Campaign.objects.create(campaign_name='Juste', nombre_images=1)
+        wrong = Campaign.objects.create(campaign_name='Fausse', nombre_images=2)
+        submitted = Campaign.objects.create(campaign_name='Soumise', status='submitted', nombre_images=5)
+        self.add_images(correct, 1)
+        self.add_images(wrong, 1)
+        ChangeLogEntry.objects.all().delete()
+        self.assertEqual(reconcile_image_counts(), 1)
+        self.assertEqual(
+            [Campaign.objects.get(pk=c.pk).nombre_images for c in (correct, wrong, submitted)], [1, 1, 5],
+        )
+        self.assertEqual(list(ChangeLogEntry.objects.values_list('object_id', flat=True)), [wrong.pk])
+
+    def test_campaign_changed_after_the_read_is_not_overwritten(self):
+        due = Campaign.objects.create(campaign_name='Due', status='submitted', end_date=date(2026, 1, 1))
+        cancelled = Campaign.objects.create(campaign_name='Annulée', status='submitted', end_date=date(2026, 1, 1))
+        values_list = QuerySet.values_list
+
+        def read_then_cancel(queryset, *fields, **kwargs):
+            # Annulation par une autre requête entre la lecture des ids et l'UPDATE
+            ids = list(values_list(queryset, *fields, **kwargs))
+            Campaign.objects.filter(pk=cancelled.pk).update(status='cancelled')
+            return ids
+
+        with mock.patch.object(QuerySet, 'values_list', read_then_cancel), \
+                mock.patch('partenaire.lifecycle.publish') as publish:
+            changed = _transition(Campaign.objects.filter(status='submitted'), 'completed')
+        self.assertEqual(changed, 1)
+        self.assertEqual(Campaign.objects.get(pk=cancelled.pk).status, 'cancelled')
+        self.assertEqual(Campaign.objects.get(pk=due.pk).status, 'completed')
+        publish.assert_called_once_with(CAMPAIGN, [due.pk])
+
+
+class ReleaseImagesTests(TestCase):
+    def campaign_with_images(self, count):
+        campaign = Campaign.objects.create(campaign_name=f'Campagne {count}')
+        ids = []
+        for i in range(count):
+            image = Image.objects.create(image=f'campaign_images/{count}-{i}.png', content_hash=f'{count}-{i}')
+            CampaignImage.objects.create(id_campaign=campaign, id_image=image)
+            ImageVariant.objects.create(
+                id_image=image, width=320, height=240, format='webp', file=f'campaign_images/variants/{count}-{i}.webp',
+            )
+            ids.append(image.pk)
+        campaign.id_image_id = ids[0]
+        campaign.save()
+        return campaign, ids
+
+    def release(self, ids):
+        with CaptureQueriesContext(connection) as queries:
+            release_images(ids)
+        return len(queries.captured_queries)
+
+    def test_query_count_does_not_grow_with_the_images(self):
+        _, few = self.campaign_with_images(1)
+        _, many = self.campaign_with_images(10)
+        self.assertEqual(self.release(few), self.release(many))
+        self.assertFalse(Image.objects.exists())
+        self.assertFalse(CampaignImage.objects.exists() or ImageVariant.objects.exists())
+
+    def test_deleted_rows_are_recorded_once_each(self):
+        campaign, ids = self.campaign_with_images(3)
+        campaign_image_ids = list(CampaignImage.objects.values_list('pk', flat=True))
+        ChangeLogEntry.objects.all().delete()
+        with mock.patch('partenaire.blobs.invalidate') as invalidate:
+            release_images(ids)
+        invalidate.assert_called_once_with(Image, ImageVariant, CampaignImage, Campaign)
+        campaign.refresh_from_db()
+        self.assertIsNone(campaign.id_image)
+        entries = set(ChangeLogEntry.objects.values_list('model', 'object_id', 'deleted'))
+        self.assertEqual(entries, {
+            *(('image', pk, True) for pk in ids),
+            *(('campaign_image', pk, True) for pk in campaign_image_ids),
+            ('campaign', campaign.pk, False),
+        })
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.alice, self.bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+        self.tokens = {user.pk: get_token(user) for user in (self.alice, self.bob)}
+
+    def authenticate(self, user):
+        request = RequestFactory().post('/graphql/', HTTP_AUTHORIZATION=f'JWT {self.tokens[user.pk]}')
+        request.user = AnonymousUser()
+        return authenticate_request(request)
+
+    def test_verified_token_is_served_from_the_cache(self):
+        first = self.authenticate(self.alice)
+        with self.assertNumQueries(0):
+            second = self.authenticate(self.alice)
+        self.assertEqual(second.pk, self.alice.pk)
+        # Copie par requête : pas d'instance partagée entre requêtes et threads
+        self.assertIsNot(second, first)
+        self.assertIsNot(second, self.authenticate(self.alice))
+
+    @override_settings(JWT_USER_CACHE_TTL=60)
+    def test_entries_expire_with_the_ttl_and_the_token(self):
+        now = time.time()
+        token_cache.set('ttl', self.alice, expires=now + 3600)
+        token_cache.set('exp', self.alice, expires=now + 10)
+        with mock.patch('partenaire.jwt_auth.time.time', return_value=now + 30):
+            self.assertIsNotNone(token_cache.get('ttl'))
+            self.assertIsNone(token_cache.get('exp'))
+        with mock.patch('partenaire.jwt_auth.time.time', return_value=now + 61):
+            self.assertIsNone(token_cache.get('ttl'))
+
+    def test_only_the_changed_user_is_forgotten(self):
+        self.authenticate(self.alice)
+        self.authenticate(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.is_active = False
+            self.alice.save()
+        with self.assertNumQueries(0):
+            self.authenticate(self.bob)
+        self.assertIsInstance(self.authenticate(self.alice), Exception)
+
+    def test_login_keeps_the_cached_tokens(self):
+        self.authenticate(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            update_last_login(None, self.alice)
+        with self.assertNumQueries(0):
+            self.authenticate(self.alice)
+
+    def test_deleted_user_is_forgotten(self):
+        self.authenticate(self.alice)
+        alice = User.objects.get(pk=self.alice.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            alice.delete()
+        self.assertIsNone(self.authenticate(self.alice))
+
+
+class CountingBytesIO(BytesIO):
+    bytes_read = 0
+
+    def read(self, *args):
+        data = super().read(*args)
+        self.bytes_read += len(data)
+        return data
+
+
+class BlobStorageTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+    def store(self, content, name='a.png', **kwargs):
+        return store_image(SimpleUploadedFile(name, content), **kwargs)
+
+    def stored_files(self):
+        return sorted(_walk('campaign_images'))
+
+    def test_identical_content_shares_one_file(self):
+        first = self.store(b'contenu', 'a.png')
+        second = self.store(b'contenu', 'b.png')
+        other = self.store(b'autre contenu', 'c.png')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.content_hash, hashlib.sha256(b'contenu').hexdigest())
+        self.assertEqual(self.stored_files(), sorted({first.image.name, other.image.name}))
+
+    def test_file_is_read_once(self):
+        source = CountingBytesIO(b'x' * 200000)
+        image_obj = store_image(File(source, name='a.png'))
+        self.assertEqual(source.bytes_read, 200000)
+        self.assertEqual(image_obj.content_hash, hashlib.sha256(b'x' * 200000).hexdigest())
+
+    def test_checksum_mismatch_keeps_nothing(self):
+        with self.assertRaises(ChecksumError):
+            self.store(b'contenu', checksum='0' * 64)
+        self.assertEqual((Image.objects.count(), self.stored_files()), (0, []))
+
+    def test_shared_file_is_deleted_with_its_last_image(self):
+        first, second = self.store(b'contenu'), self.store(b'contenu')
+        release_images([first.pk])
+        self.assertFalse(Job.objects.filter(kind='delete_files').exists())
+        release_images([second.pk])
+        job = Job.objects.get(kind='delete_files')
+        self.assertEqual(job.payload, {'names': [first.image.name]})
+        delete_files(**job.payload)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_orphan_files_are_collected(self):
+        kept = self.store(b'contenu')
+        orphan = default_storage.save('campaign_images/zz/orphan.png', ContentFile(b'orphelin'))
+        # Délai de grâce négatif : le fichier qui vient d'être écrit est assez ancien
+        self.assertEqual(collect_orphan_files(grace=timedelta(seconds=-1), dry_run=True), [orphan])
+        self.assertEqual(self.stored_files(), sorted([kept.image.name, orphan]))
+        collect_orphan_files(grace=timedelta(seconds=-1))
+        self.assertEqual(self.stored_files(), [kept.image.name])
+
+
+class ResumableUploadTests(TestCase):
+    CONTENT = b'0123456789' * 3
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=os.path.join(media.name, 'media'), IMAGE_UPLOAD_TEMP_DIR=os.path.join(media.name, 'tmp'),
+        ))
+        self.campaign = Campaign.objects.create(campaign_name='Campagne')
+        self.upload = init_upload('photo.png', len(self.CONTENT), id_campaign=self.campaign.pk)
+
+    def send(self, start, end, checksum=None):
+        chunk = self.CONTENT[start:end]
+        return append_chunk(
+            self.upload.upload_id, start, SimpleUploadedFile('chunk', chunk),
+            checksum or hashlib.sha256(chunk).hexdigest(),
+        )
+
+    def received(self):
+        with open(temp_path(self.upload), 'rb') as f:
+            return f.read()
+
+    def test_offset_must_follow_the_received_bytes(self):
+        self.send(0, 10)
+        with self.assertRaisesMessage(UploadError, 'Offset attendu: 10'):
+            self.send(20, 30)
+        self.assertEqual(self.received(), self.CONTENT[:10])
+
+    def test_resent_chunk_is_ignored(self):
+        self.send(0, 10)
+        self.assertEqual(self.send(0, 10).received_size, 10)
+        self.assertEqual(self.received(), self.CONTENT[:10])
+
+    def test_checksum_failure_truncates_the_chunk(self):
+        self.send(0, 10)
+        with self.assertRaisesMessage(UploadError, 'Checksum du morceau invalide'):
+            self.send(10, 20, checksum='0' * 64)
+        self.assertEqual(self.received(), self.CONTENT[:10])
+        self.assertEqual(ImageUpload.objects.get(pk=self.upload.pk).received_size, 10)
+        # Le même morceau, renvoyé intact, est accepté
+        self.assertEqual(self.send(10, 20).received_size, 20)
+
+    def test_upload_resumes_after_an_interruption(self):
+        self.send(0, 10)
+        self.send(10, 20)
+        # Coupure : le client reprend à l'offset enregistré
+        offset = ImageUpload.objects.get(upload_id=self.upload.upload_id).received_size
+        self.send(offset, len(self.CONTENT))
+        self.assertEqual(self.received(), self.CONTENT)
+
+    def test_finalize_needs_every_byte_and_a_matching_checksum(self):
+        self.send(0, 20)
+        with self.assertRaisesMessage(UploadError, 'Upload incomplet: 20/30 octets'):
+            finalize_upload(self.upload.upload_id)
+        self.send(20, 30)
+        with self.assertRaisesMessage(UploadError, 'Checksum du fichier invalide'):
+            finalize_upload(self.upload.upload_id, checksum='0' * 64)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image_obj = finalize_upload(self.upload.upload_id, checksum=hashlib.sha256(self.CONTENT).hexdigest())
+        with image_obj.image.open('rb') as f:
+            self.assertEqual(f.read(), self.CONTENT)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.nombre_images, 1)
+        self.assertTrue(CampaignImage.objects.filter(id_campaign=self.campaign, id_image=image_obj).exists())
+        self.assertFalse(os.path.exists(temp_path(self.upload)))
+        # Finalisation rejouée : même Image
+        self.assertEqual(finalize_upload(self.upload.upload_id), image_obj)
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE_ALIAS=None)
+class BatchTests(TestCase):
+    READ = 'query ($id: Int!) { campaignById(id: $id) { idUtilisateurCreateur { nom } } }'
+    RENAME = 'mutation ($id: Int!) { updateUtilisateur(id: $id, nom: "Renommé") { utilisateur { nom } } }'
+
+    def setUp(self):
+        self.createur = Utilisateur.objects.create(nom='Nom', prenom='P', email='batch@example.com', role='client')
+        self.campaigns = [
+            Campaign.objects.create(campaign_name=f'Campagne {i}', id_utilisateur_createur=self.createur)
+            for i in range(2)
+        ]
+
+    def read(self, index=0):
+        return {'query': self.READ, 'variables': {'id': self.campaigns[index].pk}}
+
+    def post(self, operations, path='/graphql/'):
+        return self.client.post(path, operations, content_type='application/json')
+
+    async def apost(self, operations):
+        return await self.async_client.post('/graphql/async/', operations, content_type='application/json')
+
+    def names(self, response):
+        return [
+            (result.get('data') or {}).get('campaignById', {}).get('idUtilisateurCreateur', {}).get('nom')
+            for result in response.json()
+        ]
+
+    def count_loaders(self):
+        created = []
+
+        class CountedLoaders(RequestLoaders):
+            def __init__(self):
+                super().__init__()
+                created.append(self)
+
+        self.enterContext(mock.patch('partenaire.loaders.RequestLoaders', CountedLoaders))
+        return created
+
+    def test_reads_share_the_loaders(self):
+        created = self.count_loaders()
+        response = self.post([self.read(0), self.read(1)])
+        self.assertEqual(self.names(response), ['Nom', 'Nom'])
+        self.assertEqual(len(created), 1)
+
+    def test_mutation_resets_the_loaders(self):
+        created = self.count_loaders()
+        response = self.post([
+            self.read(), {'query': self.RENAME, 'variables': {'id': self.createur.pk}}, self.read(),
+        ])
+        self.assertEqual(self.names(response), ['Nom', None, 'Renommé'])
+        # Lectures avant et après la mutation : loaders distincts
+        self.assertEqual(len(created), 2)
+
+    async def test_async_mutation_is_a_barrier(self):
+        created = self.count_loaders()
+        response = await self.apost([
+            self.read(0), self.read(1), {'query': self.RENAME, 'variables': {'id': self.createur.pk}}, self.read(0),
+        ])
+        self.assertEqual(self.names(response), ['Nom', 'Nom', None, 'Renommé'])
+        # Les deux premières lectures, exécutées ensemble, partagent leurs loaders
+        self.assertEqual(len(created), 2)
+
+    def test_errors_stay_with_their_operation(self):
+        for post in (self.post, lambda operations: async_to_sync(self.apost)(operations)):
+            response = post([self.read(), {'query': '{ nope }'}, {'variables': {}}, self.read(1)])
+            results = response.json()
+            self.assertEqual(self.names(response)[0::3], ['Nom', 'Nom'])
+            self.assertIn('nope', results[1]['errors'][0]['message'])
+            self.assertEqual(results[2]['errors'][0]['message'], 'Must provide query string.')
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(GRAPHQL_MAX_BATCH_SIZE=2)
+    def test_batch_size_is_capped(self):
+        for path in ('/graphql/', '/graphql/async/'):
+            response = self.post([self.read()] * 3, path)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Au plus 2 opérations', json.dumps(response.json(), ensure_ascii=False))
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE_ALIAS=None)
+class BulkCreateCampaignsTests(TestCase):
+    MUTATION = '''mutation ($campaigns: [CampaignInput!]!) {
+        bulkCreateCampaigns(campaigns: $campaigns) { ok results { index ok message campaign { campaignName } } }
+    }'''
+
+    def setUp(self):
+        self.display = Display.objects.create(display_name='Display')
+
+    def create(self, campaigns):
+        return execute(self.MUTATION, {'campaigns': campaigns})['bulkCreateCampaigns']
+
+    def test_invalid_items_are_reported_and_the_others_created(self):
+        result = self.create([
+            {'campaignName': 'A', 'idDisplays': [self.display.pk, self.display.pk]},
+            {'campaignName': 'B', 'idDisplays': [self.display.pk + 100]},
+            {'campaignName': 'C', 'status': 'inconnu'},
+            {'campaignName': 'D', 'startDate': '2026-02-01', 'endDate': '2026-01-01'},
+            {'campaignName': 'E', 'idUtilisateurCreateur': 999},
+            {'campaignName': 'F'},
+        ])
+        self.assertFalse(result['ok'])
+        self.assertEqual([(r['index'], r['ok']) for r in result['results']], [
+            (0, True), (1, False), (2, False), (3, False), (4, False), (5, True),
+        ])
+        self.assertEqual(result['results'][1]['message'], f'Displays introuvables: [{self.display.pk + 100}]')
+        self.assertEqual(result['results'][2]['message'], 'Statut invalide: inconnu')
+        self.assertEqual(result['results'][5]['campaign'], {'campaignName': 'F'})
+        self.assertEqual(sorted(Campaign.objects.values_list('campaign_name', flat=True)), ['A', 'F'])
+        # Display répété dans la même entrée : un seul lien
+        self.assertEqual(CampaignDisplay.objects.get().id_campaign.campaign_name, 'A')
+
+    def test_failed_write_rolls_back_every_campaign(self):
+        with mock.patch.object(CampaignDisplay.objects, 'bulk_create', side_effect=IntegrityError('échec')):
+            with self.assertRaisesMessage(Exception, 'échec'):
+                self.create([{'campaignName': 'A', 'idDisplays': [self.display.pk]}, {'campaignName': 'B'}])
+        self.assertFalse(Campaign.objects.exists())
+        self.assertFalse(ChangeLogEntry.objects.filter(model='campaign').exists())
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    LOGIN_HASH_WORKERS=2, LOGIN_MAX_FAILURES=3, LOGIN_MAX_CONCURRENT_PER_EMAIL=1,
+)
+class LoginTests(TestCase):
+    MUTATION = '''mutation ($email: String!, $mdp: String!) {
+        loginUtilisateur(email: $email, motDePasse: $mdp) { ok message }
+    }'''
+
+    def setUp(self):
+        # Pool de threads à la place des processus, et vérificateur neuf pour chaque test
+        self.enterContext(mock.patch('partenaire.auth.ProcessPoolExecutor', ThreadPoolExecutor))
+        self.enterContext(mock.patch('partenaire.auth._verifier', _Verifier()))
+        self.utilisateur = Utilisateur.objects.create(
+            nom='Nom', prenom='Prénom', email='login@example.com', role='client', mot_de_passe='secret',
+        )
+
+    def login(self, mot_de_passe, email='login@example.com'):
+        return execute(self.MUTATION, {'email': email, 'mdp': mot_de_passe})['loginUtilisateur']
+
+    def test_plaintext_password_is_hashed_on_first_login(self):
+        self.assertEqual(self.login('faux'), {'ok': False, 'message': 'Mot de passe incorrect'})
+        self.utilisateur.refresh_from_db()
+        self.assertEqual(self.utilisateur.mot_de_passe, 'secret')
+
+        self.assertTrue(self.login('secret')['ok'])
+        self.utilisateur.refresh_from_db()
+        self.assertTrue(self.utilisateur.mot_de_passe.startswith('md5$'))
+        self.assertTrue(check_password('secret', self.utilisateur.mot_de_passe))
+        # Le hash stocké suffit ensuite, sans nouvelle écriture
+        stored = self.utilisateur.mot_de_passe
+        self.assertTrue(self.login('secret')['ok'])
+        self.utilisateur.refresh_from_db()
+        self.assertEqual(self.utilisateur.mot_de_passe, stored)
+
+    def test_repeated_failures_throttle_the_email(self):
+        for _ in range(3):
+            self.assertEqual(self.login('faux')['message'], 'Mot de passe incorrect')
+        # Bloqué même avec le bon mot de passe, sans toucher au texte clair stocké
+        result = self.login('secret')
+        self.assertFalse(result['ok'])
+        self.assertIn("Trop d'échecs", result['message'])
+        self.utilisateur.refresh_from_db()
+        self.assertEqual(self.utilisateur.mot_de_passe, 'secret')
+        self.assertEqual(self.login('faux', email='autre@example.com')['message'], 'Utilisateur non trouvé')
+
+        later = time.monotonic() + 901
+        with mock.patch('partenaire.auth.time.monotonic', return_value=later):
+            self.assertTrue(self.login('secret')['ok'])
+
+    def test_success_resets_the_failure_count(self):
+        for _ in range(2):
+            self.login('faux')
+        self.assertTrue(self.login('secret')['ok'])
+        for _ in range(2):
+            self.assertEqual(self.login('faux')['message'], 'Mot de passe incorrect')
+
+    def test_concurrent_verifications_per_email_are_capped(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_verify(raw_password, encoded):
+            if raw_password == 'lent':
+                started.set()
+                release.wait(5)
+            return True, None
+
+        with mock.patch('partenaire.auth._verify', slow_verify):
+            worker = threading.Thread(target=verify_password, args=('a@example.com', 'lent', 'md5$a$b'))
+            worker.start()
+            try:
+                self.assertTrue(started.wait(5))
+                with self.assertRaisesMessage(LoginThrottled, 'simultanées'):
+                    verify_password('a@example.com', 'y', 'md5$a$b')
+                # Un autre email n'est pas concerné
+                self.assertEqual(verify_password('b@example.com', 'x', 'md5$a$b'), (True, None))
+            finally:
+                release.set()
+                worker.join()
+            self.assertEqual(verify_password('a@example.com', 'x', 'md5$a$b'), (True, None))
+
+
+class PlaylistIndexTests(TestCase):
+    def setUp(self):
+        # Index neuf par test ; les signaux marquent celui-ci
+        self.index = PlaylistIndex()
+        self.enterContext(mock.patch('partenaire.playlist.playlist_index', self.index))
+        self.display = Display.objects.create(display_name='Display')
+
+    def campaign(self, name, ordre=1, status='submitted', start=None, end=None, debut=None, fin=None):
+        campaign = Campaign.objects.create(campaign_name=name, status=status, start_date=start, end_date=end)
+        CampaignDisplay.objects.create(
+            id_campaign=campaign, id_display=self.display, date_debut_affichage=debut, date_fin_affichage=fin,
+        )
+        image = Image.objects.create(image=f'campaign_images/{name}.png')
+        CampaignImage.objects.create(id_campaign=campaign, id_image=image, ordre_affichage=ordre)
+        return campaign
+
+    def names(self, at):
+        ids = list(dict.fromkeys(entry.id_campaign for entry in self.index.playlist(self.display.pk, at)))
+        names = dict(Campaign.objects.filter(pk__in=ids).values_list('pk', 'campaign_name'))
+        return [names[pk] for pk in ids]
+
+    def test_windows_include_both_bounds(self):
+        # Dates propres au display, sinon celles de la campagne, sinon sans limite
+        self.campaign('A', debut=date(2026, 1, 10), fin=date(2026, 1, 20), start=date(2025, 1, 1))
+        self.campaign('B', start=date(2026, 1, 15), end=date(2026, 1, 31))
+        self.campaign('C')
+        self.assertEqual(self.names(date(2026, 1, 9)), ['C'])
+        self.assertEqual(self.names(date(2026, 1, 10)), ['A', 'C'])
+        self.assertEqual(self.names(date(2026, 1, 20)), ['A', 'B', 'C'])
+        self.assertEqual(self.names(date(2026, 1, 21)), ['B', 'C'])
+        self.assertEqual(self.names(date(2026, 1, 31)), ['B', 'C'])
+        self.assertEqual(self.names(date(2026, 2, 1)), ['C'])
+
+        entries = {entry.id_campaign: entry for entry in self.index.playlist(self.display.pk, date(2026, 1, 20))}
+        b, c = Campaign.objects.get(campaign_name='B'), Campaign.objects.get(campaign_name='C')
+        self.assertEqual((entries[b.pk].date_debut_affichage, entries[b.pk].date_fin_affichage),
+                         (date(2026, 1, 15), date(2026, 1, 31)))
+        self.assertEqual((entries[c.pk].date_debut_affichage, entries[c.pk].date_fin_affichage), (None, None))
+
+    def test_entries_follow_display_order_then_campaign(self):
+        first = self.campaign('A', ordre=2)
+        second = self.campaign('B', ordre=1)
+        third = self.campaign('C', ordre=2)
+        CampaignImage.objects.create(
+            id_campaign=first, id_image=Image.objects.create(image='campaign_images/A0.png'), ordre_affichage=0,
+        )
+        entries = self.index.playlist(self.display.pk, date(2026, 1, 1))
+        self.assertEqual(
+            [(entry.id_campaign, entry.ordre_affichage) for entry in entries],
+            [(first.pk, 0), (second.pk, 1), (first.pk, 2), (third.pk, 2)],
+        )
+
+    def test_only_submitted_campaigns_on_active_displays(self):
+        self.campaign('A')
+        for status in ('upload', 'pending', 'completed', 'cancelled'):
+            self.campaign(status, status=status)
+        self.assertEqual(self.names(date(2026, 1, 1)), ['A'])
+        self.assertEqual(self.index.playlist(self.display.pk + 1, date(2026, 1, 1)), [])
+
+    def test_campaign_changes_update_the_index(self):
+        campaign = self.campaign('A', start=date(2026, 1, 1), end=date(2026, 1, 31))
+        self.assertEqual(self.names(date(2026, 1, 20)), ['A'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            campaign.end_date = date(2026, 1, 15)
+            campaign.save()
+        self.assertEqual(self.names(date(2026, 1, 20)), [])
+        self.assertEqual(self.names(date(2026, 1, 15)), ['A'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(image='campaign_images/A2.png')
+            CampaignImage.objects.create(id_campaign=campaign, id_image=image, ordre_affichage=5)
+        self.assertEqual([entry.id_image for entry in self.index.playlist(self.display.pk, date(2026, 1, 2))][-1],
+                         image.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            campaign.status = 'cancelled'
+            campaign.save()
+        self.assertEqual(self.names(date(2026, 1, 2)), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            campaign.status = 'submitted'
+            campaign.save()
+        self.assertEqual(self.names(date(2026, 1, 2)), ['A'])
+
+    def test_display_changes_update_the_index(self):
+        self.campaign('A')
+        other = Display.objects.create(display_name='Autre')
+        self.assertEqual(self.names(date(2026, 1, 1)), ['A'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.display.actif = False
+            self.display.save()
+        self.assertEqual(self.names(date(2026, 1, 1)), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.display.actif = True
+            self.display.save()
+            CampaignDisplay.objects.filter(id_display=self.display).update(id_display=other)
+            for link in CampaignDisplay.objects.filter(id_display=other):
+                link.save()
+        self.assertEqual(self.names(date(2026, 1, 1)), [])
+        self.assertEqual(len(self.index.playlist(other.pk, date(2026, 1, 1))), 1)
+
+    def test_unsignalled_writes_are_picked_up_after_max_age(self):
+        campaign = self.campaign('A')
+        self.assertEqual(self.names(date(2026, 1, 1)), ['A'])
+        # Écriture d'un autre processus : pas de signal dans celui-ci
+        Campaign.objects.filter(pk=campaign.pk).update(status='cancelled')
+        self.assertEqual(self.names(date(2026, 1, 1)), ['A'])
+        later = time.monotonic() + settings.PLAYLIST_INDEX_MAX_AGE + 1
+        with mock.patch('partenaire.playlist.time.monotonic', return_value=later):
+            self.assertEqual(self.names(date(2026, 1, 1)), [])
+
+
+class WebSocketClient:
+    """Client graphql-transport-ws branché directement sur l'application ASGI."""
+
+    def __init__(self, subprotocols=(PROTOCOL,)):
+        self.inbound, self.outbound = asyncio.Queue(), asyncio.Queue()
+        scope = {'type': 'websocket', 'path': '/graphql/ws/', 'headers': [], 'subprotocols': list(subprotocols)}
+        self.task = asyncio.create_task(websocket_application(scope, self.inbound.get, self.outbound.put))
+
+    async def connect(self):
+        await self.inbound.put({'type': 'websocket.connect'})
+        return await self.receive_event()
+
+    async def send(self, message):
+        await self.inbound.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+
+    async def receive_event(self):
+        return await asyncio.wait_for(self.outbound.get(), 5)
+
+    async def receive(self):
+        event = await self.receive_event()
+        return json.loads(event['text']) if event['type'] == 'websocket.send' else event
+
+    async def init(self, payload=None):
+        await self.connect()
+        await self.send({'type': 'connection_init', 'payload': payload or {}})
+        return await self.receive()
+
+    async def disconnect(self):
+        await self.inbound.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE_ALIAS=None)
+class WebSocketTests(TestCase):
+    SUBSCRIPTION = 'subscription ($ids: [Int!]) { campaignUpdated(ids: $ids) { campaignName status } }'
+
+    def setUp(self):
+        self.broker = LocalBroker()
+        self.enterContext(mock.patch('partenaire.pubsub._broker', self.broker))
+        self.campaign = Campaign.objects.create(campaign_name='Campagne')
+
+    def run_async(self, coroutine_function):
+        async_to_sync(coroutine_function)()
+
+    def rename(self, name):
+        # Publication au commit, comme en production
+        with self.captureOnCommitCallbacks(execute=True):
+            self.campaign.campaign_name = name
+            self.campaign.save()
+
+    async def subscribed(self, count=1):
+        while len(self.broker._subscribers[CAMPAIGN]) != count:
+            await asyncio.sleep(0.01)
+
+    def test_handshake(self):
+        async def scenario():
+            client = WebSocketClient()
+            self.assertEqual(await client.connect(), {'type': 'websocket.accept', 'subprotocol': PROTOCOL})
+            await client.send({'type': 'connection_init'})
+            self.assertEqual(await client.receive(), {'type': 'connection_ack'})
+            await client.send({'type': 'ping'})
+            self.assertEqual(await client.receive(), {'type': 'pong'})
+            await client.send({'type': 'connection_init'})
+            self.assertEqual((await client.receive())['code'], 4429)
+            await asyncio.wait_for(client.task, 5)
+
+        self.run_async(scenario)
+
+    def test_protocol_errors_close_the_connection(self):
+        async def scenario():
+            client = WebSocketClient(subprotocols=['graphql-ws'])
+            self.assertEqual((await client.connect())['code'], 4406)
+
+            client = WebSocketClient()
+            await client.connect()
+            await client.send({'type': 'inconnu'})
+            self.assertEqual((await client.receive())['code'], 4400)
+
+            with override_settings(SUBSCRIPTION_CONNECTION_INIT_TIMEOUT=0.01):
+                client = WebSocketClient()
+                await client.connect()
+                self.assertEqual((await client.receive())['code'], 4408)
+
+        self.run_async(scenario)
+
+    def test_unauthenticated_connections_are_rejected(self):
+        user = User.objects.create_user('abonne')
+        token = get_token(user)
+
+        async def scenario():
+            # subscribe avant connection_init
+            client = WebSocketClient()
+            await client.connect()
+            await client.send({'id': '1', 'type': 'subscribe', 'payload': {'query': self.SUBSCRIPTION}})
+            self.assertEqual((await client.receive())['code'], 4401)
+            await asyncio.wait_for(client.task, 5)
+            self.assertEqual(self.broker._subscribers[CAMPAIGN], set())
+
+            client = WebSocketClient()
+            self.assertEqual((await client.init({'Authorization': 'JWT invalide'}))['code'], 4403)
+
+            client = WebSocketClient()
+            self.assertEqual(await client.init({'Authorization': f'JWT {token}'}), {'type': 'connection_ack'})
+            await client.disconnect()
+
+        self.run_async(scenario)
+
+    def test_subscribe_next_complete(self):
+        async def scenario():
+            client = WebSocketClient()
+            await client.init()
+            await client.send({
+                'id': 'a', 'type': 'subscribe',
+                'payload': {'query': self.SUBSCRIPTION, 'variables': {'ids': [self.campaign.pk]}},
+            })
+            await self.subscribed()
+            await sync_to_async(self.rename)('Renommée')
+            self.assertEqual(await client.receive(), {
+                'id': 'a', 'type': 'next',
+                'payload': {'data': {'campaignUpdated': {'campaignName': 'Renommée', 'status': 'UPLOAD'}}},
+            })
+
+            # `complete` du client : fin de l'abonnement, sans réponse
+            await client.send({'id': 'a', 'type': 'complete'})
+            await self.subscribed(0)
+            await sync_to_async(self.rename)('Ignorée')
+
+            # Requête sur la connexion : un `next` puis `complete` du serveur
+            await client.send({
+                'id': 'b', 'type': 'subscribe',
+                'payload': {'query': '{ campaignById(id: %d) { campaignName } }' % self.campaign.pk},
+            })
+            self.assertEqual(await client.receive(), {
+                'id': 'b', 'type': 'next', 'payload': {'data': {'campaignById': {'campaignName': 'Ignorée'}}},
+            })
+            self.assertEqual(await client.receive(), {'id': 'b', 'type': 'complete'})
+            await client.disconnect()
+
+        self.run_async(scenario)
+
+    def test_rejected_operations_get_an_error(self):
+        async def scenario():
+            client = WebSocketClient()
+            await client.init()
+            await client.send({
+                'id': 'm', 'type': 'subscribe',
+                'payload': {'query': 'mutation { deleteCampaign(id: %d) { ok } }' % self.campaign.pk},
+            })
+            message = await client.receive()
+            self.assertEqual((message['id'], message['type']), ('m', 'error'))
+            self.assertIn('/graphql/', message['payload'][0]['message'])
+
+            await client.send({'id': 'x', 'type': 'subscribe', 'payload': {'query': '{ inconnu }'}})
+            self.assertEqual((await client.receive())['type'], 'error')
+            await client.disconnect()
+
+        self.run_async(scenario)
+        self.assertTrue(Campaign.objects.filter(pk=self.campaign.pk).exists())
+
+
+class SchemaSurfaceTests(TestCase):
+    def test_image_uploads_are_not_exposed_on_other_types(self):
+        types = schema.graphql_schema.type_map
+        self.assertNotIn('imageUploads', types['UtilisateurType'].fields)
+        self.assertNotIn('imageuploadSet', types['ImageType'].fields)
+        self.assertNotIn('imageuploadSet', types['CampaignType'].fields)
+
+    def test_display_key_is_not_exposed(self):
+        self.assertNotIn('cleImpressions', schema.graphql_schema.type_map['DisplayType'].fields)
@@ -0,0 +1,258 @@
+import contextvars
+import heapq
+import inspect
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+from .middleware import in_event_loop
+from .persisted import document_cache
+
+logger = logging.getLogger(__name__)
+
+# Requêtes SQL exécutées en dehors de tout resolver (session, JWT, cache de réponses...)
+OUTSIDE_RESOLVERS = '(hors resolver)'
+
+# Trace de l'opération en cours et resolver en cours (chemin, Type.champ). Variables de
+# contexte : elles suivent les tâches de la vue asynchrone et les threads de sync_to_async
+_current_trace = contextvars.ContextVar('graphql_trace', default=None)
+_current_resolver = contextvars.ContextVar('graphql_resolver', default=(OUTSIDE_RESOLVERS, OUTSIDE_RESOLVERS))
+
+
+class _PathStats:
+    __slots__ = ('calls', 'seconds', 'sql_count', 'sql_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+
+
+class Trace:
+    """
+    Temps et requêtes SQL de la requête, par chemin de resolver (alias compris, sans les index
+    de liste) et par champ du schéma (Type.champ).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.duration = None
+        self.paths = {}
+        self.fields = {}
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.slowest = []
+        # Resolvers dans la boucle d'événements, SQL dans le thread de sync_to_async
+        self._lock = threading.Lock()
+
+    def _stats(self, key):
+        path, field = key
+        stats = self.paths.get(path)
+        if stats is None:
+            stats = self.paths[path] = _PathStats()
+        field_stats = self.fields.get(field)
+        if field_stats is None:
+            field_stats = self.fields[field] = _PathStats()
+        return stats, field_stats
+
+    def resolve(self, next, root, info, args):
+        path = '.'.join(key for key in info.path.as_list() if isinstance(key, str))
+        key = (path, f'{info.parent_type.name}.{info.field_name}')
+        if in_event_loop():
+            return self._resolve_async(next, root, info, args, key)
+        token = _current_resolver.set(key)
+        start = time.perf_counter()
+        try:
+            return next(root, info, **args)
+        finally:
+            _current_resolver.reset(token)
+            self._add_call(key, time.perf_counter() - start)
+
+    async def _resolve_async(self, next, root, info, args, key):
+        # Le resolver est appelé dans ce contexte : ses passages par sync_to_async emportent
+        # `key` et leurs requêtes SQL lui sont attribuées
+        token = _current_resolver.set(key)
+        start = time.perf_counter()
+        try:
+            result = next(root, info, **args)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        finally:
+            _current_resolver.reset(token)
+            self._add_call(key, time.perf_counter() - start)
+
+    def _add_call(self, key, seconds):
+        with self._lock:
+            for stats in self._stats(key):
+                stats.calls += 1
+                stats.seconds += seconds
+
+    def execute_sql(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            key = _current_resolver.get()
+            with self._lock:
+                for stats in self._stats(key):
+                    stats.sql_count += 1
+                    stats.sql_seconds += elapsed
+                self.sql_count += 1
+                self.sql_seconds += elapsed
+                entry = (elapsed, self.sql_count, sql, key[0])
+                if len(self.slowest) < settings.GRAPHQL_TRACING_SLOWEST_QUERIES:
+                    heapq.heappush(self.slowest, entry)
+                else:
+                    heapq.heappushpop(self.slowest, entry)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+
+    def report(self):
+        return {
+            'duration': _ms(self.duration),
+            'sql': {'count': self.sql_count, 'duration': _ms(self.sql_seconds)},
+            'resolvers': [
+                {
+                    'path': path, 'calls': stats.calls, 'duration': _ms(stats.seconds),
+                    'sqlCount': stats.sql_count, 'sqlDuration': _ms(stats.sql_seconds),
+                }
+                for path, stats in sorted(self.paths.items(), key=lambda item: -item[1].seconds - item[1].sql_seconds)
+            ],
+            'slowestQueries': [
+                {'sql': sql, 'path': path, 'duration': _ms(elapsed)}
+                for elapsed, _, sql, path in sorted(self.slowest, reverse=True)
+            ],
+            'documentCache': document_cache.stats(),
+        }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+class Metrics:
+    """
+    Agrégats des requêtes échantillonnées, exposés au format texte Prometheus. Indexés par
+    champ du schéma (Type.champ) : les alias choisis par les clients ne créent pas de séries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.traced = 0
+        self.fields = {}
+
+    def record_request(self, trace):
+        with self._lock:
+            self.requests += 1
+            if trace is None:
+                return
+            self.traced += 1
+            for field, stats in trace.fields.items():
+                total = self.fields.get(field)
+                if total is None:
+                    total = self.fields[field] = _PathStats()
+                total.calls += stats.calls
+                total.seconds += stats.seconds
+                total.sql_count += stats.sql_count
+                total.sql_seconds += stats.sql_seconds
+
+    def render(self):
+        lines = [
+            '# TYPE graphql_requests_total counter',
+            f'graphql_requests_total {self.requests}',
+            '# TYPE graphql_traced_requests_total counter',
+            f'graphql_traced_requests_total {self.traced}',
+        ]
+        series = (
+            ('graphql_resolver_calls_total', 'calls'),
+            ('graphql_resolver_seconds_total', 'seconds'),
+            ('graphql_resolver_sql_queries_total', 'sql_count'),
+            ('graphql_resolver_sql_seconds_total', 'sql_seconds'),
+        )
+        with self._lock:
+            for name, attribute in series:
+                lines.append(f'# TYPE {name} counter')
+                for field, stats in sorted(self.fields.items()):
+                    lines.append(f'{name}{{field="{field}"}} {getattr(stats, attribute)}')
+        for key, value in document_cache.stats().items():
+            lines.append(f'# TYPE graphql_document_cache_{key} gauge')
+            lines.append(f'graphql_document_cache_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def _execute_sql(execute, sql, params, many, context):
+    trace = _current_trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    return trace.execute_sql(execute, sql, params, many, context)
+
+
+def _install_sql_wrapper(sender, connection, **kwargs):
+    # Une connexion par thread, dont celui de sync_to_async. En tête de liste : les
+    # connection.execute_wrapper() ouverts avant la connexion retirent toujours le leur
+    if _execute_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _execute_sql)
+
+
+def connect_signals():
+    connection_created.connect(_install_sql_wrapper, dispatch_uid='graphql-tracing-sql')
+
+
+@contextmanager
+def trace_request(request):
+    """
+    Trace l'exécution d'une opération GraphQL avec la probabilité GRAPHQL_TRACING_SAMPLE_RATE.
+    Fournit la Trace (ou None si l'opération n'est pas échantillonnée).
+    """
+    rate = settings.GRAPHQL_TRACING_SAMPLE_RATE
+    if not rate or random.random() >= rate:
+        try:
+            yield None
+        finally:
+            metrics.record_request(None)
+        return
+
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+        metrics.record_request(trace)
+        if not settings.DEBUG:
+            logger.info(json.dumps({'event': 'graphql_trace', 'path': request.path, **trace.report()}))
+
+
+def traced_middleware(middleware):
+    """
+    Middlewares de l'opération en cours : sans TracingMiddleware si elle n'est pas échantillonnée,
+    pour ne pas ajouter un appel à chaque champ résolu.
+    """
+    if _current_trace.get() is not None:
+        return middleware
+    return [entry for entry in middleware if not isinstance(entry, TracingMiddleware)]
+
+
+class TracingMiddleware:
+    """Middleware graphene : mesure chaque resolver des opérations échantillonnées par trace_request."""
+
+    def resolve(self, next, root, info, **args):
+        trace = _current_trace.get()
+        if trace is None:
+            return next(root, info, **args)
+        return trace.resolve(next, root, info, args)
@@ -0,0 +1,131 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .blobs import ChecksumError, store_image
+from .images import schedule_variants
+from .models import Campaign, CampaignImage, ImageUpload
+from .pubsub import CAMPAIGN, publish
+from .response_cache import invalidate
+from .sync import record_changes
+
+# Nombre d'images à partir duquel une campagne en 'upload' passe en 'pending'
+IMAGES_FOR_PENDING = 3
+
+
+class UploadError(Exception):
+    pass
+
+
+def attach_image_to_campaign(image_obj, id_campaign):
+    """Rattache l'image à la campagne et applique la transition 'upload' -> 'pending'."""
+    campaign = Campaign.objects.get(pk=id_campaign)
+    CampaignImage.objects.create(id_campaign=campaign, id_image=image_obj)
+    # Incrémente le compteur d'images et, si la campagne était en 'upload' et atteint
+    # 3 images, la passe à 'pending' : un seul UPDATE, sans COUNT(*)
+    Campaign.objects.filter(pk=campaign.pk).update(
+        nombre_images=F('nombre_images') + 1,
+        date_modification=timezone.now(),
+        status=Case(
+            When(status='upload', nombre_images__gte=IMAGES_FOR_PENDING - 1, then=Value('pending')),
+            default=F('status'),
+        ),
+    )
+    # update() n'envoie pas post_save
+    invalidate(Campaign)
+    publish(CAMPAIGN, [campaign.pk])
+    record_changes(Campaign, [campaign.pk])
+    campaign.refresh_from_db(fields=['status', 'nombre_images'])
+    return campaign
+
+
+def temp_path(upload):
+    directory = settings.IMAGE_UPLOAD_TEMP_DIR
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f'{upload.upload_id}.part')
+
+
+def _remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def init_upload(filename, total_size, description=None, id_utilisateur_partenaire=None, id_campaign=None):
+    if total_size <= 0:
+        raise UploadError("Taille de fichier invalide")
+    upload = ImageUpload.objects.create(
+        filename=os.path.basename(filename),
+        total_size=total_size,
+        description=description,
+        id_utilisateur_partenaire_id=id_utilisateur_partenaire,
+        id_campaign_id=id_campaign,
+    )
+    open(temp_path(upload), 'wb').close()
+    return upload
+
+
+def append_chunk(upload_id, offset, chunk, checksum):
+    """
+    Écrit `chunk` à `offset` dans le fichier temporaire, morceau par morceau, en vérifiant
+    son SHA-256. Un morceau déjà reçu (renvoyé après une coupure) est simplement ignoré.
+    """
+    with transaction.atomic():
+        upload = ImageUpload.objects.select_for_update().get(upload_id=upload_id)
+        if upload.status != 'pending':
+            raise UploadError("Upload déjà finalisé")
+        if offset + chunk.size <= upload.received_size:
+            return upload
+        if offset != upload.received_size:
+            raise UploadError(f"Offset attendu: {upload.received_size}")
+        if offset + chunk.size > upload.total_size:
+            raise UploadError("Le morceau dépasse la taille annoncée")
+
+        digest = hashlib.sha256()
+        with open(temp_path(upload), 'r+b') as destination:
+            destination.seek(offset)
+            for piece in chunk.chunks():
+                digest.update(piece)
+                destination.write(piece)
+            if digest.hexdigest() != checksum.lower():
+                # Annuler l'écriture : le client renverra le même morceau
+                destination.truncate(offset)
+                raise UploadError("Checksum du morceau invalide")
+        upload.received_size = offset + chunk.size
+        upload.save(update_fields=['received_size', 'date_modification'])
+    return upload
+
+
+def finalize_upload(upload_id, checksum=None):
+    """Crée l'Image (et le lien CampaignImage) à partir du fichier reçu en entier."""
+    with transaction.atomic():
+        upload = ImageUpload.objects.select_for_update().get(upload_id=upload_id)
+        if upload.status == 'completed':
+            return upload.id_image
+        if upload.received_size != upload.total_size:
+            raise UploadError(f"Upload incomplet: {upload.received_size}/{upload.total_size} octets")
+
+        path = temp_path(upload)
+        # Checksum vérifié pendant la copie vers le stockage : le fichier n'est lu qu'une fois
+        with open(path, 'rb') as source:
+            try:
+                image_obj = store_image(
+                    File(source, name=upload.filename), checksum=checksum,
+                    description=upload.description,
+                    id_utilisateur_partenaire_id=upload.id_utilisateur_partenaire_id,
+                )
+            except ChecksumError as e:
+                raise UploadError(str(e))
+        schedule_variants(image_obj)
+        if upload.id_campaign_id:
+            attach_image_to_campaign(image_obj, upload.id_campaign_id)
+        upload.status = 'completed'
+        upload.id_image = image_obj
+        upload.save(update_fields=['status', 'id_image', 'date_modification'])
+        # Le fichier temporaire n'est supprimé qu'une fois l'Image enregistrée
+        transaction.on_commit(lambda: _remove_file(path))
+    return image_obj
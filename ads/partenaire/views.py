@@ -1,3 +1,463 @@
-from django.shortcuts import render
+import asyncio
+import hmac
+import inspect
+import json
+from collections import namedtuple
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse
+from django.views.decorators.http import condition, require_POST
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import HttpError
+from graphene_file_upload.django import FileUploadGraphQLView
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast
+
+from .middleware import SyncResolverMiddleware
+from .models import Utilisateur
+from . import response_cache
+from .avatars import avatar_content_type, avatar_etag
+from .cost import check_query_cost
+from .db import serialized_writes
+from .impressions import (
+    ImpressionError, ImpressionForbidden, caller_displays, check_pairs, parse_events, record_impressions,
+)
+from .jwt_auth import authenticate_request
+from .loaders import reset_loaders
+from .persisted import PersistedQueryError, document_cache, query_hash, register_query, resolve_persisted_query
+from .tracing import metrics, trace_request, traced_middleware
+
+
+def _check_batch(operations):
+    if not operations:
+        raise HttpError(HttpResponseBadRequest("Received an empty list in the batch request."))
+    if len(operations) > settings.GRAPHQL_MAX_BATCH_SIZE:
+        raise HttpError(HttpResponseBadRequest(
+            f"Au plus {settings.GRAPHQL_MAX_BATCH_SIZE} opérations par requête groupée."
+        ))
+    if not all(isinstance(data, dict) for data in operations):
+        raise HttpError(HttpResponseBadRequest("The received data is not a valid JSON query."))
+
+
+class GraphQLView(FileUploadGraphQLView):
+    """
+    Vue GraphQL du projet : uploads multipart, requêtes persistées (hash SHA-256 à la place du
+    texte), cache des documents déjà analysés et validés et cache des réponses aux lectures.
+
+    Un corps JSON (ou `operations` multipart) sous forme de liste est une requête groupée :
+    les opérations sont exécutées dans l'ordre avec le même contexte (utilisateur JWT,
+    loaders) et la réponse est la liste de leurs résultats.
+    """
+
+    def parse_body(self, request):
+        content_type = self.get_content_type(request)
+        if content_type == 'application/json' and request.body.lstrip()[:1] == b'[':
+            try:
+                data = json.loads(request.body)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("POST body sent invalid JSON."))
+        else:
+            data = super().parse_body(request)
+        if isinstance(data, list):
+            _check_batch(data)
+        return data
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        if extensions and isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        try:
+            query, request.graphql_query_hash, request.graphql_register_query = resolve_persisted_query(
+                query, extensions,
+            )
+        except PersistedQueryError as e:
+            # PersistedQueryNotFound répond en 200 : le client renvoie alors la requête complète
+            status = 200 if e.code == 'PERSISTED_QUERY_NOT_FOUND' else 400
+            raise HttpError(HttpResponse(status=status), str(e))
+        return query, variables, operation_name, id
+
+    def get_response(self, request, data, show_graphiql=False):
+        if isinstance(data, list):
+            return self.get_batch_response(request, data)
+        response, status_code = self.get_operation_response(request, data, show_graphiql)
+        if response is None:
+            return None, status_code
+        return self.json_encode(request, response, pretty=show_graphiql), status_code
+
+    def get_batch_response(self, request, operations):
+        responses, status_code = [], 200
+        for data in operations:
+            # Une opération en échec ne fait pas échouer les suivantes
+            setattr(request, MUTATION_ERRORS_FLAG, False)
+            try:
+                response, status = self.get_operation_response(request, data)
+            except HttpError as e:
+                response, status = {'errors': [self.format_error(e)]}, e.response.status_code
+            responses.append(response)
+            status_code = max(status_code, status)
+        return self.json_encode(request, responses), status_code
+
+    def get_operation_response(self, request, data, show_graphiql=False):
+        # Reprise de graphene-django : ajoute `extensions` (coût estimé) à la réponse
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if not execution_result:
+            return None, status_code
+
+        response = {}
+        if execution_result.errors:
+            set_rollback()
+            response["errors"] = [self.format_error(e) for e in execution_result.errors]
+
+        if execution_result.errors and any(not getattr(e, "path", None) for e in execution_result.errors):
+            status_code = 400
+        else:
+            response["data"] = execution_result.data
+
+        if execution_result.extensions:
+            response["extensions"] = execution_result.extensions
+
+        if self.batch:
+            response["id"] = id
+            response["status"] = status_code
+
+        return response, status_code
+
+    def get_document(self, request, query):
+        return document_cache.get_document(
+            self.schema.graphql_schema, query,
+            digest=getattr(request, 'graphql_query_hash', None),
+            validation_rules=self.validation_rules,
+            max_errors=graphene_settings.MAX_VALIDATION_ERRORS,
+        )
+
+    def get_response_cache_key(self, request, query, document, variables, operation_name):
+        digest = getattr(request, 'graphql_query_hash', None) or query_hash(query)
+        return response_cache.cache_key(
+            self.schema.graphql_schema, request, document, digest, operation_name, variables,
+        )
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        document, errors = self.get_document(request, query)
+        if errors:
+            return ExecutionResult(data=None, errors=errors)
+        # Requête APQ enregistrée seulement une fois analysée et validée
+        if getattr(request, 'graphql_register_query', False):
+            register_query(request.graphql_query_hash, query)
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ["POST"],
+                "Can only perform a {} operation from a POST request.".format(operation_ast.operation.value),
+            ))
+
+        # Estimation du coût avant l'exécution de tout resolver
+        try:
+            cost = check_query_cost(self.schema.graphql_schema, document, operation_name, variables)
+        except GraphQLError as e:
+            return ExecutionResult(data=None, errors=[e])
+
+        with trace_request(request) as trace:
+            result = self.execute_document(request, query, document, operation_ast, variables, operation_name)
+        result.extensions = {**(result.extensions or {}), 'cost': cost}
+        if trace is not None and settings.DEBUG:
+            result.extensions['tracing'] = trace.report()
+        return result
+
+    def execute_document(self, request, query, document, operation_ast, variables, operation_name):
+        cache_key = self.get_response_cache_key(request, query, document, variables, operation_name)
+        if cache_key:
+            data = response_cache.get_response(cache_key)
+            if data is not None:
+                return ExecutionResult(data=data)
+
+        try:
+            execute_options = {
+                "root_value": self.get_root_value(request),
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": traced_middleware(self.get_middleware(request)),
+            }
+            if self.execution_context_class:
+                execute_options["execution_context_class"] = self.execution_context_class
+
+            if operation_ast is not None and operation_ast.operation == OperationType.MUTATION:
+                return self.execute_mutation(request, document, **execute_options)
+
+            result = execute(self.schema.graphql_schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+        if cache_key and not result.errors:
+            response_cache.store_response(cache_key, result.data)
+        return result
+
+    def execute_mutation(self, request, document, **execute_options):
+        """Exécution synchrone d'une mutation : écritures sérialisées (SQLite), ATOMIC_MUTATIONS."""
+        # Loaders vides avant et après : une mutation d'une requête groupée ne lit ni ne
+        # laisse aux opérations suivantes des objets chargés avant l'écriture
+        reset_loaders(execute_options["context_value"])
+        try:
+            with serialized_writes():
+                if (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                ):
+                    with transaction.atomic():
+                        result = execute(self.schema.graphql_schema, document, **execute_options)
+                        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                            transaction.set_rollback(True)
+                    return result
+                return execute(self.schema.graphql_schema, document, **execute_options)
+        finally:
+            reset_loaders(execute_options["context_value"])
+
+
+# Opération d'une requête sur AsyncGraphQLView ; `error` : réponse déjà prête (statut compris)
+_Operation = namedtuple(
+    '_Operation', ['document', 'variables', 'operation_name', 'cost', 'cache_key', 'is_mutation', 'error'],
+    defaults=(None,) * 7,
+)
+
+
+class AsyncGraphQLView(GraphQLView):
+    """
+    Point d'entrée GraphQL natif ASGI : le schéma est exécuté en asynchrone, la requête
+    (y compris les uploads multipart) est lue par le serveur ASGI sans occuper de thread.
+    Dans une requête groupée, les lectures consécutives sont exécutées de façon concurrente.
+    """
+    view_is_async = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Lectures exécutées dans la boucle ; self.middleware reste celui des mutations, exécutées
+        # en synchrone dans un thread
+        self.async_middleware = [SyncResolverMiddleware()] + list(self.middleware)
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        try:
+            data = self.parse_body(request)
+        except HttpError as e:
+            return self._response(request, {'errors': [self.format_error(e)]}, e.response.status_code)
+
+        # Résoudre l'utilisateur (session, puis jeton JWT) avant l'exécution : les middlewares
+        # s'exécutent dans la boucle d'événements, sans accès à la base
+        request.user = await request.auser()
+        await sync_to_async(authenticate_request)(request)
+        if not isinstance(data, list):
+            response, status = await self._execute_operation(request, await self._prepare_operation(request, data))
+            return self._response(request, response, status)
+
+        # Analysées dans l'ordre : l'empreinte de la requête persistée est rangée sur `request`
+        operations = [await self._prepare_operation(request, entry) for entry in data]
+        results = []
+        index = 0
+        while index < len(operations):
+            # Les lectures consécutives sont exécutées ensemble ; une mutation est exécutée seule,
+            # après les opérations qui la précèdent
+            group = [operations[index]]
+            index += 1
+            while not group[0].is_mutation and index < len(operations) and not operations[index].is_mutation:
+                group.append(operations[index])
+                index += 1
+            results.extend(await asyncio.gather(*(self._execute_operation(request, operation) for operation in group)))
+        return self._response(request, [response for response, _ in results], max(status for _, status in results))
+
+    async def _prepare_operation(self, request, data):
+        """Analyse, validation et estimation du coût d'une opération, avant toute exécution."""
+        try:
+            # Peut lire la table des requêtes persistées
+            query, variables, operation_name, _ = await sync_to_async(self.get_graphql_params)(request, data)
+        except HttpError as e:
+            return _Operation(error=({'errors': [self.format_error(e)]}, e.response.status_code))
+        if not query:
+            return _Operation(error=({'errors': [{'message': "Must provide query string."}]}, 400))
+
+        document, errors = self.get_document(request, query)
+        if errors:
+            return _Operation(error=({'errors': [self.format_error(error) for error in errors]}, 400))
+        if getattr(request, 'graphql_register_query', False):
+            await sync_to_async(register_query)(request.graphql_query_hash, query)
+
+        try:
+            # Les statistiques des tables peuvent être relues en base
+            cost = await sync_to_async(check_query_cost)(self.schema.graphql_schema, document, operation_name, variables)
+        except GraphQLError as e:
+            return _Operation(error=({'errors': [self.format_error(e)]}, 400))
+
+        cache_key = await sync_to_async(self.get_response_cache_key)(
+            request, query, document, variables, operation_name,
+        )
+        operation_ast = get_operation_ast(document, operation_name)
+        return _Operation(
+            document, variables, operation_name, cost, cache_key,
+            is_mutation=operation_ast is not None and operation_ast.operation == OperationType.MUTATION,
+        )
+
+    async def _execute_operation(self, request, operation):
+        if operation.error:
+            return operation.error
+        # Chaque opération a sa trace : celles d'une requête groupée sont exécutées ensemble
+        with trace_request(request) as trace:
+            response, status = await self._run_operation(request, operation)
+        if trace is not None and settings.DEBUG:
+            response['extensions']['tracing'] = trace.report()
+        return response, status
+
+    async def _run_operation(self, request, operation):
+        if operation.cache_key:
+            data = await sync_to_async(response_cache.get_response)(operation.cache_key)
+            if data is not None:
+                return {'data': data, 'extensions': {'cost': operation.cost}}, 200
+
+        if operation.is_mutation:
+            # Même chemin que GraphQLView (écritures sérialisées, ATOMIC_MUTATIONS), dans le
+            # thread partagé de sync_to_async
+            setattr(request, MUTATION_ERRORS_FLAG, False)
+            result = await sync_to_async(self.execute_mutation)(
+                request, operation.document,
+                variable_values=operation.variables,
+                operation_name=operation.operation_name,
+                context_value=request,
+                middleware=traced_middleware(self.middleware),
+            )
+        else:
+            result = execute(
+                self.schema.graphql_schema, operation.document,
+                variable_values=operation.variables,
+                operation_name=operation.operation_name,
+                context_value=request,
+                middleware=traced_middleware(self.async_middleware),
+            )
+            if inspect.isawaitable(result):
+                result = await result
+        if operation.cache_key and not result.errors:
+            await sync_to_async(response_cache.store_response)(operation.cache_key, result.data)
+        response = {}
+        if result.errors:
+            response['errors'] = [self.format_error(error) for error in result.errors]
+        if result.data is not None or not result.errors:
+            response['data'] = result.data
+        response['extensions'] = {'cost': operation.cost}
+        return response, 200 if result.data is not None else 400
+
+    def _response(self, request, data, status):
+        return HttpResponse(
+            status=status, content=self.json_encode(request, data), content_type='application/json',
+        )
+
+
+def _metrics_allowed(request):
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = settings.GRAPHQL_METRICS_TOKEN
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+
+def metrics_view(request):
+    """Métriques des requêtes GraphQL tracées, au format texte Prometheus (staff ou jeton)."""
+    if not settings.GRAPHQL_METRICS_ENABLED:
+        raise Http404
+    if not _metrics_allowed(request):
+        response = HttpResponse(status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4')
+
+
+@require_POST
+def impressions_view(request):
+    """
+    Réception par lots des impressions des écrans :
+    {"events": [{"campaign": 1, "display": 2, "count": 3, "timestamp": "..."}]}.
+    Envoyées par un display (Authorization: Display <clé>) ou par son partenaire, pour des
+    campagnes diffusées sur ses displays. Les compteurs sont mis à jour en base en différé
+    (partenaire.impressions).
+    """
+    allowed = caller_displays(request)
+    if allowed is None:
+        return JsonResponse({'error': "Authentification requise (display ou partenaire)"}, status=401)
+    try:
+        events = parse_events(json.loads(request.body).get('events'))
+        check_pairs(events, allowed)
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': "Corps JSON invalide"}, status=400)
+    except ImpressionForbidden as e:
+        return JsonResponse({'error': str(e)}, status=403)
+    except ImpressionError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'accepted': record_impressions(events)}, status=202)
+
+
+def _avatar_name(request, user_id):
+    # Lu une seule fois par requête : sert à l'ETag, à Last-Modified et à la réponse
+    if not hasattr(request, 'avatar_name'):
+        request.avatar_name = (
+            Utilisateur.objects.filter(pk=user_id).values_list('picture', flat=True).first() or None
+        )
+    return request.avatar_name
+
+
+def _avatar_etag(request, user_id):
+    name = _avatar_name(request, user_id)
+    return avatar_etag(name) if name else None
+
+
+def _avatar_last_modified(request, user_id):
+    name = _avatar_name(request, user_id)
+    if name is None:
+        return None
+    try:
+        return default_storage.get_modified_time(name)
+    except (OSError, NotImplementedError):
+        return None
+
+
+@condition(etag_func=_avatar_etag, last_modified_func=_avatar_last_modified)
+def avatar_view(request, user_id):
+    """
+    Photo de profil d'un utilisateur, lue en flux depuis le stockage des médias. Le nom du
+    fichier contient le hash du contenu : il sert d'ETag et les clients revalident par 304.
+    """
+    name = _avatar_name(request, user_id)
+    content_type = avatar_content_type(name) if name else None
+    if content_type is None:
+        # Aucune photo, ou fichier d'avant la vérification du format : jamais servi
+        raise Http404
+    try:
+        response = FileResponse(default_storage.open(name), content_type=content_type)
+    except FileNotFoundError:
+        raise Http404
+    response['X-Content-Type-Options'] = 'nosniff'
+    response['Cache-Control'] = f'private, max-age={settings.AVATAR_CACHE_MAX_AGE}'
+    return response
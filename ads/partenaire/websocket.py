@@ -0,0 +1,229 @@
+import asyncio
+import inspect
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http.cookie import parse_cookie
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView, instantiate_middleware
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast
+from graphql.execution import create_source_event_stream
+
+from .cost import check_query_cost
+from .jwt_auth import authenticate_request
+from .middleware import SyncResolverMiddleware
+from .persisted import PersistedQueryError, document_cache, register_query, resolve_persisted_query
+from .pubsub import SubscriptionOverflow
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL = 'graphql-transport-ws'
+
+
+def get_operation_type(document, operation_name):
+    operation_ast = get_operation_ast(document, operation_name)
+    return operation_ast.operation if operation_ast is not None else None
+
+
+class SubscriptionContext:
+    """Contexte des opérations d'une connexion WebSocket, à la place de la requête HTTP."""
+
+    def __init__(self, scope, payload):
+        self.path = scope['path']
+        self.META = {
+            'HTTP_' + name.decode('latin1').upper().replace('-', '_'): value.decode('latin1')
+            for name, value in scope.get('headers', [])
+        }
+        # Le navigateur ne peut pas ajouter d'en-tête à la connexion : jeton JWT dans connection_init
+        authorization = payload.get('Authorization') or payload.get('authorization')
+        if authorization:
+            self.META['HTTP_AUTHORIZATION'] = authorization
+        self.COOKIES = parse_cookie(self.META.get('HTTP_COOKIE', ''))
+        self.user = AnonymousUser()
+        self.loaders = None
+
+
+class _Connection:
+    """Une connexion graphql-transport-ws : une tâche par opération en cours."""
+
+    def __init__(self, scope, send):
+        self.scope = scope
+        self._send = send
+        self._send_lock = asyncio.Lock()
+        self.context = None
+        self.operations = {}
+        self.schema = graphene_settings.SCHEMA.graphql_schema
+        self.middleware = [SyncResolverMiddleware()] + list(instantiate_middleware(graphene_settings.MIDDLEWARE))
+
+    async def send(self, message):
+        async with self._send_lock:
+            await self._send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    async def close(self, code, reason):
+        async with self._send_lock:
+            await self._send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    async def run(self, receive):
+        try:
+            while True:
+                if self.context is None:
+                    try:
+                        event = await asyncio.wait_for(receive(), settings.SUBSCRIPTION_CONNECTION_INIT_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        await self.close(4408, "Connection initialisation timeout")
+                        return
+                else:
+                    event = await receive()
+                if event['type'] == 'websocket.disconnect':
+                    return
+                if event['type'] == 'websocket.receive' and not await self.handle(event.get('text') or ''):
+                    return
+        finally:
+            for task in self.operations.values():
+                task.cancel()
+
+    async def handle(self, text):
+        """Traite un message du client ; renvoie False si la connexion a été fermée."""
+        try:
+            message = json.loads(text)
+            kind = message['type']
+        except (ValueError, TypeError, KeyError):
+            await self.close(4400, "Invalid message")
+            return False
+
+        if kind == 'connection_init':
+            if self.context is not None:
+                await self.close(4429, "Too many initialisation requests")
+                return False
+            self.context = SubscriptionContext(self.scope, message.get('payload') or {})
+            # Jeton vérifié une fois pour toute la connexion ; sans jeton la connexion est anonyme,
+            # un jeton invalide ou expiré la refuse (les événements ne repassent pas par la
+            # vérification de JSONWebTokenMiddleware, limitée aux champs sans parent)
+            if isinstance(await sync_to_async(authenticate_request)(self.context), Exception):
+                await self.close(4403, "Forbidden")
+                return False
+            await self.send({'type': 'connection_ack'})
+        elif kind == 'ping':
+            await self.send({'type': 'pong'})
+        elif kind == 'pong':
+            pass
+        elif kind == 'subscribe':
+            if self.context is None:
+                await self.close(4401, "Unauthorized")
+                return False
+            operation_id = message.get('id')
+            if operation_id in self.operations:
+                await self.close(4409, f"Subscriber for {operation_id} already exists")
+                return False
+            task = asyncio.create_task(self.run_operation(operation_id, message.get('payload') or {}))
+            self.operations[operation_id] = task
+            task.add_done_callback(lambda done: self._forget(operation_id, done))
+        elif kind == 'complete':
+            task = self.operations.pop(message.get('id'), None)
+            if task is not None:
+                task.cancel()
+        else:
+            await self.close(4400, f"Unknown message type {kind}")
+            return False
+        return True
+
+    def _forget(self, operation_id, task):
+        # L'identifiant a pu être réutilisé après un `complete`
+        if self.operations.get(operation_id) is task:
+            del self.operations[operation_id]
+
+    async def run_operation(self, operation_id, payload):
+        try:
+            if not await self.execute_operation(operation_id, payload):
+                return  # message `error` déjà envoyé : pas de `complete`
+        except asyncio.CancelledError:
+            return  # `complete` du client ou connexion fermée : rien à envoyer
+        except SubscriptionOverflow as e:
+            await self.send({'id': operation_id, 'type': 'error', 'payload': [{'message': str(e)}]})
+            return
+        except Exception:
+            logger.exception("Échec de l'opération %s", operation_id)
+            await self.send({'id': operation_id, 'type': 'error', 'payload': [{'message': "Internal error"}]})
+            return
+        await self.send({'id': operation_id, 'type': 'complete'})
+
+    async def execute_operation(self, operation_id, payload):
+        """Exécute l'opération et envoie ses résultats ; renvoie False si elle a été refusée."""
+        variables, operation_name = payload.get('variables'), payload.get('operationName')
+        try:
+            # Même protocole et même liste d'autorisation que sur HTTP
+            query, digest, register = await sync_to_async(resolve_persisted_query)(
+                payload.get('query'), payload.get('extensions'),
+            )
+        except PersistedQueryError as e:
+            await self.send({'id': operation_id, 'type': 'error', 'payload': [{'message': str(e)}]})
+            return False
+        document, errors = document_cache.get_document(
+            self.schema, query or '', digest, max_errors=graphene_settings.MAX_VALIDATION_ERRORS,
+        )
+        if not errors and get_operation_type(document, operation_name) == OperationType.MUTATION:
+            # Les écritures passent par /graphql/ : serialized_writes, ATOMIC_MUTATIONS, cache
+            errors = [GraphQLError("Mutations non acceptées sur la connexion WebSocket : utiliser /graphql/.")]
+        if not errors:
+            try:
+                await sync_to_async(check_query_cost)(self.schema, document, operation_name, variables)
+            except GraphQLError as e:
+                errors = [e]
+        if errors:
+            await self.send({'id': operation_id, 'type': 'error', 'payload': [GraphQLView.format_error(e) for e in errors]})
+            return False
+        if register:
+            await sync_to_async(register_query)(digest, query)
+
+        if get_operation_type(document, operation_name) != OperationType.SUBSCRIPTION:
+            # Requête envoyée sur la connexion : un seul résultat
+            await self.send_result(operation_id, await self.execute(document, variables, operation_name))
+            return True
+
+        stream = await create_source_event_stream(
+            self.schema, document, context_value=self.context,
+            variable_values=variables, operation_name=operation_name,
+        )
+        if isinstance(stream, ExecutionResult):
+            await self.send({'id': operation_id, 'type': 'error', 'payload': [GraphQLView.format_error(e) for e in stream.errors]})
+            return False
+        try:
+            # Un événement n'est lu qu'une fois le précédent envoyé : un client lent laisse les
+            # changements s'accumuler (fusionnés) dans son Subscriber
+            async for event in stream:
+                await self.send_result(operation_id, await self.execute(document, variables, operation_name, event))
+        finally:
+            await stream.aclose()
+        return True
+
+    async def execute(self, document, variables, operation_name, root_value=None):
+        # create_source_event_stream ne passe pas par les middlewares : chaque événement est
+        # exécuté ici, avec SyncResolverMiddleware pour les resolvers qui lisent la base
+        result = execute(
+            self.schema, document, root_value=root_value, context_value=self.context,
+            variable_values=variables, operation_name=operation_name, middleware=self.middleware,
+        )
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def send_result(self, operation_id, result):
+        payload = {'data': result.data}
+        if result.errors:
+            payload['errors'] = [GraphQLView.format_error(error) for error in result.errors]
+        await self.send({'id': operation_id, 'type': 'next', 'payload': payload})
+
+
+async def websocket_application(scope, receive, send):
+    """Application ASGI des connexions WebSocket GraphQL (abonnements), sur SUBSCRIPTION_PATH."""
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    if scope['path'] != graphene_settings.SUBSCRIPTION_PATH or PROTOCOL not in scope.get('subprotocols', []):
+        await send({'type': 'websocket.close', 'code': 4406})
+        return
+    await send({'type': 'websocket.accept', 'subprotocol': PROTOCOL})
+    await _Connection(scope, send).run(receive)